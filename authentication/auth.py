@@ -4,9 +4,20 @@ from typing import Optional
 
 
 AUTH_KEY_CHECK = os.environ.get("AUTH_KEY")
+ADMIN_KEY_CHECK = os.environ.get("ADMIN_KEY")
 
 #Authorizes the user based on an API key sent in the header
 def get_api_key(x_api_key: Optional[str] = Header(None)):
     if not x_api_key or x_api_key != AUTH_KEY_CHECK:
         raise HTTPException(status_code=401, detail="Invalid API key.")
-    return x_api_key
\ No newline at end of file
+    return x_api_key
+
+#Admin key for debug features, always fails when ADMIN_KEY is not set
+def is_admin_key(key: Optional[str]) -> bool:
+    return bool(ADMIN_KEY_CHECK) and key == ADMIN_KEY_CHECK
+
+#Authorizes admin-only debug endpoints
+def get_admin_key(x_admin_key: Optional[str] = Header(None)):
+    if not is_admin_key(x_admin_key):
+        raise HTTPException(status_code=401, detail="Invalid admin key.")
+    return x_admin_key
@@ -0,0 +1,135 @@
+"""
+    In-memory clue -> word association graph built from stored puzzles.
+
+    Every stored clue with its board's selected flags is a confirmed association between
+    the clue and the selected words. Edge weights count how often a word was selected for
+    a clue, relative to how many boards used the clue.
+
+    Loaded at startup and kept up to date as clues are committed in this worker
+    (add_clue_to_selection and the write batcher call add()). Clues committed by other
+    workers are picked up by the periodic refresh(), which reads clues above the highest
+    id seen so far less ASSOC_RESCAN_IDS, so a clue committed late with a lower id (by
+    another worker or the write batcher) is still found. Clue ids in that window are
+    remembered so none is counted twice. After partition retention archives clues the graph is rebuilt from
+    the clues that are left (reset() then refresh()).
+"""
+from collections import defaultdict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import os
+from .models import Clue, WordConnection, WordConnectionWord, unpack_selection
+
+#An edge is strong when the word was selected at least ASSOC_MIN_COUNT times and on at
+#least ASSOC_MIN_WEIGHT of the boards that used the clue
+ASSOC_MIN_COUNT = int(os.environ.get("ASSOC_MIN_COUNT", 2))
+ASSOC_MIN_WEIGHT = float(os.environ.get("ASSOC_MIN_WEIGHT", 0.5))
+ASSOC_LOAD_BATCH = 10_000
+ASSOC_REFRESH_SECONDS = float(os.environ.get("ASSOC_REFRESH_SECONDS", 60))
+#Ids below the highest seen that every refresh reads again, for clues committed late
+ASSOC_RESCAN_IDS = int(os.environ.get("ASSOC_RESCAN_IDS", 1000))
+
+
+class AssociationGraph:
+    def __init__(self):
+        self.edges: dict[str, dict[int, int]] = defaultdict(dict)
+        self.clue_counts: dict[str, int] = defaultdict(int)
+        self.last_clue_id = 0
+        #Ids already counted that the next refresh() reads again
+        self._seen_ids: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.clue_counts)
+
+    def reset(self):
+        self.edges = defaultdict(dict)
+        self.clue_counts = defaultdict(int)
+        self.last_clue_id = 0
+        self._seen_ids = set()
+
+    def add(self, clue: str, selected_word_ids: list[int], clue_id: int | None = None):
+        if clue_id is not None:
+            if clue_id in self._seen_ids:
+                return
+            #Below the rescan window refresh() won't read it again
+            if clue_id > self._rescan_from():
+                self._seen_ids.add(clue_id)
+        key = clue.strip().lower()
+        self.clue_counts[key] += 1
+        edges = self.edges[key]
+        for word_id in selected_word_ids:
+            edges[word_id] = edges.get(word_id, 0) + 1
+
+    def weights(self, clue: str, word_ids: list[int]) -> list[float]:
+        key = clue.strip().lower()
+        total = self.clue_counts.get(key, 0)
+        edges = self.edges.get(key, {})
+        return [
+            edges.get(word_id, 0) / total if total and edges.get(word_id, 0) >= ASSOC_MIN_COUNT else 0.0
+            for word_id in word_ids
+        ]
+
+    def guess(self, list_of_word_objects: list, clue: str, num_words_to_select: int) -> list | None:
+        """
+            Same output as ai_guess_word, or None unless at least num_words_to_select
+            board words have a strong edge to the clue
+        """
+        weights = self.weights(clue, [word["id"] for word in list_of_word_objects])
+        ranked = sorted(range(len(weights)), key=lambda position: -weights[position])[:num_words_to_select]
+        if len(ranked) < num_words_to_select or any(weights[position] < ASSOC_MIN_WEIGHT for position in ranked):
+            return None
+        chosen = set(ranked)
+        return [{**word, "selected": position in chosen} for position, word in enumerate(list_of_word_objects)]
+
+    def _rescan_from(self) -> int:
+        return max(0, self.last_clue_id - ASSOC_RESCAN_IDS)
+
+    async def refresh(self, session: AsyncSession) -> int:
+        """
+            Read clues above last_clue_id - ASSOC_RESCAN_IDS. Returns the number added.
+        """
+        added = 0
+        after = self._rescan_from()
+        while True:
+            compact = await session.execute(
+                select(Clue.id, Clue.clue, WordConnection.word_ids, WordConnection.selected_mask, WordConnection.known_mask)
+                .join(WordConnection, WordConnection.id == Clue.connection_id)
+                .where(Clue.id > after)
+                .order_by(Clue.id)
+                .limit(ASSOC_LOAD_BATCH)
+            )
+            rows = compact.all()
+            if not rows:
+                break
+            #Boards from before the compact columns, selections come from the link rows
+            legacy_ids = [row.id for row in rows if row.word_ids is None]
+            legacy_selected = defaultdict(list)
+            if legacy_ids:
+                links = await session.execute(
+                    select(Clue.id, WordConnectionWord.word_id)
+                    .join(WordConnectionWord, WordConnectionWord.connection_id == Clue.connection_id)
+                    .where(Clue.id.in_(legacy_ids), WordConnectionWord.selected.is_(True))
+                )
+                for clue_id, word_id in links:
+                    legacy_selected[clue_id].append(word_id)
+
+            for row in rows:
+                if row.id not in self._seen_ids:
+                    if row.word_ids is None:
+                        selected = legacy_selected[row.id]
+                    else:
+                        flags = unpack_selection(row.selected_mask, row.known_mask, len(row.word_ids))
+                        selected = [word_id for word_id, flag in zip(row.word_ids, flags) if flag]
+                    self.add(row.clue, selected)
+                    self._seen_ids.add(row.id)
+                    added += 1
+            after = rows[-1].id
+            self.last_clue_id = max(self.last_clue_id, after)
+            rescan_from = self._rescan_from()
+            self._seen_ids = {clue_id for clue_id in self._seen_ids if clue_id > rescan_from}
+        return added
+
+    async def load(self, session: AsyncSession):
+        await self.refresh(session)
+
+
+association_graph = AssociationGraph()
@@ -0,0 +1,352 @@
+"""
+    Data-layer benchmarks for data/db_actions.py against a synthetic dataset.
+
+        python -m data.benchmark seed --words 100000 --boards 1000000
+        python -m data.benchmark run --iterations 200 --output bench.json
+        python -m data.benchmark compare baseline.json bench.json --tolerance 0.25
+
+    Uses the database from DATABASE_URL. `seed` empties words and every puzzle table
+    (data.maintenance.PUZZLE_TABLES), so it refuses to run unless the database name
+    contains "bench" (or --force is given).
+
+    The synthetic lexicon is word_list.txt plus generated words up to --words. Boards are
+    nine distinct random words with two to four selected, --clue-ratio of them have a clue,
+    spread over the last --months months of clue partitions. Everything is bulk loaded
+    with CSV COPY in chunks, each committed in its own transaction, so a 10M board load
+    never holds more than one chunk in memory or in a transaction. An interrupted seed
+    leaves the chunks loaded so far, run it again to start over.
+
+    `run` times every db_actions function and writes a JSON report (latency percentiles
+    and SQL statements per call). `compare` exits 1 when a function's p50 grew by more
+    than the tolerance or it runs more statements than the baseline, for CI.
+"""
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from sqlalchemy import text
+import argparse
+import asyncio
+import csv
+import io
+import json
+import platform
+import random
+import sys
+import time
+import numpy as np
+from .db import engine, SessionLocal
+from .db_setup import main as create_tables
+from .db_stats import track_queries
+from .partitions import ensure_clue_partitions
+from .maintenance import PUZZLE_TABLES
+from .models import BOARD_STORAGE, pack_selection
+from .db_actions import (
+    get_random_words,
+    get_words_by_text,
+    create_word_connection,
+    get_word_connection_by_id,
+    add_clue_to_selection,
+    get_clue_by_id,
+    get_clue_by_id_compact,
+    get_clues_by_ids,
+    get_clues_by_ids_compact,
+)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+COPY_CHUNK = 100_000
+BOARD_SIZE = 9
+BATCH_SIZE = 20
+REPORT_VERSION = 1
+
+
+async def _copy(raw, table: str, columns: list[str], rows):
+    """
+        COPY rows in as CSV, asyncpg has no binary encoder for citext columns
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+    await raw.copy_to_table(table, source=io.BytesIO(buffer.getvalue().encode("utf-8")), columns=columns, format="csv")
+
+
+def _lexicon(size: int, rng: np.random.Generator) -> list[str]:
+    with open(BASE_DIR / "word_list.txt", "r") as file:
+        words = [line.strip() for line in file if line.strip()]
+    seen = {word.lower() for word in words}
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    while len(words) < size:
+        #Random stem plus the running index keeps generated words unique
+        stem = "".join(rng.choice(letters, int(rng.integers(3, 8))))
+        word = f"{stem}{len(words)}"
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words[:size]
+
+
+def _random_boards(count: int, word_count: int, rng: np.random.Generator) -> np.ndarray:
+    """
+        (count, 9) word ids, distinct within each row
+    """
+    boards = rng.integers(1, word_count + 1, size=(count, BOARD_SIZE), dtype=np.int64)
+    while True:
+        ordered = np.sort(boards, axis=1)
+        duplicated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not duplicated.any():
+            return boards
+        boards[duplicated] = rng.integers(1, word_count + 1, size=(int(duplicated.sum()), BOARD_SIZE))
+
+
+def _random_selections(count: int, rng: np.random.Generator) -> np.ndarray:
+    """
+        (count, 9) bool, two to four words selected per board
+    """
+    selected_counts = rng.integers(2, 5, size=count)
+    ranks = np.argsort(rng.random((count, BOARD_SIZE)), axis=1)
+    return ranks < selected_counts[:, None]
+
+
+async def seed(words: int, boards: int, clue_ratio: float, months: int, seed_value: int, force: bool):
+    async with engine.connect() as conn:
+        database = (await conn.execute(text("SELECT current_database()"))).scalar()
+    if "bench" not in database and not force:
+        sys.exit(f"Refusing to empty database {database!r}, use a database with 'bench' in its name or --force")
+
+    engine.sync_engine.echo = False
+    await create_tables()
+    rng = np.random.default_rng(seed_value)
+    lexicon = _lexicon(words, rng)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    oldest = now - timedelta(days=30 * months)
+    started = time.perf_counter()
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"TRUNCATE words, {', '.join(PUZZLE_TABLES)} RESTART IDENTITY CASCADE"))
+        await ensure_clue_partitions(conn, start=oldest.date())
+        raw = (await conn.get_raw_connection()).driver_connection
+
+        await _copy(raw, "words", ["id", "word"], ((i + 1, word) for i, word in enumerate(lexicon)))
+        print("WORDS LOADED", len(lexicon), f"{time.perf_counter() - started:.1f}s")
+
+    clue_count = 0
+    span_seconds = (now - oldest).total_seconds()
+    for chunk_start in range(0, boards, COPY_CHUNK):
+        chunk = min(COPY_CHUNK, boards - chunk_start)
+        board_ids = np.arange(chunk_start + 1, chunk_start + chunk + 1)
+        word_ids = _random_boards(chunk, len(lexicon), rng)
+        selections = _random_selections(chunk, rng)
+        masks = [pack_selection(row) for row in selections.tolist()]
+
+        #One transaction per chunk, a single one for 10M boards would hold ~90M link rows
+        async with engine.begin() as conn:
+            raw = (await conn.get_raw_connection()).driver_connection
+            await _copy(
+                raw, "word_connections", ["id", "word_ids", "selected_mask", "known_mask"],
+                (
+                    (board_id, "{" + ",".join(map(str, row)) + "}", selected_mask, known_mask)
+                    for board_id, row, (selected_mask, known_mask) in zip(board_ids.tolist(), word_ids.tolist(), masks)
+                ),
+            )
+            if BOARD_STORAGE != "compact":
+                await _copy(
+                    raw, "word_connection_words", ["word_id", "connection_id", "selected"],
+                    zip(word_ids.ravel().tolist(), np.repeat(board_ids, BOARD_SIZE).tolist(), selections.ravel().tolist()),
+                )
+
+            with_clue = np.nonzero(rng.random(chunk) < clue_ratio)[0]
+            offsets = rng.random(with_clue.size) * span_seconds
+            clue_words = rng.integers(0, len(lexicon), size=with_clue.size)
+            selected_counts = selections.sum(axis=1)
+            await _copy(
+                raw, "clues", ["id", "clue", "clue_word_count", "created_at", "connection_id"],
+                (
+                    (clue_count + n + 1, lexicon[int(word)], int(selected_counts[i]), (oldest + timedelta(seconds=float(offset))).isoformat(), int(board_ids[i]))
+                    for n, (i, offset, word) in enumerate(zip(with_clue, offsets, clue_words))
+                ),
+            )
+        clue_count += with_clue.size
+        print("BOARDS LOADED", chunk_start + chunk, "CLUES", clue_count, f"{time.perf_counter() - started:.1f}s")
+
+    async with engine.begin() as conn:
+        for sequence, table in (("words_id_seq", "words"), ("word_connections_id_seq", "word_connections"), ("clues_id_seq", "clues")):
+            await conn.execute(text(f"SELECT setval('{sequence}', coalesce((SELECT max(id) FROM {table}), 1))"))
+
+    #Fresh planner statistics, otherwise the timings reflect plans for empty tables
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE"))
+    print("SEEDED", {"words": len(lexicon), "boards": boards, "clues": clue_count}, f"{time.perf_counter() - started:.1f}s")
+
+
+class Timings:
+    def __init__(self):
+        self.ms = []
+        self.statements = []
+
+    def summary(self) -> dict:
+        ms = np.asarray(self.ms)
+        return {
+            "iterations": len(self.ms),
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "max_ms": round(float(ms.max()), 3),
+            "sql_statements": max(self.statements),
+        }
+
+
+async def _timed(timings: Timings, call):
+    with track_queries() as stats:
+        started = time.perf_counter()
+        result = await call()
+        timings.ms.append((time.perf_counter() - started) * 1000)
+    timings.statements.append(stats.count)
+    return result
+
+
+async def _dataset_size() -> dict:
+    async with engine.connect() as conn:
+        #Planner estimates, exact counts take too long on large datasets
+        result = await conn.execute(text("""
+            SELECT relname, greatest(reltuples, 0)::bigint FROM pg_class
+            WHERE relname IN ('words', 'word_connections', 'word_connection_words')
+        """))
+        size = dict(result.all())
+        size["clues"] = (await conn.execute(text("SELECT coalesce(max(id), 0) FROM clues"))).scalar()
+    return size
+
+
+async def run(iterations: int, warmup: int, output: Path, seed_value: int):
+    engine.sync_engine.echo = False
+    rng = random.Random(seed_value)
+    size = await _dataset_size()
+    max_board = size.get("word_connections", 0)
+    max_clue = size["clues"]
+    if not max_board or not max_clue:
+        sys.exit("No boards or clues, run `python -m data.benchmark seed` first")
+
+    timings = {name: Timings() for name in (
+        "get_random_words",
+        "get_words_by_text",
+        "create_word_connection",
+        "add_clue_to_selection",
+        "get_word_connection_by_id",
+        "get_clue_by_id",
+        "get_clue_by_id_compact",
+        "get_clues_by_ids",
+        "get_clues_by_ids_compact",
+    )}
+
+    for iteration in range(warmup + iterations):
+        if iteration == warmup:
+            for timing in timings.values():
+                timing.ms.clear()
+                timing.statements.clear()
+        #A fresh session per call, like a request
+        async with SessionLocal() as session:
+            words = await _timed(timings["get_random_words"], lambda: get_random_words(session, BOARD_SIZE))
+        async with SessionLocal() as session:
+            await _timed(timings["get_words_by_text"], lambda: get_words_by_text(session, [word.word for word in words]))
+
+        flags = [False] * BOARD_SIZE
+        for position in rng.sample(range(BOARD_SIZE), 3):
+            flags[position] = True
+        async with SessionLocal() as session:
+            connection = await _timed(timings["create_word_connection"], lambda: create_word_connection(session, words))
+        selection = [{"word_id": word.id, "selected": flag} for word, flag in zip(words, flags)]
+        async with SessionLocal() as session:
+            await _timed(timings["add_clue_to_selection"], lambda: add_clue_to_selection(session, connection.id, selection, "bench", 3))
+
+        board_id = rng.randint(1, max_board)
+        clue_id = rng.randint(1, max_clue)
+        async with SessionLocal() as session:
+            await _timed(timings["get_word_connection_by_id"], lambda: get_word_connection_by_id(session, board_id))
+        async with SessionLocal() as session:
+            await _timed(timings["get_clue_by_id"], lambda: get_clue_by_id(session, clue_id))
+        async with SessionLocal() as session:
+            await _timed(timings["get_clue_by_id_compact"], lambda: get_clue_by_id_compact(session, clue_id))
+        #A history screen's worth of clues
+        clue_ids = [rng.randint(1, max_clue) for _ in range(BATCH_SIZE)]
+        async with SessionLocal() as session:
+            await _timed(timings["get_clues_by_ids"], lambda: get_clues_by_ids(session, clue_ids))
+        async with SessionLocal() as session:
+            await _timed(timings["get_clues_by_ids_compact"], lambda: get_clues_by_ids_compact(session, clue_ids))
+
+    async with engine.connect() as conn:
+        server_version = (await conn.execute(text("SHOW server_version"))).scalar()
+    report = {
+        "version": REPORT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "postgres": server_version,
+            "board_storage": BOARD_STORAGE,
+        },
+        "dataset": size,
+        "results": {name: timing.summary() for name, timing in timings.items()},
+    }
+    output.write_text(json.dumps(report, indent=2))
+    for name, result in report["results"].items():
+        print(f"{name:>26}: p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  {result['sql_statements']} statements")
+    print("REPORT WRITTEN", output)
+    print("NOTE benchmark boards use the clue 'bench' and can be removed afterwards")
+
+
+def compare(baseline_path: Path, report_path: Path, tolerance: float) -> int:
+    baseline = json.loads(baseline_path.read_text())
+    report = json.loads(report_path.read_text())
+    if baseline.get("dataset") != report.get("dataset"):
+        print("WARNING DATASETS DIFFER", baseline.get("dataset"), report.get("dataset"))
+
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:>26}: new")
+            continue
+        ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else 1.0
+        status = "ok"
+        if ratio > 1 + tolerance:
+            status = "SLOWER"
+            regressions.append(name)
+        if result["sql_statements"] > base["sql_statements"]:
+            status = "MORE QUERIES"
+            regressions.append(name)
+        print(f"{name:>26}: p50 {base['p50_ms']:8.2f} -> {result['p50_ms']:8.2f}ms ({ratio:5.2f}x)  "
+              f"statements {base['sql_statements']} -> {result['sql_statements']}  {status}")
+    if regressions:
+        print("REGRESSIONS", sorted(set(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-layer benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="Fill the database with a synthetic dataset")
+    seed_parser.add_argument("--words", type=int, default=100_000)
+    seed_parser.add_argument("--boards", type=int, default=10_000)
+    seed_parser.add_argument("--clue-ratio", type=float, default=0.8)
+    seed_parser.add_argument("--months", type=int, default=12)
+    seed_parser.add_argument("--seed", type=int, default=0)
+    seed_parser.add_argument("--force", action="store_true", help="Allow a database without 'bench' in its name")
+
+    run_parser = subparsers.add_parser("run", help="Time the db_actions functions")
+    run_parser.add_argument("--iterations", type=int, default=200)
+    run_parser.add_argument("--warmup", type=int, default=20)
+    run_parser.add_argument("--output", type=Path, default=Path("bench.json"))
+    run_parser.add_argument("--seed", type=int, default=0)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare a report against a baseline")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("report", type=Path)
+    compare_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p50 growth, 0.25 = 25%%")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        asyncio.run(seed(args.words, args.boards, args.clue_ratio, args.months, args.seed, args.force))
+    elif args.command == "run":
+        asyncio.run(run(args.iterations, args.warmup, args.output, args.seed))
+    elif args.command == "compare":
+        sys.exit(compare(args.baseline, args.report, args.tolerance))
@@ -0,0 +1,68 @@
+"""
+    In-process LRU of clue responses, clue_id -> AIClueWithSelectedWordsSchema.
+
+    A stored clue never changes, so an entry is valid for as long as the clue exists.
+    Filled by /getclueresponsefromid, /clues/batch and when a clue is generated, and
+    read before going to the database. Clues archived by partition retention are
+    dropped by drop_below() when the association graph refresh sees the oldest stored
+    clue id move.
+"""
+from collections import OrderedDict
+import os
+from services.metrics import Counter
+
+CLUE_CACHE_SIZE = int(os.environ.get("CLUE_CACHE_SIZE", 10_000))
+
+CLUE_CACHE_REQUESTS = Counter("clue_cache_requests_total", "Clue response cache lookups, by result")
+
+
+class ClueResponseCache:
+    def __init__(self, size: int = CLUE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        #Ids below this have been archived
+        self.floor = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, clue_id: int):
+        response = self.entries.get(clue_id)
+        if response is None:
+            CLUE_CACHE_REQUESTS.inc(result="miss")
+            return None
+        CLUE_CACHE_REQUESTS.inc(result="hit")
+        self.entries.move_to_end(clue_id)
+        return response
+
+    def get_many(self, clue_ids: list[int]) -> dict:
+        """
+            {clue_id: response} for the ids that are cached
+        """
+        found = {}
+        for clue_id in dict.fromkeys(clue_ids):
+            if (response := self.get(clue_id)) is not None:
+                found[clue_id] = response
+        return found
+
+    def put(self, clue_id: int, response):
+        if self.size <= 0 or clue_id < self.floor:
+            return
+        self.entries[clue_id] = response
+        self.entries.move_to_end(clue_id)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def drop_below(self, floor: int) -> bool:
+        """
+            Forget clues with ids below floor. Returns whether the floor moved.
+        """
+        if floor <= self.floor:
+            return False
+        self.floor = floor
+        for clue_id in [clue_id for clue_id in self.entries if clue_id < floor]:
+            del self.entries[clue_id]
+        return True
+
+
+clue_cache = ClueResponseCache()
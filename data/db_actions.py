@@ -2,14 +2,16 @@ from typing import List
 from pydantic import BaseModel
 from sqlalchemy.future import select
 from sqlalchemy.exc import IntegrityError
-from .models import WordConnectionWord, WordConnection,Word, Clue
-from .db import engine
+from .models import WordConnectionWord, WordConnection,Word, Clue, SeededPuzzle, IdempotencyKey, ClueAlternate, pack_selection, BOARD_STORAGE
+from .db import engine, read_only
+from .association_graph import association_graph
 import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker, selectinload, joinedload
-from sqlalchemy import select, func
+from sqlalchemy import select, func, delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
 
@@ -33,6 +35,7 @@ async def add_words(session: AsyncSession, word_list: list[str]) -> int:
             await session.rollback()  # word already exists, skip it
     return added_count
 
+@read_only
 async def get_random_words(session: AsyncSession, count: int = 9) -> list[Word]:
     """
     Fetch `count` random words from the words table.
@@ -45,6 +48,18 @@ async def get_random_words(session: AsyncSession, count: int = 9) -> list[Word]:
     )
     return result.scalars().all()
 
+@read_only
+async def get_words_by_text(session: AsyncSession, words: list[str]) -> list[Word]:
+    """
+    Fetch Word objects for a list of word strings.
+    Returns them in the same order as `words`, skipping any that are not in the table.
+    """
+    result = await session.execute(
+        select(Word).where(Word.word.in_(words))
+    )
+    words_by_text = {word.word.lower(): word for word in result.scalars().all()}
+    return [words_by_text[w.lower()] for w in words if w.lower() in words_by_text]
+
 async def create_word_connection(
     session: AsyncSession,
     words: list[Word],
@@ -56,23 +71,30 @@ async def create_word_connection(
         raise ValueError("selected_flags must be the same length as words")
 
     # Create the WordConnection
-    connection = WordConnection()
+    selected_mask, known_mask = pack_selection(selected_flags)
+    connection = WordConnection(
+        word_ids=[word.id for word in words],
+        selected_mask=selected_mask,
+        known_mask=known_mask,
+    )
     session.add(connection)
     await session.flush()  # assign id
 
     # Add WordConnectionWord rows
-    for word, selected in zip(words, selected_flags):
-        wcw = WordConnectionWord(
-            word_id=word.id,
-            connection_id=connection.id,
-            selected=selected  # now can be None
-        )
-        session.add(wcw)
+    if BOARD_STORAGE != "compact":
+        for word, selected in zip(words, selected_flags):
+            wcw = WordConnectionWord(
+                word_id=word.id,
+                connection_id=connection.id,
+                selected=selected  # now can be None
+            )
+            session.add(wcw)
 
     await session.commit()
     await session.refresh(connection)
     return connection
 
+@read_only
 async def get_word_connection_by_id(
     session: AsyncSession,
     connection_id: int
@@ -97,6 +119,33 @@ async def get_word_connection_by_id(
     connection = result.scalars().first()
     return connection
 
+@read_only
+async def get_board_word_ids(
+    session: AsyncSession,
+    connection_id: int
+) -> list[int] | None:
+    """
+    Word ids of a board, from the compact column in board order, or from the link rows.
+    Link rows don't store a position, those boards come back ordered by word id so
+    the same board always hydrates the same way.
+    Returns None if the board does not exist.
+    """
+    result = await session.execute(
+        select(WordConnection.id, WordConnection.word_ids)
+        .where(WordConnection.id == connection_id)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    if row.word_ids is not None:
+        return list(row.word_ids)
+    result = await session.execute(
+        select(WordConnectionWord.word_id)
+        .where(WordConnectionWord.connection_id == connection_id)
+        .order_by(WordConnectionWord.word_id)
+    )
+    return list(result.scalars().all())
+
 def valid_clue_text(clue_text):
     clue_text = clue_text.strip()
 
@@ -128,7 +177,7 @@ async def add_clue_to_selection(
     result = await session.execute(
         select(WordConnection)
         .where(WordConnection.id == selection_id)
-        .options(selectinload(WordConnection.word_links))
+        .options(selectinload(WordConnection.word_links), selectinload(WordConnection.clue))
     )
 
     word_connection = result.scalar_one_or_none()
@@ -140,11 +189,16 @@ async def add_clue_to_selection(
     if word_connection.clue:
         raise ValueError("A clue already exists for this selection")
 
-    # 2️⃣ Build lookup of links
+    # 2️⃣ Build lookup of links (and positions in the compact layout)
     word_links_by_id = {
         link.word_id: link
         for link in word_connection.word_links
     }
+    compact_positions = {
+        word_id: position
+        for position, word_id in enumerate(word_connection.word_ids or [])
+    }
+    compact_flags = word_connection.selected_flags()
 
     true_count = 0
 
@@ -153,14 +207,20 @@ async def add_clue_to_selection(
         word_id = item["word_id"]
         selected_value = item.get("selected")
 
-        if word_id not in word_links_by_id:
+        if word_id not in word_links_by_id and word_id not in compact_positions:
             raise ValueError(f"Word {word_id} not part of this selection")
 
-        word_links_by_id[word_id].selected = selected_value
+        if word_id in word_links_by_id:
+            word_links_by_id[word_id].selected = selected_value
+        if word_id in compact_positions:
+            compact_flags[compact_positions[word_id]] = selected_value
 
         if selected_value is True:
             true_count += 1
 
+    if word_connection.word_ids is not None:
+        word_connection.selected_mask, word_connection.known_mask = pack_selection(compact_flags)
+
     # 4️⃣ Validate count matches expected
     if true_count != clue_word_count:
         raise ValueError(
@@ -182,8 +242,14 @@ async def add_clue_to_selection(
     # 6️⃣ Commit atomically
     await session.commit()
     await session.refresh(new_clue)
+    association_graph.add(
+        new_clue.clue,
+        [item["word_id"] for item in selection_list if item.get("selected") is True],
+        clue_id=new_clue.id,
+    )
     return new_clue
 
+@read_only
 async def get_clue_by_id(
     session: AsyncSession,
     clue_id: int,
@@ -201,6 +267,235 @@ async def get_clue_by_id(
 
     return result.scalar_one_or_none()
 
+@read_only
+async def get_clue_by_id_compact(
+    session: AsyncSession,
+    clue_id: int,
+) -> Clue | None:
+    """
+    Fetch a Clue and its board's compact columns in a single query.
+    The words are hydrated by the caller from data.word_index.
+    Returns None for boards that have no compact columns yet.
+    """
+    result = await session.execute(
+        select(Clue)
+        .where(Clue.id == clue_id)
+        .options(
+            joinedload(Clue.connection).load_only(
+                WordConnection.id,
+                WordConnection.word_ids,
+                WordConnection.selected_mask,
+                WordConnection.known_mask,
+            )
+        )
+    )
+    clue = result.scalar_one_or_none()
+    if clue is None or clue.connection is None or clue.connection.word_ids is None:
+        return None
+    return clue
+
+@read_only
+async def get_clues_by_ids(
+    session: AsyncSession,
+    clue_ids: list[int],
+) -> dict[int, Clue]:
+    """
+    Fetch many Clues with their boards' link rows and words, one query per level
+    for the whole batch. Returns {clue_id: Clue} for the ids that exist.
+    """
+    if not clue_ids:
+        return {}
+    result = await session.execute(
+        select(Clue)
+        .where(Clue.id.in_(set(clue_ids)))
+        .options(
+            selectinload(Clue.connection)
+                .selectinload(WordConnection.word_links)
+                .selectinload(WordConnectionWord.word)
+        )
+    )
+    return {clue.id: clue for clue in result.scalars()}
+
+@read_only
+async def get_clues_by_ids_compact(
+    session: AsyncSession,
+    clue_ids: list[int],
+) -> dict[int, Clue]:
+    """
+    Fetch many Clues and their boards' compact columns in a single query.
+    Clues whose board has no compact columns yet are left out.
+    """
+    if not clue_ids:
+        return {}
+    result = await session.execute(
+        select(Clue)
+        .where(Clue.id.in_(set(clue_ids)))
+        .options(
+            joinedload(Clue.connection).load_only(
+                WordConnection.id,
+                WordConnection.word_ids,
+                WordConnection.selected_mask,
+                WordConnection.known_mask,
+            )
+        )
+    )
+    return {
+        clue.id: clue for clue in result.scalars()
+        if clue.connection is not None and clue.connection.word_ids is not None
+    }
+
+async def add_clue_alternates(session: AsyncSession, clue_id: int, word_ids: list[int], alternates: list[dict]) -> int:
+    """
+    Keep the other valid candidates of a clue call, alternates are [{clue, selected_words}]
+    in rank order. Returns the number stored.
+    """
+    rows = []
+    for rank, alternate in enumerate(alternates, start=1):
+        selected_word_ids = [word["id"] for word in alternate["selected_words"] if word.get("selected") is True]
+        rows.append({
+            "clue_id": clue_id,
+            "board_key": sorted(word_ids),
+            "rank": rank,
+            "clue": alternate["clue"].strip(),
+            "clue_word_count": len(selected_word_ids),
+            "selected_word_ids": selected_word_ids,
+        })
+    if not rows:
+        return 0
+    await session.execute(pg_insert(ClueAlternate).values(rows))
+    await session.commit()
+    return len(rows)
+
+@read_only
+async def get_clue_alternates(session: AsyncSession, clue_id: int) -> list[ClueAlternate]:
+    result = await session.execute(
+        select(ClueAlternate)
+        .where(ClueAlternate.clue_id == clue_id)
+        .order_by(ClueAlternate.rank)
+    )
+    return list(result.scalars().all())
+
+async def take_clue_alternate(session: AsyncSession, word_ids: list[int]) -> ClueAlternate | None:
+    """
+    Claim the best unused alternate for a board, None when there is none.
+    Concurrent replays of the board get different alternates.
+    """
+    best = (
+        select(ClueAlternate.id)
+        .where(ClueAlternate.board_key == sorted(word_ids), ClueAlternate.used_at.is_(None))
+        .order_by(ClueAlternate.clue_id.desc(), ClueAlternate.rank)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(ClueAlternate)
+        .where(ClueAlternate.id == best)
+        .values(used_at=func.current_timestamp())
+        .returning(ClueAlternate)
+    )
+    alternate = result.scalar_one_or_none()
+    await session.commit()
+    return alternate
+
+async def get_seeded_puzzle(session: AsyncSession, seed: str) -> SeededPuzzle | None:
+    result = await session.execute(
+        select(SeededPuzzle).where(SeededPuzzle.seed == seed)
+    )
+    return result.scalar_one_or_none()
+
+async def count_recent_seeded_puzzles(session: AsyncSession, interval: timedelta) -> int:
+    """
+    Seeded puzzles stored in the last `interval`, by the database clock
+    """
+    result = await session.execute(
+        select(func.count())
+        .select_from(SeededPuzzle)
+        .where(SeededPuzzle.created_at >= func.current_timestamp() - interval)
+    )
+    return result.scalar()
+
+async def delete_word_connection(session: AsyncSession, connection_id: int):
+    """
+    Delete a board, its link rows and clue go with it (ON DELETE CASCADE)
+    """
+    await session.execute(delete(WordConnection).where(WordConnection.id == connection_id))
+    await session.commit()
+
+async def add_seeded_puzzle(session: AsyncSession, seed: str, clue_id: int, response_json: str) -> bool:
+    """
+    Store the response for a seed. Returns False if another worker stored one first.
+    """
+    result = await session.execute(
+        pg_insert(SeededPuzzle)
+        .values(seed=seed, clue_id=clue_id, response_json=response_json)
+        .on_conflict_do_nothing(index_elements=["seed"])
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+async def claim_idempotency_key(session: AsyncSession, key: str, fingerprint: str, pending_seconds: float) -> tuple[bool, IdempotencyKey | None]:
+    """
+    Claim a key for a new attempt.
+    Returns (True, None) if this caller owns the attempt, otherwise (False, existing row).
+    Expired rows (including pending ones whose worker died) are taken over.
+    """
+    now = func.current_timestamp()
+    await session.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.key == key, IdempotencyKey.expires_at < now)
+    )
+    result = await session.execute(
+        pg_insert(IdempotencyKey)
+        .values(key=key, fingerprint=fingerprint, status="pending", expires_at=now + timedelta(seconds=pending_seconds))
+        .on_conflict_do_nothing(index_elements=["key"])
+    )
+    await session.commit()
+    if result.rowcount == 1:
+        return True, None
+    return False, await get_idempotency_key(session, key)
+
+async def get_idempotency_key(session: AsyncSession, key: str) -> IdempotencyKey | None:
+    result = await session.execute(
+        select(IdempotencyKey).where(IdempotencyKey.key == key)
+    )
+    return result.scalar_one_or_none()
+
+async def complete_idempotency_key(session: AsyncSession, key: str, status: int, headers: str, body: str, ttl_seconds: float):
+    await session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key)
+        .values(
+            status="done",
+            response_status=status,
+            response_headers=headers,
+            response_body=body,
+            expires_at=func.current_timestamp() + timedelta(seconds=ttl_seconds),
+        )
+    )
+    await session.commit()
+
+async def release_idempotency_key(session: AsyncSession, key: str):
+    """
+    Forget a failed attempt so a retry runs again
+    """
+    await session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+    await session.commit()
+
+async def delete_expired_idempotency_keys(session: AsyncSession, max_keys: int) -> int:
+    """
+    Delete expired keys, then the oldest ones beyond max_keys. Returns the number deleted.
+    """
+    expired = await session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at < func.current_timestamp())
+    )
+    keep = select(IdempotencyKey.key).order_by(IdempotencyKey.created_at.desc()).limit(max_keys)
+    overflow = await session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.key.not_in(keep))
+    )
+    await session.commit()
+    return expired.rowcount + overflow.rowcount
+
 
 async def main():
     BASE_DIR = Path(__file__).resolve().parent.parent
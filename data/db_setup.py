@@ -6,14 +6,22 @@
 
 #word selection - Links 9 words
 
-#Guess - word selection with guess word
+#Guess - word selection with guess word (guesses, written by data/guess_writer.py)
 
-#Clue - word selection with clue word
+#Clue - word selection with clue word (monthly partitions, see data/partitions.py)
+
+#Seeded puzzle - daily / seeded board with its stored response
+
+#Idempotency key - stored response of an AI-backed POST retried with the same key
+
+#Clue alternate - other valid clues the model gave for a board
 
 import asyncio
 from .db import engine, Base
-from .models import WordConnectionWord, WordConnection,Word, Clue
+from .models import WordConnectionWord, WordConnection,Word, Clue, Guess, SeededPuzzle, IdempotencyKey, ClueAlternate
 from sqlalchemy import text
+from .partitions import ensure_clue_partitions
+from .maintenance import ensure_maintenance_columns
 
 
 async def main():
@@ -22,6 +30,9 @@ async def main():
         await conn.execute(
             text("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
         )
+        await ensure_clue_partitions(conn)
+        #Columns and indexes added since the tables were first created
+        await ensure_maintenance_columns(conn)
 
         
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""
+    SQL statement counting and timing through SQLAlchemy engine events.
+
+    Statements are attributed to whatever SqlStats is active in the current context
+    (set per request by the profiling middleware), and to any process-wide collectors
+    opened with query_budget() in tests.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+import time
+
+MAX_RECORDED_STATEMENTS = 200
+
+
+class SqlStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = []
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append({"sql": " ".join(statement.split()), "ms": round(elapsed_ms, 3)})
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "statements": self.statements,
+        }
+
+
+_current_stats: ContextVar[SqlStats | None] = ContextVar("sql_stats", default=None)
+_global_collectors: list[SqlStats] = []
+
+#Transactions committed by this process, across all engines
+commit_count = 0
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block of code runs more SQL statements than its budget allows."""
+
+    def __init__(self, budget: int, stats: SqlStats):
+        self.budget = budget
+        self.stats = stats
+        statements = "\n".join(f"  {s['sql']}" for s in stats.statements)
+        super().__init__(f"Query budget of {budget} exceeded, {stats.count} statements ran:\n{statements}")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    stats = _current_stats.get()
+    if stats is None and not _global_collectors:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if stats is not None:
+        stats.record(statement, elapsed_ms)
+    for collector in _global_collectors:
+        collector.record(statement, elapsed_ms)
+
+
+def _handle_error(exception_context):
+    #Failed statements never reach after_cursor_execute, drop their start time
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def _commit(conn):
+    global commit_count
+    commit_count += 1
+
+
+def attach_query_listeners(engine):
+    """
+        Register the counting listeners on an (async) engine
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+    event.listen(sync_engine, "commit", _commit)
+
+
+@contextmanager
+def track_queries():
+    """
+        Collect statements run in the current context (task and anything it awaits)
+    """
+    stats = SqlStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries: int):
+    """
+        Test helper, fails if the block runs more than `max_queries` statements.
+        Collects process-wide so it also sees queries from a TestClient's app thread.
+
+            with query_budget(4):
+                client.get("/getclueresponsefromid?clue_id=1", headers=headers)
+    """
+    stats = SqlStats()
+    _global_collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        _global_collectors.remove(stats)
+    if stats.count > max_queries:
+        raise QueryBudgetExceeded(max_queries, stats)
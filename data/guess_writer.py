@@ -0,0 +1,162 @@
+"""
+    Write-behind persistence of AI guesses.
+
+    /guessselection calls record_guess() which only puts the row on a bounded queue, so
+    the guess response is never held up by the database. A GuessWriter (see Batcher in
+    write_batcher.py) inserts queued rows in batches.
+
+    Overflow: when GUESS_QUEUE_MAX rows are waiting, new guesses are dropped (not the
+    queued ones) and counted in guess_writes_dropped_total{reason="queue_full"}.
+    Errors: a batch that failed because of the database (lost connection, timeout) is
+    retried GUESS_RETRIES times, waiting GUESS_RETRY_SECONDS and doubling, with at most
+    GUESS_QUEUE_MAX rows waiting for a retry (reason="retry_full" beyond that). Rows
+    that still can't be written are counted in reason="flush_error".
+    Shutdown: stop() flushes everything still queued, waiting up to GUESS_FLUSH_TIMEOUT seconds.
+"""
+from sqlalchemy import insert, select
+from .db import SessionLocal
+from .models import Guess, WordConnection, Clue
+from .write_batcher import Batcher, is_transient, BATCH_FLUSHES, BATCH_ITEMS
+from services.metrics import Counter
+import asyncio
+import os
+
+GUESS_BATCH_MAX_ITEMS = int(os.environ.get("GUESS_BATCH_MAX_ITEMS", 100))
+GUESS_BATCH_INTERVAL_MS = float(os.environ.get("GUESS_BATCH_INTERVAL_MS", 200))
+GUESS_QUEUE_MAX = int(os.environ.get("GUESS_QUEUE_MAX", 10000))
+GUESS_FLUSH_TIMEOUT = float(os.environ.get("GUESS_FLUSH_TIMEOUT", 10))
+GUESS_RETRIES = int(os.environ.get("GUESS_RETRIES", 5))
+#First wait before a retry, doubled after each failed one
+GUESS_RETRY_SECONDS = float(os.environ.get("GUESS_RETRY_SECONDS", 0.5))
+
+GUESSES_QUEUED = Counter("guess_writes_queued_total", "AI guesses queued for writing")
+GUESSES_DROPPED = Counter("guess_writes_dropped_total", "AI guesses not written, by reason")
+
+
+class GuessWriter(Batcher):
+
+    name = "guesses"
+
+    def __init__(self, max_items: int, interval_ms: float, max_queue: int = 0):
+        super().__init__(max_items, interval_ms, max_queue)
+        #Rows waiting for a retry and the tasks retrying them
+        self.retrying = 0
+        self._retry_tasks: set[asyncio.Task] = set()
+
+    def record(self, row: dict) -> bool:
+        """
+            Queue a guess row without waiting. Returns False if it was dropped.
+        """
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            GUESSES_DROPPED.inc(reason="queue_full")
+            return False
+        GUESSES_QUEUED.inc()
+        return True
+
+    async def flush(self, rows: list[dict]):
+        async with SessionLocal() as session:
+            async with session.begin():
+                #Ids come from the client, drop references that don't exist rather than fail the batch
+                connection_ids = {row["connection_id"] for row in rows if row.get("connection_id")}
+                clue_ids = {row["clue_id"] for row in rows if row.get("clue_id")}
+                known_connections = set()
+                known_clues = set()
+                if connection_ids:
+                    result = await session.execute(select(WordConnection.id).where(WordConnection.id.in_(connection_ids)))
+                    known_connections = set(result.scalars().all())
+                if clue_ids:
+                    result = await session.execute(select(Clue.id).where(Clue.id.in_(clue_ids)))
+                    known_clues = set(result.scalars().all())
+                values = [
+                    {
+                        **row,
+                        "connection_id": row.get("connection_id") if row.get("connection_id") in known_connections else None,
+                        "clue_id": row.get("clue_id") if row.get("clue_id") in known_clues else None,
+                    }
+                    for row in rows
+                ]
+                await session.execute(insert(Guess).values(values))
+
+    def failed(self, rows: list[dict], error: Exception):
+        if not is_transient(error):
+            #The row itself can't be written, trying again won't change that
+            GUESSES_DROPPED.inc(len(rows), reason="flush_error")
+            return
+        if self.queue.maxsize and self.retrying + len(rows) > self.queue.maxsize:
+            GUESSES_DROPPED.inc(len(rows), reason="retry_full")
+            return
+        self.retrying += len(rows)
+        task = asyncio.create_task(self._retry(rows))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _retry(self, rows: list[dict]):
+        #Rows of this task still counted in self.retrying
+        waiting = len(rows)
+        try:
+            for attempt in range(GUESS_RETRIES):
+                await asyncio.sleep(GUESS_RETRY_SECONDS * 2 ** attempt)
+                try:
+                    await self.flush(rows)
+                except Exception as e:
+                    print("GUESS WRITE RETRY FAILED", attempt + 1, len(rows), e)
+                    if not is_transient(e):
+                        #The database is back, let the batcher find the bad rows. Halves that
+                        #fail again come back through failed(), which counts them anew
+                        self.retrying -= waiting
+                        waiting = 0
+                        await self._flush(rows)
+                        return
+                    continue
+                BATCH_FLUSHES.inc(batcher=self.name)
+                BATCH_ITEMS.inc(len(rows), batcher=self.name)
+                return
+            GUESSES_DROPPED.inc(len(rows), reason="flush_error")
+        except asyncio.CancelledError:
+            GUESSES_DROPPED.inc(len(rows), reason="shutdown")
+            raise
+        finally:
+            self.retrying -= waiting
+
+    async def stop(self, timeout: float = 10):
+        """
+            Flush the queue, then give pending retries what is left of the timeout
+        """
+        started = asyncio.get_running_loop().time()
+        await super().stop(timeout)
+        if self._retry_tasks:
+            remaining = max(0.0, timeout - (asyncio.get_running_loop().time() - started))
+            _, pending = await asyncio.wait(set(self._retry_tasks), timeout=remaining)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+guess_writer = GuessWriter(GUESS_BATCH_MAX_ITEMS, GUESS_BATCH_INTERVAL_MS, max_queue=GUESS_QUEUE_MAX)
+
+
+def record_guess(
+    word_objects: list,
+    ai_selection: list,
+    clue: str,
+    number_of_selected_words: int,
+    usage: dict,
+    connection_id: int | None = None,
+    clue_id: int | None = None,
+) -> bool:
+    #Map the AI's selection back to ids through the board words, the AI output isn't trusted for ids
+    selected_words = {word["word"] for word in ai_selection if word.get("selected")}
+    return guess_writer.record({
+        "connection_id": connection_id,
+        "clue_id": clue_id,
+        "clue": clue,
+        "number_of_selected_words": number_of_selected_words,
+        "word_ids": [word["id"] for word in word_objects],
+        "selected_word_ids": [word["id"] for word in word_objects if word["word"] in selected_words],
+        "model": usage.get("model"),
+        "latency_ms": usage.get("latency_ms"),
+        "input_tokens": usage.get("input_tokens"),
+        "output_tokens": usage.get("output_tokens"),
+    })
@@ -0,0 +1,281 @@
+"""
+    Maintenance of the puzzle tables: the orphan reaper and targeted VACUUM / ANALYZE.
+
+        python -m data.maintenance migrate       # add word_connections.created_at and the indexes
+        python -m data.maintenance reap          # delete orphaned boards now
+        python -m data.maintenance reap --dry-run
+        python -m data.maintenance alternates    # delete used and expired clue alternates
+        python -m data.maintenance vacuum        # VACUUM / ANALYZE the tables that need it
+        python -m data.maintenance run           # both, like the scheduled job
+
+    A board (word_connections row and its word_connection_words rows) is orphaned when its
+    clue was never stored: add_clue_to_selection raised or the request was cancelled
+    after create_word_connection committed. Boards without a clue or a guess that are
+    older than ORPHAN_MIN_AGE_SECONDS are deleted, ORPHAN_BATCH ids at a time, walking
+    the id range from where the last run stopped. The link rows go with them
+    (ON DELETE CASCADE). The reaper shares the partition retention job's lock and does
+    nothing while a detached clue partition is waiting to be archived.
+
+    Clue alternates are deleted CLUE_ALTERNATE_USED_SECONDS after they were served and
+    CLUE_ALTERNATE_MAX_AGE_SECONDS after they were stored if they never were. Those of
+    archived clues go with their partition (data/partitions.py).
+
+    After that, tables whose dead tuples or changes since the last analyze passed
+    VACUUM_DEAD_RATIO / ANALYZE_CHANGE_RATIO of their live rows are vacuumed / analyzed,
+    one table at a time, instead of leaving everything to autovacuum's schedule.
+
+    Every run prints what it reclaimed and how long it took, the same numbers are on
+    /metrics (maintenance_*).
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import argparse
+import asyncio
+import os
+import time
+from .db import engine
+from .partitions import list_detached_partitions, partition_lock
+from services.metrics import Counter, Gauge
+
+ORPHAN_MIN_AGE_SECONDS = float(os.environ.get("ORPHAN_MIN_AGE_SECONDS", 3600))
+#Ids examined per delete, each batch is its own transaction
+ORPHAN_BATCH = int(os.environ.get("ORPHAN_BATCH", 5000))
+#Batches per run, the next run continues from there
+ORPHAN_MAX_BATCHES = int(os.environ.get("ORPHAN_MAX_BATCHES", 200))
+VACUUM_DEAD_RATIO = float(os.environ.get("VACUUM_DEAD_RATIO", 0.1))
+ANALYZE_CHANGE_RATIO = float(os.environ.get("ANALYZE_CHANGE_RATIO", 0.1))
+#Tables smaller than this are left to autovacuum
+MAINTENANCE_MIN_ROWS = int(os.environ.get("MAINTENANCE_MIN_ROWS", 1000))
+MAINTENANCE_SECONDS = float(os.environ.get("MAINTENANCE_SECONDS", 3600))
+CLUE_ALTERNATE_MAX_AGE_SECONDS = float(os.environ.get("CLUE_ALTERNATE_MAX_AGE_SECONDS", 30 * 86400))
+#Served alternates are kept this long for GET /clues/{clue_id}/alternates
+CLUE_ALTERNATE_USED_SECONDS = float(os.environ.get("CLUE_ALTERNATE_USED_SECONDS", 7 * 86400))
+
+#Clue partitions (clues_pYYYYMM) are matched by prefix
+PUZZLE_TABLES = (
+    "word_connections",
+    "word_connection_words",
+    "clues",
+    "guesses",
+    "clue_alternates",
+    "idempotency_keys",
+    "seeded_puzzles",
+)
+
+ADD_COLUMNS = [
+    #Existing boards get the time of the migration, they become eligible after ORPHAN_MIN_AGE_SECONDS
+    "ALTER TABLE word_connections ADD COLUMN IF NOT EXISTS created_at timestamp NOT NULL DEFAULT current_timestamp",
+    "CREATE INDEX IF NOT EXISTS ix_word_connections_created_at ON word_connections (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_clues_connection_id ON clues (connection_id)",
+    "CREATE INDEX IF NOT EXISTS ix_clue_alternates_created_at ON clue_alternates (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_clue_alternates_used_at ON clue_alternates (used_at)",
+]
+
+REAP_BATCH = text("""
+    WITH orphans AS (
+        SELECT wc.id
+        FROM word_connections wc
+        WHERE wc.id > :after AND wc.id <= :upto
+          AND wc.created_at < :cutoff
+          AND NOT EXISTS (SELECT 1 FROM clues c WHERE c.connection_id = wc.id)
+          AND NOT EXISTS (SELECT 1 FROM guesses g WHERE g.connection_id = wc.id)
+        FOR UPDATE OF wc SKIP LOCKED
+    )
+    DELETE FROM word_connections wc
+    USING orphans
+    WHERE wc.id = orphans.id
+""")
+
+COUNT_BATCH = text("""
+    SELECT count(*)
+    FROM word_connections wc
+    WHERE wc.id > :after AND wc.id <= :upto
+      AND wc.created_at < :cutoff
+      AND NOT EXISTS (SELECT 1 FROM clues c WHERE c.connection_id = wc.id)
+      AND NOT EXISTS (SELECT 1 FROM guesses g WHERE g.connection_id = wc.id)
+""")
+
+#Separate statements so each can use its index
+EXPIRE_ALTERNATES = [
+    ("used", text("DELETE FROM clue_alternates WHERE used_at < :used_before")),
+    ("expired", text("DELETE FROM clue_alternates WHERE created_at < :created_before")),
+]
+
+TABLE_STATS = text("""
+    SELECT relname, n_live_tup, n_dead_tup, n_mod_since_analyze
+    FROM pg_stat_user_tables
+    WHERE relname = ANY(:tables) OR relname LIKE 'clues\\_p%'
+""")
+
+MAINTENANCE_RUNS = Counter("maintenance_runs_total", "Maintenance runs, by task")
+ORPHANS_REAPED = Counter("maintenance_orphans_reaped_total", "Orphaned boards deleted by the reaper")
+ALTERNATES_DELETED = Counter("maintenance_alternates_deleted_total", "Clue alternates deleted, by reason")
+TABLES_MAINTAINED = Counter("maintenance_tables_total", "Tables vacuumed or analyzed, by operation")
+MAINTENANCE_LAST_MS = Gauge("maintenance_last_run_ms", "Duration of the last maintenance run, by task")
+
+
+async def ensure_maintenance_columns(conn):
+    for statement in ADD_COLUMNS:
+        await conn.execute(text(statement))
+
+
+class OrphanReaper:
+    def __init__(self):
+        #Boards up to here have been examined, ids only grow
+        self.scanned_upto = 0
+
+    async def reap(self, dry_run: bool = False, max_batches: int | None = ORPHAN_MAX_BATCHES) -> dict:
+        """
+            Delete (or with dry_run count) orphans in up to max_batches batches, None for all
+        """
+        started = time.perf_counter()
+        cutoff = datetime.now() - timedelta(seconds=ORPHAN_MIN_AGE_SECONDS)
+        async with engine.connect() as conn:
+            detached = await list_detached_partitions(conn)
+            if detached:
+                #Their boards would all look orphaned, retention deletes them after the export
+                print("REAPER SKIPPED, DETACHED PARTITIONS", [name for name, _ in detached])
+                return {"orphans": 0, "dry_run": dry_run, "skipped": "detached partitions"}
+            #Boards created after the cutoff are left for a later run
+            upto = (await conn.execute(
+                text("SELECT max(id) FROM word_connections WHERE created_at < :cutoff"), {"cutoff": cutoff}
+            )).scalar() or 0
+        if upto < self.scanned_upto:
+            #Table emptied or restored, start again
+            self.scanned_upto = 0
+
+        after = self.scanned_upto
+        reaped = 0
+        batches = 0
+        while after < upto and (max_batches is None or batches < max_batches):
+            batch_upto = min(after + ORPHAN_BATCH, upto)
+            params = {"after": after, "upto": batch_upto, "cutoff": cutoff}
+            async with engine.begin() as conn:
+                if dry_run:
+                    reaped += (await conn.execute(COUNT_BATCH, params)).scalar()
+                else:
+                    reaped += (await conn.execute(REAP_BATCH, params)).rowcount
+            after = batch_upto
+            batches += 1
+        if not dry_run:
+            self.scanned_upto = after
+            ORPHANS_REAPED.inc(reaped)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        MAINTENANCE_RUNS.inc(task="reap")
+        MAINTENANCE_LAST_MS.set(round(elapsed_ms, 1), task="reap")
+        return {
+            "orphans": reaped,
+            "dry_run": dry_run,
+            "scanned_upto": after,
+            "remaining_ids": max(0, upto - after),
+            "ms": round(elapsed_ms, 1),
+        }
+
+
+orphan_reaper = OrphanReaper()
+
+
+async def expire_clue_alternates() -> dict:
+    started = time.perf_counter()
+    now = datetime.now()
+    params = {
+        "used_before": now - timedelta(seconds=CLUE_ALTERNATE_USED_SECONDS),
+        "created_before": now - timedelta(seconds=CLUE_ALTERNATE_MAX_AGE_SECONDS),
+    }
+    deleted = {}
+    async with engine.begin() as conn:
+        for reason, statement in EXPIRE_ALTERNATES:
+            deleted[reason] = (await conn.execute(statement, params)).rowcount
+            ALTERNATES_DELETED.inc(deleted[reason], reason=reason)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    MAINTENANCE_RUNS.inc(task="alternates")
+    MAINTENANCE_LAST_MS.set(round(elapsed_ms, 1), task="alternates")
+    return {**deleted, "ms": round(elapsed_ms, 1)}
+
+
+async def vacuum_tables(force: bool = False) -> dict:
+    """
+        VACUUM (ANALYZE) tables with many dead tuples, ANALYZE tables with many changes.
+        VACUUM can't run in a transaction, so this uses an autocommit connection.
+    """
+    started = time.perf_counter()
+    vacuumed = []
+    analyzed = []
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        stats = (await conn.execute(TABLE_STATS, {"tables": list(PUZZLE_TABLES)})).all()
+        for name, live, dead, modified in stats:
+            if live + dead < MAINTENANCE_MIN_ROWS and not force:
+                continue
+            if force or dead > VACUUM_DEAD_RATIO * max(live, 1):
+                table_started = time.perf_counter()
+                await conn.execute(text(f'VACUUM (ANALYZE) "{name}"'))
+                vacuumed.append((name, dead, round((time.perf_counter() - table_started) * 1000, 1)))
+                TABLES_MAINTAINED.inc(operation="vacuum")
+            elif modified > ANALYZE_CHANGE_RATIO * max(live, 1):
+                table_started = time.perf_counter()
+                await conn.execute(text(f'ANALYZE "{name}"'))
+                analyzed.append((name, modified, round((time.perf_counter() - table_started) * 1000, 1)))
+                TABLES_MAINTAINED.inc(operation="analyze")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    MAINTENANCE_RUNS.inc(task="vacuum")
+    MAINTENANCE_LAST_MS.set(round(elapsed_ms, 1), task="vacuum")
+    #(table, dead tuples / changed rows, ms)
+    return {"vacuumed": vacuumed, "analyzed": analyzed, "ms": round(elapsed_ms, 1)}
+
+
+async def maintain_puzzle_tables():
+    """
+        Scheduled job: reap orphans, expire clue alternates, then vacuum / analyze what
+        needs it.
+        Only one worker does it at a time, the others skip.
+    """
+    #The partition retention job's lock: while it archives a partition, that partition's
+    #boards have no clues row and would look orphaned. One job at a time, the other skips.
+    async with partition_lock() as locked:
+        if not locked:
+            return
+        reaped = await orphan_reaper.reap()
+        print("ORPHANS REAPED", reaped)
+        print("CLUE ALTERNATES DELETED", await expire_clue_alternates())
+        maintained = await vacuum_tables()
+        print("TABLES MAINTAINED", maintained)
+
+
+async def _migrate():
+    async with engine.begin() as conn:
+        await ensure_maintenance_columns(conn)
+    print("MAINTENANCE COLUMNS AND INDEXES CREATED")
+
+
+async def _reap(dry_run: bool):
+    async with partition_lock() as locked:
+        if not locked:
+            print("MAINTENANCE OR PARTITION RETENTION IS RUNNING, try again later")
+            return
+        #A one-off run goes through the whole table
+        print("ORPHANS REAPED", await orphan_reaper.reap(dry_run=dry_run, max_batches=None))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Puzzle table maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="Add word_connections.created_at and the indexes maintenance uses")
+    reap_parser = subparsers.add_parser("reap", help="Delete orphaned boards")
+    reap_parser.add_argument("--dry-run", action="store_true", help="Only count them")
+    subparsers.add_parser("alternates", help="Delete used and expired clue alternates")
+    vacuum_parser = subparsers.add_parser("vacuum", help="VACUUM / ANALYZE the puzzle tables that need it")
+    vacuum_parser.add_argument("--force", action="store_true", help="Vacuum every puzzle table")
+    subparsers.add_parser("run", help="Reap and vacuum, like the scheduled job")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        asyncio.run(_migrate())
+    elif args.command == "reap":
+        asyncio.run(_reap(args.dry_run))
+    elif args.command == "alternates":
+        print("CLUE ALTERNATES DELETED", asyncio.run(expire_clue_alternates()))
+    elif args.command == "vacuum":
+        print("TABLES MAINTAINED", asyncio.run(vacuum_tables(args.force)))
+    elif args.command == "run":
+        asyncio.run(maintain_puzzle_tables())
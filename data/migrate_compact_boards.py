@@ -0,0 +1,84 @@
+"""
+    Migrate boards from the word_connection_words link table to the compact columns
+    on word_connections (word_ids, selected_mask, known_mask).
+
+        python -m data.migrate_compact_boards
+        python -m data.migrate_compact_boards --drop-links   # after switching to BOARD_STORAGE=compact
+
+    The link table has no position column, so migrated boards are ordered by word id.
+    Runs in batches of connection ids so no single transaction locks the whole table.
+"""
+import argparse
+import asyncio
+from sqlalchemy import text
+from .db import engine
+
+ADD_COLUMNS = [
+    "ALTER TABLE word_connections ADD COLUMN IF NOT EXISTS word_ids integer[]",
+    "ALTER TABLE word_connections ADD COLUMN IF NOT EXISTS selected_mask integer",
+    "ALTER TABLE word_connections ADD COLUMN IF NOT EXISTS known_mask integer",
+]
+
+MIGRATE_BATCH = text("""
+    WITH positioned AS (
+        SELECT
+            connection_id,
+            word_id,
+            selected,
+            row_number() OVER (PARTITION BY connection_id ORDER BY word_id) - 1 AS position
+        FROM word_connection_words
+        WHERE connection_id > :after AND connection_id <= :upto
+    ),
+    packed AS (
+        SELECT
+            connection_id,
+            array_agg(word_id ORDER BY position) AS word_ids,
+            sum(CASE WHEN selected THEN 1 << position::int ELSE 0 END)::int AS selected_mask,
+            sum(CASE WHEN selected IS NOT NULL THEN 1 << position::int ELSE 0 END)::int AS known_mask
+        FROM positioned
+        GROUP BY connection_id
+    )
+    UPDATE word_connections wc
+    SET word_ids = packed.word_ids,
+        selected_mask = packed.selected_mask,
+        known_mask = packed.known_mask
+    FROM packed
+    WHERE wc.id = packed.connection_id
+      AND wc.word_ids IS NULL
+""")
+
+DROP_LINKS_BATCH = text("""
+    DELETE FROM word_connection_words wcw
+    USING word_connections wc
+    WHERE wcw.connection_id = wc.id
+      AND wc.word_ids IS NOT NULL
+      AND wc.id > :after AND wc.id <= :upto
+""")
+
+
+async def migrate(batch_size: int, drop_links: bool):
+    async with engine.begin() as conn:
+        for statement in ADD_COLUMNS:
+            await conn.execute(text(statement))
+        max_id = (await conn.execute(text("SELECT coalesce(max(id), 0) FROM word_connections"))).scalar()
+
+    migrated = 0
+    dropped = 0
+    for after in range(0, max_id, batch_size):
+        async with engine.begin() as conn:
+            params = {"after": after, "upto": after + batch_size}
+            result = await conn.execute(MIGRATE_BATCH, params)
+            migrated += result.rowcount
+            if drop_links:
+                result = await conn.execute(DROP_LINKS_BATCH, params)
+                dropped += result.rowcount
+        print("MIGRATED UP TO", min(after + batch_size, max_id), "OF", max_id)
+    print("BOARDS MIGRATED", migrated, "LINK ROWS DROPPED", dropped)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate boards to the compact layout")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--drop-links", action="store_true", help="Delete link rows of migrated boards")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.drop_links))
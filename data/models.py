@@ -8,13 +8,45 @@ from sqlalchemy import (
     Text,
     Boolean,
     ForeignKey,
+    ARRAY,
     ForeignKeyConstraint,
     TIMESTAMP,
     func,
     UniqueConstraint,
+    Sequence,
+    PrimaryKeyConstraint,
 )
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.dialects.postgresql import CITEXT
+import os
+
+#"both" writes the link rows and the compact word_ids/mask columns,
+#"compact" writes only the compact columns (one row per board)
+BOARD_STORAGE = os.environ.get("BOARD_STORAGE", "both")
+
+
+def pack_selection(selected_flags: list[bool | None]) -> tuple[int, int]:
+    """
+        Pack per-word selected flags into (selected_mask, known_mask).
+        Bit i of known_mask is set when flag i is not None.
+    """
+    selected_mask = 0
+    known_mask = 0
+    for position, selected in enumerate(selected_flags):
+        if selected is not None:
+            known_mask |= 1 << position
+            if selected:
+                selected_mask |= 1 << position
+    return selected_mask, known_mask
+
+
+def unpack_selection(selected_mask: int | None, known_mask: int | None, size: int) -> list[bool | None]:
+    selected_mask = selected_mask or 0
+    known_mask = known_mask or 0
+    return [
+        bool(selected_mask >> position & 1) if known_mask >> position & 1 else None
+        for position in range(size)
+    ]
 
 
 class Word(Base):
@@ -82,16 +114,40 @@ class WordConnection(Base):
     #     nullable=True,
     # )
 
-    word_links = relationship("WordConnectionWord", back_populates="connection")
-    clue = relationship("Clue", back_populates="connection")
+    #Compact layout, one narrow row per board (see data/migrate_compact_boards.py):
+    #board word ids in order, bit i of selected_mask is word_ids[i]'s selected flag
+    #and bit i of known_mask is set when that flag is not NULL
+    word_ids = Column(ARRAY(Integer), nullable=True)
+    selected_mask = Column(Integer, nullable=True)
+    known_mask = Column(Integer, nullable=True)
 
+    #Lets the orphan reaper (data/maintenance.py) leave boards still waiting for their clue alone
+    created_at = Column(
+        TIMESTAMP,
+        server_default=func.current_timestamp(),
+        nullable=False,
+        index=True,
+    )
 
+    word_links = relationship("WordConnectionWord", back_populates="connection")
+    clue = relationship("Clue", back_populates="connection")
+    guesses = relationship("Guess", back_populates="connection")
 
+    def selected_flags(self) -> list[bool | None]:
+        return unpack_selection(self.selected_mask, self.known_mask, len(self.word_ids or []))
 
     def to_dict(self):
+        if self.word_ids is not None and BOARD_STORAGE == "compact":
+            #No link rows in compact-only storage, words are hydrated elsewhere
+            words = [
+                {"word_id": word_id, "word": None, "selected": selected}
+                for word_id, selected in zip(self.word_ids, self.selected_flags())
+            ]
+        else:
+            words = [wcw.to_dict() for wcw in self.word_links]
         return {
             "id": self.id,
-            "words": [wcw.to_dict() for wcw in self.word_links],
+            "words": words,
             "clue" : self.clue,
         }
 
@@ -125,12 +181,24 @@ class WordConnectionWord(Base):
             "selected": self.selected,
         }
 
+clue_id_seq = Sequence("clues_id_seq")
+
 class Clue(Base):
+    """
+        Range partitioned by created_at (monthly partitions, see data/partitions.py).
+        Postgres needs the partition key in the primary key, ids are still unique
+        through the sequence. Other tables can't hold a foreign key to clues.id.
+    """
     __tablename__ = "clues"
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id = Column(
         Integer,
-        primary_key=True,
+        clue_id_seq,
+        server_default=clue_id_seq.next_value(),
     )
 
     clue = Column(
@@ -152,6 +220,7 @@ class Clue(Base):
     connection_id = Column(
         Integer,
         ForeignKey("word_connections.id", ondelete="CASCADE"),
+        index=True,
     )
 
     # words = relationship(
@@ -171,4 +240,187 @@ class Clue(Base):
             "clue_word_count": self.clue_word_count,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "connection": self.connection.to_dict() if self.connection else None,
-        }
\ No newline at end of file
+        }
+
+class Guess(Base):
+    """
+        An AI guess at a board for a clue, kept for accuracy analysis and reuse
+    """
+    __tablename__ = "guesses"
+
+    id = Column(
+        Integer,
+        primary_key=True,
+    )
+
+    connection_id = Column(
+        Integer,
+        ForeignKey("word_connections.id", ondelete="CASCADE"),
+        nullable=True,
+        index=True,
+    )
+
+    #No foreign key, clues is partitioned (see Clue)
+    clue_id = Column(
+        Integer,
+        nullable=True,
+        index=True,
+    )
+
+    clue = Column(
+        CITEXT,
+        nullable=False
+    )
+
+    number_of_selected_words = Column(
+        Integer,
+        nullable=False
+    )
+
+    #Board word ids in order and the ids the AI selected
+    word_ids = Column(ARRAY(Integer), nullable=False)
+    selected_word_ids = Column(ARRAY(Integer), nullable=False)
+
+    model = Column(String(100), nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+
+    created_at = Column(
+        TIMESTAMP,
+        server_default=func.current_timestamp(),
+        nullable=False,
+    )
+
+    connection = relationship(
+        "WordConnection",
+        back_populates="guesses"
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "connection_id": self.connection_id,
+            "clue_id": self.clue_id,
+            "clue": self.clue,
+            "number_of_selected_words": self.number_of_selected_words,
+            "word_ids": self.word_ids,
+            "selected_word_ids": self.selected_word_ids,
+            "model": self.model,
+            "latency_ms": self.latency_ms,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+class SeededPuzzle(Base):
+    """
+        A puzzle derived from a seed (e.g. "daily-2026-10-19"), generated once and
+        served from the stored response after that
+    """
+    __tablename__ = "seeded_puzzles"
+
+    seed = Column(String(64), primary_key=True)
+
+    #No foreign key, clues is partitioned (see Clue)
+    clue_id = Column(
+        Integer,
+        nullable=False,
+    )
+
+    #Serialized API response, served as is
+    response_json = Column(Text, nullable=False)
+
+    created_at = Column(
+        TIMESTAMP,
+        server_default=func.current_timestamp(),
+        nullable=False,
+    )
+
+class IdempotencyKey(Base):
+    """
+        Outcome of a POST sent with an Idempotency-Key header (see services/idempotency.py).
+        Shared by every worker, rows are removed once expires_at has passed.
+    """
+    __tablename__ = "idempotency_keys"
+
+    #Path plus the client's key, hashed
+    key = Column(String(64), primary_key=True)
+
+    #Hash of the request body, a reused key with a different body is rejected
+    fingerprint = Column(String(64), nullable=False)
+
+    #"pending" while the first attempt runs, then "done"
+    status = Column(String(16), nullable=False)
+
+    response_status = Column(Integer, nullable=True)
+    response_headers = Column(Text, nullable=True)
+    response_body = Column(Text, nullable=True)
+
+    created_at = Column(
+        TIMESTAMP,
+        server_default=func.current_timestamp(),
+        nullable=False,
+    )
+
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)
+
+class ClueAlternate(Base):
+    """
+        A valid candidate clue the model ranked below the one that was used (see
+        AI_CLUE_CANDIDATES in services/ai.py), kept for the board to serve a replay of
+        the board or an easier / harder variant without another model call
+    """
+    __tablename__ = "clue_alternates"
+
+    id = Column(
+        Integer,
+        primary_key=True,
+    )
+
+    #The clue that was used, no foreign key, clues is partitioned (see Clue)
+    clue_id = Column(
+        Integer,
+        nullable=False,
+        index=True,
+    )
+
+    #Sorted board word ids, the same board finds its alternates in any word order
+    board_key = Column(ARRAY(Integer), nullable=False, index=True)
+
+    #1 is the best alternate
+    rank = Column(Integer, nullable=False)
+
+    clue = Column(
+        CITEXT,
+        nullable=False
+    )
+
+    clue_word_count = Column(
+        Integer,
+        nullable=False
+    )
+
+    selected_word_ids = Column(ARRAY(Integer), nullable=False)
+
+    #Set once the alternate has been served for a replay of the board
+    used_at = Column(TIMESTAMP, nullable=True, index=True)
+
+    #Alternates are deleted by data/maintenance.py after CLUE_ALTERNATE_MAX_AGE_SECONDS
+    created_at = Column(
+        TIMESTAMP,
+        server_default=func.current_timestamp(),
+        nullable=False,
+        index=True,
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "clue_id": self.clue_id,
+            "rank": self.rank,
+            "clue": self.clue,
+            "clue_word_count": self.clue_word_count,
+            "selected_word_ids": self.selected_word_ids,
+            "used_at": self.used_at.isoformat() if self.used_at else None,
+        }
@@ -0,0 +1,355 @@
+"""
+    Monthly range partitions of `clues` by created_at, and the retention job.
+
+        python -m data.partitions migrate      # convert an existing unpartitioned clues table
+        python -m data.partitions ensure       # create partitions for the coming months
+        python -m data.partitions retain       # archive and drop partitions past retention
+
+    Partitions are named clues_pYYYYMM and cover [first of month, first of next month).
+    A default partition catches anything outside them and should stay empty.
+
+    Retention: partitions that ended more than CLUE_RETENTION_MONTHS ago are detached,
+    exported with their boards (word_connections / word_connection_words rows), the
+    guesses on those boards or clues, the clues' alternates and the seeded puzzles built
+    on them to gzipped CSV files in ARCHIVE_DIR, and then dropped together with all of
+    those rows. Workers drop archived clues from their in-process caches when they see
+    the oldest clue id move (see oldest_clue_id). A partition whose archive failed half
+    way stays detached, with its progress in the table comment, and the next run
+    finishes it. The orphan reaper (data/maintenance.py) runs under the same lock and
+    not at all while such a partition exists, its boards no longer have a clue.
+"""
+from contextlib import asynccontextmanager
+from datetime import date
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex, CreateTable
+import argparse
+import asyncio
+import gzip
+import os
+import re
+import time
+from .db import engine
+from .models import Clue
+from services.metrics import Counter
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", 3))
+#0 keeps everything
+CLUE_RETENTION_MONTHS = int(os.environ.get("CLUE_RETENTION_MONTHS", 0))
+ARCHIVE_DIR = Path(os.environ.get("ARCHIVE_DIR", BASE_DIR / "archive"))
+RETENTION_DELETE_BATCH = int(os.environ.get("RETENTION_DELETE_BATCH", 5000))
+PARTITION_MAINTENANCE_SECONDS = float(os.environ.get("PARTITION_MAINTENANCE_SECONDS", 6 * 3600))
+
+PARTITION_NAME = re.compile(r"^clues_p(\d{4})(\d{2})$")
+#Arbitrary constant for pg_try_advisory_lock, only one worker maintains partitions (or
+#runs the orphan reaper, see data/maintenance.py) at a time
+PARTITION_LOCK_KEY = 7_310_001
+
+PARTITIONS_ARCHIVED = Counter("clue_partitions_archived_total", "Clue partitions detached, exported and dropped")
+ROWS_ARCHIVED = Counter("clue_rows_archived_total", "Rows exported by the retention job")
+
+
+def add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"clues_p{month.year:04d}{month.month:02d}"
+
+
+async def is_partitioned(conn) -> bool:
+    result = await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'clues'"))
+    return result.scalar() == "p"
+
+
+async def ensure_clue_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD, start: date | None = None) -> list[str]:
+    """
+        Create the monthly partitions from `start` (default this month) to months_ahead
+        months from now, plus the default partition. Returns the names created.
+    """
+    this_month = date.today().replace(day=1)
+    month = (start or this_month).replace(day=1)
+    last = add_months(this_month, months_ahead)
+    created = []
+    while month <= last:
+        name = partition_name(month)
+        exists = await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})
+        if exists.scalar() is None:
+            await conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF clues "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        month = add_months(month, 1)
+    await conn.execute(text("CREATE TABLE IF NOT EXISTS clues_default PARTITION OF clues DEFAULT"))
+    stray = (await conn.execute(text("SELECT count(*) FROM clues_default"))).scalar()
+    if stray:
+        print("WARNING CLUES IN DEFAULT PARTITION", stray)
+    return created
+
+
+async def list_partitions(conn) -> list[tuple[str, date]]:
+    result = await conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'clues'
+    """))
+    partitions = []
+    for (name,) in result:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def legacy_renames() -> list[str]:
+    """
+        Move the old table and the names of its constraints and indexes out of the way of
+        the partitioned table. data.maintenance migrate may have added the indexes.
+    """
+    statements = [
+        "ALTER TABLE clues RENAME TO clues_legacy",
+        "ALTER TABLE clues_legacy RENAME CONSTRAINT clues_pkey TO clues_legacy_pkey",
+        "ALTER TABLE clues_legacy RENAME CONSTRAINT clues_connection_id_fkey TO clues_legacy_connection_id_fkey",
+    ]
+    for index in sorted(Clue.__table__.indexes, key=lambda index: index.name):
+        legacy_name = index.name.replace("clues", "clues_legacy", 1)
+        statements.append(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {legacy_name}")
+    return statements
+
+
+def create_partitioned_clues(sync_conn):
+    """
+        CREATE TABLE and indexes only, clues_id_seq already exists
+    """
+    sync_conn.execute(CreateTable(Clue.__table__))
+    for index in Clue.__table__.indexes:
+        sync_conn.execute(CreateIndex(index))
+
+
+async def migrate_to_partitioned(keep_legacy: bool = False):
+    """
+        Convert an existing plain `clues` table into the partitioned layout, copying its rows
+    """
+    async with engine.begin() as conn:
+        if await is_partitioned(conn):
+            print("CLUES IS ALREADY PARTITIONED")
+            return
+        # Keep the id sequence when the old table is dropped, the new table reuses it
+        await conn.execute(text("ALTER SEQUENCE clues_id_seq OWNED BY NONE"))
+        for statement in legacy_renames():
+            await conn.execute(text(statement))
+        # Foreign keys to clues.id can't point at a partitioned table
+        for table in ("guesses", "seeded_puzzles"):
+            await conn.execute(text(f"ALTER TABLE IF EXISTS {table} DROP CONSTRAINT IF EXISTS {table}_clue_id_fkey"))
+
+        await conn.run_sync(create_partitioned_clues)
+        oldest = (await conn.execute(text("SELECT min(created_at) FROM clues_legacy"))).scalar()
+        await ensure_clue_partitions(conn, start=oldest.date() if oldest else None)
+        copied = await conn.execute(text("""
+            INSERT INTO clues (id, clue, clue_word_count, created_at, connection_id)
+            SELECT id, clue, clue_word_count, created_at, connection_id FROM clues_legacy
+        """))
+        await conn.execute(text("SELECT setval('clues_id_seq', coalesce((SELECT max(id) FROM clues), 1))"))
+        if not keep_legacy:
+            await conn.execute(text("DROP TABLE clues_legacy"))
+        print("CLUES MIGRATED TO PARTITIONS", copied.rowcount)
+
+
+async def _export(raw, query: str, path: Path) -> int:
+    rows = 0
+    with gzip.open(path, "wb") as file:
+        async def write(chunk):
+            nonlocal rows
+            rows += chunk.count(b"\n")
+            file.write(chunk)
+        await raw.copy_from_query(query, output=write, format="csv", header=True)
+    return max(0, rows - 1)
+
+
+async def list_detached_partitions(conn) -> list[tuple[str, str | None]]:
+    """
+        clues_pYYYYMM tables no longer attached to clues: an archive that failed after the
+        detach. Returns (name, archive state) pairs, the state is kept in the table comment.
+    """
+    result = await conn.execute(text("""
+        SELECT child.relname, obj_description(child.oid, 'pg_class')
+        FROM pg_class child
+        WHERE child.relkind = 'r'
+          AND child.relname LIKE 'clues\\_p%'
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE pg_inherits.inhrelid = child.oid)
+    """))
+    return sorted((name, state) for name, state in result if PARTITION_NAME.match(name))
+
+
+async def archive_partition(name: str, archive_dir: Path = ARCHIVE_DIR, state: str | None = None) -> dict:
+    """
+        Detach one partition, export it with its boards and the rows referring to its
+        clues, then drop all of them.
+        Each step records its state on the detached table, a partition left behind by a
+        failed run is picked up again by apply_retention, see list_detached_partitions.
+    """
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    if state is None:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"ALTER TABLE clues DETACH PARTITION {name}"))
+            await conn.execute(text(f"COMMENT ON TABLE {name} IS 'detached'"))
+        state = "detached"
+
+    board_ids = f"SELECT connection_id FROM {name} WHERE connection_id IS NOT NULL"
+    clue_ids = f"SELECT id FROM {name}"
+    exported = {}
+    #Once exported the rows below start going, exporting again would overwrite the files with less
+    if state == "detached":
+        async with engine.connect() as conn:
+            raw = (await conn.get_raw_connection()).driver_connection
+            exported["clues"] = await _export(raw, f"SELECT * FROM {name}", archive_dir / f"{name}.csv.gz")
+            exported["word_connections"] = await _export(
+                raw, f"SELECT * FROM word_connections WHERE id IN ({board_ids})", archive_dir / f"{name}_word_connections.csv.gz"
+            )
+            exported["word_connection_words"] = await _export(
+                raw, f"SELECT * FROM word_connection_words WHERE connection_id IN ({board_ids})", archive_dir / f"{name}_word_connection_words.csv.gz"
+            )
+            #Deleted with the boards (ON DELETE CASCADE) or below, export them first
+            exported["guesses"] = await _export(
+                raw,
+                f"SELECT * FROM guesses WHERE connection_id IN ({board_ids}) OR clue_id IN ({clue_ids})",
+                archive_dir / f"{name}_guesses.csv.gz",
+            )
+            exported["clue_alternates"] = await _export(
+                raw, f"SELECT * FROM clue_alternates WHERE clue_id IN ({clue_ids})", archive_dir / f"{name}_clue_alternates.csv.gz"
+            )
+            exported["seeded_puzzles"] = await _export(
+                raw, f"SELECT * FROM seeded_puzzles WHERE clue_id IN ({clue_ids})", archive_dir / f"{name}_seeded_puzzles.csv.gz"
+            )
+        async with engine.begin() as conn:
+            await conn.execute(text(f"COMMENT ON TABLE {name} IS 'exported'"))
+    else:
+        print("RESUMING ARCHIVE OF", name, state)
+
+    #From here on every step can simply run again
+    #No foreign keys to clues (it is partitioned), rows pointing at the archived clues go here
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DELETE FROM clue_alternates WHERE clue_id IN ({clue_ids})"))
+        #A seed archived here is generated again on its next request
+        await conn.execute(text(f"DELETE FROM seeded_puzzles WHERE clue_id IN ({clue_ids})"))
+        #Guesses on boards that are kept, the ones on archived boards go with them
+        await conn.execute(text(f"UPDATE guesses SET clue_id = NULL WHERE clue_id IN ({clue_ids})"))
+
+    #Bounded deletes so no single transaction holds locks on a large set of boards
+    deleted = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(text(f"""
+                DELETE FROM word_connections WHERE id IN (
+                    {board_ids} LIMIT :batch
+                )
+            """), {"batch": RETENTION_DELETE_BATCH})
+        deleted += result.rowcount
+        if result.rowcount < RETENTION_DELETE_BATCH:
+            break
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP TABLE {name}"))
+    PARTITIONS_ARCHIVED.inc()
+    ROWS_ARCHIVED.inc(sum(exported.values()))
+    print("PARTITION ARCHIVED", name, exported, "BOARDS DELETED", deleted)
+    return exported
+
+
+async def oldest_clue_id(conn) -> int:
+    """
+        Lowest clue id still stored. Retention drops the oldest months, so clue ids below
+        it have been archived.
+    """
+    return (await conn.execute(text("SELECT coalesce(min(id), 0) FROM clues"))).scalar()
+
+
+async def apply_retention(retention_months: int = CLUE_RETENTION_MONTHS) -> list[str]:
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(date.today().replace(day=1), -retention_months)
+    async with engine.connect() as conn:
+        detached = await list_detached_partitions(conn)
+        partitions = await list_partitions(conn)
+    archived = []
+    #Finish what a failed run left detached first, until then the reaper stays off
+    for name, state in detached:
+        await archive_partition(name, state=state or "detached")
+        archived.append(name)
+    for name, month in partitions:
+        #Only partitions that ended before the cutoff
+        if add_months(month, 1) <= cutoff:
+            await archive_partition(name)
+            archived.append(name)
+    return archived
+
+
+@asynccontextmanager
+async def partition_lock():
+    """
+        async with partition_lock() as locked: ...  locked is False if another worker
+        holds it
+    """
+    async with engine.connect() as lock_conn:
+        locked = (await lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": PARTITION_LOCK_KEY})).scalar()
+        await lock_conn.commit()
+        try:
+            yield locked
+        finally:
+            if locked:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PARTITION_LOCK_KEY})
+                await lock_conn.commit()
+
+
+async def maintain_partitions():
+    """
+        Scheduled job: create upcoming partitions and apply retention.
+        Only one worker does it at a time, the others skip.
+    """
+    started = time.perf_counter()
+    async with partition_lock() as locked:
+        if not locked:
+            return
+        async with engine.begin() as conn:
+            if not await is_partitioned(conn):
+                print("CLUES IS NOT PARTITIONED, run python -m data.partitions migrate")
+                return
+            created = await ensure_clue_partitions(conn)
+        archived = await apply_retention()
+        print("PARTITIONS MAINTAINED", "CREATED", created, "ARCHIVED", archived, f"{time.perf_counter() - started:.2f}s")
+
+
+async def _retain(months: int):
+    async with partition_lock() as locked:
+        if not locked:
+            print("PARTITION MAINTENANCE OR THE ORPHAN REAPER IS RUNNING, try again later")
+            return
+        print("ARCHIVED", await apply_retention(months))
+
+
+async def _ensure():
+    async with engine.begin() as conn:
+        print("PARTITIONS CREATED", await ensure_clue_partitions(conn))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clue partitions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Convert the clues table to partitions")
+    migrate_parser.add_argument("--keep-legacy", action="store_true", help="Keep the old table as clues_legacy")
+    subparsers.add_parser("ensure", help="Create upcoming partitions")
+    retain_parser = subparsers.add_parser("retain", help="Archive partitions past retention")
+    retain_parser.add_argument("--months", type=int, default=CLUE_RETENTION_MONTHS)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        asyncio.run(migrate_to_partitioned(args.keep_legacy))
+    elif args.command == "ensure":
+        asyncio.run(_ensure())
+    elif args.command == "retain":
+        asyncio.run(_retain(args.months))
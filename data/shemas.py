@@ -20,10 +20,20 @@ class WordWithoutSelectionSchema(BaseModel):
 # class ListOfWordsSchema(BaseModel):
 #     List[WordWithoutSelectionSchema]
 
+class BoardReferenceSchema(BaseModel):
+    #One of the two, the words are filled in server side from the words table
+    word_ids : Optional[List[int]] = None
+    connection_id : Optional[int] = None
+
 class ClueWithSelectedWordsSchema(BaseModel):
     clue : str
     number_of_selected_words : int
-    words : List[WordWithoutSelectionSchema]
+    #Either the words, or just their ids, or only connection_id
+    words : Optional[List[WordWithoutSelectionSchema]] = None
+    word_ids : Optional[List[int]] = None
+    #Optional, links the stored guess to the board / clue it was made for
+    connection_id : Optional[int] = None
+    clue_id : Optional[int] = None
 
 class AIClueWithSelectedWordsSchema(BaseModel):
     clue_id : int
@@ -39,6 +49,26 @@ class AIClueWithUnselectedWordsSchema(BaseModel):
     created_at : datetime
     words : List[WordWithoutSelectionSchema]
 
+class ClueAlternateSchema(BaseModel):
+    clue : str
+    number_of_selected_words : int
+    words : List[WordSchema]
+    #True once it has been served for a replay of the board
+    used : bool
+
+class ClueBatchRequestSchema(BaseModel):
+    ids : List[int]
+
+class ClueBatchItemSchema(BaseModel):
+    clue_id : int
+    found : bool
+    #None when the clue does not exist
+    response : Optional[AIClueWithSelectedWordsSchema] = None
+
+class ClueBatchResponseSchema(BaseModel):
+    #In request order, one item per requested id
+    clues : List[ClueBatchItemSchema]
+
 
 class AIGuessResponseSchema(BaseModel):
     clue : str
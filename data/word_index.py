@@ -0,0 +1,59 @@
+"""
+    In-memory id -> word map of the `words` table.
+
+    Loaded once at startup (the table is small and effectively read-only) so boards
+    stored as an array of word ids can be hydrated without joining `words`.
+    Ids that are missing, e.g. words added after startup, are fetched on demand.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import Word
+
+
+class WordIndex:
+    def __init__(self):
+        self.words_by_id: dict[int, str] = {}
+        self.ids_by_word: dict[str, int] = {}
+
+    def add(self, word_id: int, word: str):
+        self.words_by_id[word_id] = word
+        self.ids_by_word[word.lower()] = word_id
+
+    def __len__(self) -> int:
+        return len(self.words_by_id)
+
+    def word(self, word_id: int) -> str | None:
+        return self.words_by_id.get(word_id)
+
+    def id_of(self, word: str) -> int | None:
+        return self.ids_by_word.get(word.strip().lower())
+
+    async def load(self, session: AsyncSession):
+        result = await session.execute(select(Word.id, Word.word))
+        for word_id, word in result:
+            self.add(word_id, word)
+
+    async def ensure(self, session: AsyncSession, word_ids: list[int]) -> bool:
+        """
+            Fetch any ids not already in the index. Returns False if some don't exist at all.
+        """
+        missing = {word_id for word_id in word_ids if word_id not in self.words_by_id}
+        if missing:
+            result = await session.execute(select(Word.id, Word.word).where(Word.id.in_(missing)))
+            for word_id, word in result:
+                self.add(word_id, word)
+        return all(word_id in self.words_by_id for word_id in word_ids)
+
+    def board_words(self, word_ids: list[int], selected_flags: list[bool | None] | None = None) -> list[dict]:
+        """
+            Board as word objects {id, word, selected} in board order
+        """
+        if selected_flags is None:
+            selected_flags = [None] * len(word_ids)
+        return [
+            {"id": word_id, "word": self.words_by_id[word_id], "selected": selected}
+            for word_id, selected in zip(word_ids, selected_flags)
+        ]
+
+
+word_index = WordIndex()
@@ -0,0 +1,280 @@
+"""
+    Write-behind batching for puzzle inserts.
+
+    Concurrent requests hand their puzzle (nine words, selected flags and clue) to the
+    batcher instead of committing three small transactions each. The batcher collects
+    items for up to PUZZLE_BATCH_INTERVAL_MS or PUZZLE_BATCH_MAX_ITEMS, writes them with
+    one multi-row INSERT per table in a single transaction and resolves each caller's
+    future with its generated ids. A batch that fails is split in halves and retried, so
+    only the item that can't be written (e.g. an IntegrityError) fails its caller. A lost
+    connection or timeout fails the whole batch at once, every half would fail too.
+
+    Enable with PUZZLE_WRITE_BATCHING=1. Compare commit rates with:
+        python -m data.write_batcher bench --requests 2000 --concurrency 200
+"""
+from abc import ABC, abstractmethod
+from sqlalchemy import insert, text
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from .association_graph import association_graph
+from .db import SessionLocal
+from .db_actions import valid_clue_text
+from .models import WordConnection, WordConnectionWord, Clue, pack_selection, BOARD_STORAGE
+from . import db_stats
+from services.metrics import Counter, Gauge
+import argparse
+import asyncio
+import os
+import time
+
+PUZZLE_WRITE_BATCHING = os.environ.get("PUZZLE_WRITE_BATCHING", "0") == "1"
+PUZZLE_BATCH_MAX_ITEMS = int(os.environ.get("PUZZLE_BATCH_MAX_ITEMS", 50))
+PUZZLE_BATCH_INTERVAL_MS = float(os.environ.get("PUZZLE_BATCH_INTERVAL_MS", 5))
+
+BATCH_FLUSHES = Counter("write_batch_flushes_total", "Transactions committed by write-behind batchers")
+BATCH_ITEMS = Counter("write_batch_items_total", "Items written by write-behind batchers")
+BATCH_ERRORS = Counter("write_batch_errors_total", "Batches that failed to write")
+BATCH_QUEUE = Gauge("write_batch_queue_length", "Items waiting in write-behind batchers")
+Counter("db_commits_total", "Database transactions committed by this process").set_function(lambda: db_stats.commit_count)
+
+
+_STOP = object()
+
+
+def is_transient(error: Exception) -> bool:
+    """
+        The database, not the items, failed: lost connection, timeout
+    """
+    if isinstance(error, (OperationalError, InterfaceError, OSError, TimeoutError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class Batcher(ABC):
+    """
+        Collects items from a queue and hands them to flush() in batches.
+        Subclasses implement flush(items), failed(items, error) is called for items
+        that can't be written even on their own.
+    """
+
+    name = "batcher"
+
+    def __init__(self, max_items: int, interval_ms: float, max_queue: int = 0):
+        self.max_items = max_items
+        self.interval = interval_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            _running.append(self)
+
+    async def stop(self, timeout: float = 10):
+        """
+            Stop collecting, flushing whatever is already queued first
+        """
+        if self._task is None:
+            return
+        await self.queue.put(_STOP)
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        finally:
+            self._task = None
+            _running.remove(self)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            items = [item]
+            deadline = loop.time() + self.interval
+            while len(items) < self.max_items:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                items.append(item)
+            await self._flush(items)
+
+    async def _flush(self, items: list):
+        try:
+            await self.flush(items)
+            BATCH_FLUSHES.inc(batcher=self.name)
+            BATCH_ITEMS.inc(len(items), batcher=self.name)
+        except Exception as e:
+            BATCH_ERRORS.inc(batcher=self.name)
+            if len(items) == 1 or is_transient(e):
+                print("BATCH WRITE FAILED", self.name, len(items), e)
+                self.failed(items, e)
+                return
+            #One bad item rolls back the whole transaction, write the halves separately
+            print("BATCH WRITE FAILED, SPLITTING", self.name, len(items), e)
+            middle = len(items) // 2
+            await self._flush(items[:middle])
+            await self._flush(items[middle:])
+
+    @abstractmethod
+    async def flush(self, items: list):
+        pass
+
+    def failed(self, items: list, error: Exception):
+        pass
+
+
+_running: list[Batcher] = []
+BATCH_QUEUE.set_function(lambda: {(("batcher", b.name),): b.queue.qsize() for b in _running})
+
+
+class PendingPuzzle:
+    def __init__(self, word_ids: list[int], selected_flags: list[bool | None], clue_text: str, clue_word_count: int):
+        self.word_ids = word_ids
+        self.selected_flags = selected_flags
+        self.clue_text = clue_text
+        self.clue_word_count = clue_word_count
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class PuzzleWriteBatcher(Batcher):
+    """
+        Batches WordConnection + WordConnectionWord + Clue inserts
+    """
+
+    name = "puzzles"
+
+    async def submit(self, word_ids: list[int], selected_flags: list[bool | None], clue_text: str, clue_word_count: int) -> dict:
+        """
+            Queue a puzzle and wait for it to be written.
+            Validates like add_clue_to_selection before anything is queued.
+
+            :return: {"connection_id", "clue_id", "created_at"}
+        """
+        if not valid_clue_text(clue_text):
+            raise ValueError("Clue must be a single word with no spaces")
+        if len(selected_flags) != len(word_ids):
+            raise ValueError("selected_flags must be the same length as words")
+        true_count = sum(1 for flag in selected_flags if flag is True)
+        if true_count != clue_word_count:
+            raise ValueError(
+                f"clue_word_count ({clue_word_count}) "
+                f"does not match number of selected words ({true_count})"
+            )
+        pending = PendingPuzzle(word_ids, selected_flags, clue_text.strip(), clue_word_count)
+        await self.queue.put(pending)
+        return await pending.future
+
+    async def flush(self, items: list[PendingPuzzle]):
+        async with SessionLocal() as session:
+            async with session.begin():
+                #Reserve the connection ids up front so the link rows can go in one INSERT
+                id_result = await session.execute(
+                    text("SELECT nextval(pg_get_serial_sequence('word_connections', 'id')) FROM generate_series(1, :n)"),
+                    {"n": len(items)},
+                )
+                connection_ids = id_result.scalars().all()
+
+                connection_rows = []
+                for cid, item in zip(connection_ids, items):
+                    selected_mask, known_mask = pack_selection(item.selected_flags)
+                    connection_rows.append({
+                        "id": cid,
+                        "word_ids": item.word_ids,
+                        "selected_mask": selected_mask,
+                        "known_mask": known_mask,
+                    })
+                await session.execute(insert(WordConnection).values(connection_rows))
+                if BOARD_STORAGE != "compact":
+                    await session.execute(insert(WordConnectionWord).values([
+                        {"word_id": word_id, "connection_id": cid, "selected": selected}
+                        for cid, item in zip(connection_ids, items)
+                        for word_id, selected in zip(item.word_ids, item.selected_flags)
+                    ]))
+                clue_result = await session.execute(
+                    insert(Clue)
+                    .values([
+                        {"clue": item.clue_text, "clue_word_count": item.clue_word_count, "connection_id": cid}
+                        for cid, item in zip(connection_ids, items)
+                    ])
+                    .returning(Clue.id, Clue.connection_id, Clue.created_at)
+                )
+                clues_by_connection = {row.connection_id: row for row in clue_result}
+
+        for cid, item in zip(connection_ids, items):
+            row = clues_by_connection[cid]
+            association_graph.add(
+                item.clue_text,
+                [word_id for word_id, selected in zip(item.word_ids, item.selected_flags) if selected],
+                clue_id=row.id,
+            )
+            if not item.future.done():
+                item.future.set_result({"connection_id": cid, "clue_id": row.id, "created_at": row.created_at})
+
+    def failed(self, items: list[PendingPuzzle], error: Exception):
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+
+puzzle_batcher = PuzzleWriteBatcher(PUZZLE_BATCH_MAX_ITEMS, PUZZLE_BATCH_INTERVAL_MS)
+
+
+async def _bench(requests: int, concurrency: int):
+    from .db_actions import create_word_connection, add_clue_to_selection, get_random_words
+
+    async def xact_commits() -> int:
+        async with SessionLocal() as session:
+            result = await session.execute(
+                text("SELECT xact_commit FROM pg_stat_database WHERE datname = current_database()")
+            )
+            return result.scalar()
+
+    async with SessionLocal() as session:
+        words = await get_random_words(session, 9)
+    word_ids = [word.id for word in words]
+    flags = [True, True, False, False, False, False, False, False, False]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def direct():
+        async with semaphore:
+            async with SessionLocal() as session:
+                connection = await create_word_connection(session, words, selected_flags=flags)
+                selection = [{"word_id": wid, "selected": flag} for wid, flag in zip(word_ids, flags)]
+                await add_clue_to_selection(session, connection.id, selection, "bench", 2)
+
+    async def batched():
+        async with semaphore:
+            await puzzle_batcher.submit(word_ids, flags, "bench", 2)
+
+    for name, job in (("direct", direct), ("batched", batched)):
+        if name == "batched":
+            puzzle_batcher.start()
+        # pg_stat_database is updated asynchronously, give it a moment either side
+        await asyncio.sleep(1)
+        before = await xact_commits()
+        start = time.perf_counter()
+        await asyncio.gather(*(job() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(1)
+        commits = await xact_commits() - before
+        print(f"{name:>8}: {requests} puzzles in {elapsed:.2f}s, {requests / elapsed:,.0f} puzzles/s, "
+              f"{commits} commits ({commits / elapsed:,.0f} commits/s)")
+    await puzzle_batcher.stop()
+    print("NOTE bench puzzles use the clue 'bench' and can be removed afterwards")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Puzzle write batcher")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Compare commit rates with and without batching")
+    bench_parser.add_argument("--requests", type=int, default=2000)
+    bench_parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(_bench(args.requests, args.concurrency))
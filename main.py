@@ -1,33 +1,70 @@
 #from typing import Union, List
-from fastapi import FastAPI, Depends, HTTPException, Header, Query, status
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request, Response, status
 from pydantic import BaseModel, HttpUrl
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from typing import Optional, List
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from typing import Optional, List, Union
 #from data.actions import get_or_add_user
 import os, dotenv, base64, json
 from uvicorn import Config, Server
-from data.db import engine
+from data.db import SessionLocal
 import asyncio
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import sessionmaker
 from data.db_actions import (
     get_random_words,
     add_clue_to_selection,
     create_word_connection,
     get_word_connection_by_id,
-    get_clue_by_id,
+    get_words_by_text,
+    get_clues_by_ids,
+    get_clues_by_ids_compact,
+    get_board_word_ids,
+    add_clue_alternates,
+    get_clue_alternates,
+    take_clue_alternate,
 )
+from data.word_index import word_index
+from data.clue_cache import clue_cache
+from data.association_graph import association_graph, ASSOC_REFRESH_SECONDS
 from data.shemas import (
     WordWithoutSelectionSchema,
     WordSchema,
+    BoardReferenceSchema,
     ClueWithSelectedWordsSchema,
     AIGuessResponseSchema,
     AIClueWithSelectedWordsSchema,
     AIClueWithUnselectedWordsSchema,
+    ClueAlternateSchema,
+    ClueBatchRequestSchema,
+    ClueBatchItemSchema,
+    ClueBatchResponseSchema,
 )
-from authentication.auth import get_api_key
-from services.ai import  ai_guess_word, ai_get_clue_and_selected_words
+from authentication.auth import get_api_key, get_admin_key, is_admin_key
+from services.ai import  route_guess_word, route_clue_and_selected_words, stream_clue_and_selected_words, QUALITY_TIERS, AI_CLUE_CANDIDATES, AI_REQUESTS
+from services.concurrency_limit import ModelOverloaded
+from services.board_generator import get_board_generator, DIFFICULTIES
+from services.lexicon import ensure_lexicon
+from services.profiling import ProfilingMiddleware
+from services.wire_format import MsgPackMiddleware
+from services.idempotency import IdempotencyMiddleware, expire_idempotency_keys, IDEMPOTENCY_CLEANUP_SECONDS
+from services.traffic_capture import TrafficCaptureMiddleware, capture
+from services.metrics import render_metrics
+from services.clue_legality import clue_index
+from services.loop_watchdog import loop_watchdog, LOOP_WATCHDOG
+from data.write_batcher import puzzle_batcher, PUZZLE_WRITE_BATCHING
+from data.guess_writer import guess_writer, record_guess, GUESS_FLUSH_TIMEOUT
+from services.scheduler import schedule, start_scheduler, stop_scheduler
+from services.seeded_puzzles import (
+    get_seeded_puzzle_response,
+    prewarm_daily_puzzles,
+    daily_seed,
+    valid_seed,
+    seconds_until_next_day,
+    DAILY_PREWARM_SECONDS,
+    SEEDED_MAX_AGE,
+    SeedLimitReached,
+)
+from data.partitions import maintain_partitions, oldest_clue_id, PARTITION_MAINTENANCE_SECONDS
+from data.maintenance import maintain_puzzle_tables, MAINTENANCE_SECONDS
 from pathlib import Path
 #import bleach
 
@@ -47,6 +84,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+#Per-request profiler, enabled with X-Debug-Profile and X-Admin-Key headers
+app.add_middleware(ProfilingMiddleware)
+
+#Idempotency-Key support on the AI-backed POSTs
+app.add_middleware(IdempotencyMiddleware)
+
+#MessagePack requests and responses (Accept / Content-Type: application/msgpack)
+app.add_middleware(MsgPackMiddleware)
+
+#Records traffic for replay when TRAFFIC_CAPTURE_FILE is set, outermost
+if capture.enabled:
+    app.add_middleware(TrafficCaptureMiddleware)
+
 # del os.environ["GL_CLIENT_REDIRECT_URI"]
 # del os.environ["FB_CLIENT_REDIRECT_URI"]
 # del os.environ["X_REDIRECT_URI"]
@@ -60,8 +110,199 @@ if os.path.isfile(dotenv_file):
 # CLIENT_ID = os.environ.get("CLIENT_ID")
 # CLIENT_SECRET = os.environ.get("CLIENT_SECRET")
 
+#Most clues fetched by one /clues/batch request
+CLUE_BATCH_MAX = int(os.environ.get("CLUE_BATCH_MAX", 100))
+
 # REDIRECT_URI="https://welcome-capital-jaybird.ngrok-free.app"
 
+async def refresh_association_graph():
+    async with SessionLocal() as session:
+        #Partition retention archived clues, forget them and rebuild from what is left
+        if clue_cache.drop_below(await oldest_clue_id(session)):
+            association_graph.reset()
+        #Clues committed by other workers
+        await association_graph.refresh(session)
+
+#Background jobs, every worker runs its own copy
+schedule("prewarm_daily_puzzles", DAILY_PREWARM_SECONDS, prewarm_daily_puzzles, initial_delay=5)
+schedule("refresh_association_graph", ASSOC_REFRESH_SECONDS, refresh_association_graph, initial_delay=ASSOC_REFRESH_SECONDS)
+schedule("expire_idempotency_keys", IDEMPOTENCY_CLEANUP_SECONDS, expire_idempotency_keys, initial_delay=60)
+schedule("maintain_partitions", PARTITION_MAINTENANCE_SECONDS, maintain_partitions, initial_delay=30)
+schedule("maintain_puzzle_tables", MAINTENANCE_SECONDS, maintain_puzzle_tables, initial_delay=120)
+
+@app.on_event("startup")
+async def startup():
+    #Recompile the shared lexicon file if word_list.txt has changed
+    ensure_lexicon()
+    #id -> word map for hydrating compact boards
+    try:
+        async with SessionLocal() as session:
+            await word_index.load(session)
+        print("WORD INDEX LOADED", len(word_index))
+        clue_index.warm(word_index.words_by_id.values())
+    except Exception as e:
+        print("WORD INDEX NOT LOADED", e)
+    #Clue -> word associations from stored puzzles, answers guesses without the model
+    try:
+        async with SessionLocal() as session:
+            #Where the refresh job starts watching for archived clues
+            clue_cache.drop_below(await oldest_clue_id(session))
+            await association_graph.load(session)
+        print("ASSOCIATION GRAPH LOADED", len(association_graph))
+    except Exception as e:
+        print("ASSOCIATION GRAPH NOT LOADED", e)
+    if PUZZLE_WRITE_BATCHING:
+        puzzle_batcher.start()
+    guess_writer.start()
+    start_scheduler()
+    if LOOP_WATCHDOG:
+        loop_watchdog.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await loop_watchdog.stop()
+    await stop_scheduler()
+    #Write out any puzzles and guesses still waiting in the batchers
+    await puzzle_batcher.stop()
+    await guess_writer.stop(timeout=GUESS_FLUSH_TIMEOUT)
+    capture.close()
+
+def clue_word_selections(clue) -> list[WordSchema]:
+    """
+        Board words for a clue, from the compact columns when the words are in the
+        index, otherwise from the link rows
+    """
+    connection = clue.connection
+    if connection.word_ids is not None and all(word_index.word(word_id) for word_id in connection.word_ids):
+        return [ WordSchema(**word) for word in word_index.board_words(connection.word_ids, connection.selected_flags()) ]
+    return [ WordSchema(id=word_link.word_id, word=word_link.word.word, selected=word_link.selected) for word_link in connection.word_links ]
+
+async def save_puzzle_batched(word_objects: list, selected_flags: list, clue_text: str, response_schema):
+    """
+        Write the puzzle through the write-behind batcher and build the response
+        from what we already have instead of reading it back
+    """
+    selected_length = len([flag for flag in selected_flags if flag])
+    try:
+        saved = await puzzle_batcher.submit([word["id"] for word in word_objects], selected_flags, clue_text, selected_length)
+    except Exception as e:
+        print("BATCHED CLUE ERROR", e)
+        raise HTTPException(status_code=400, detail=f"Failed to add the clue.")
+    word_selections = [ WordSchema(id=word["id"], word=word["word"], selected=selected) for word, selected in zip(word_objects, selected_flags) ]
+    return response_schema(
+        clue_id = saved["clue_id"],
+        clue = clue_text.strip(),
+        number_of_selected_words = selected_length,
+        created_at = saved["created_at"],
+        words=word_selections
+    )
+
+async def hydrate_board(words: Optional[list] = None, word_ids: Optional[list[int]] = None, connection_id: Optional[int] = None) -> list[dict]:
+    """
+        Board as [{id, word}] from the client's words, a list of word ids or a stored
+        board. Words always come from the words table, client word strings are ignored.
+    """
+    if words is not None and word_ids is not None:
+        raise HTTPException(status_code=400, detail=f"Send either words or word_ids, not both.")
+    if words is not None:
+        word_ids = [word.id for word in words]
+    async with SessionLocal() as session:
+        if word_ids is None:
+            if connection_id is None:
+                raise HTTPException(status_code=400, detail=f"Send words, word_ids or connection_id.")
+            word_ids = await get_board_word_ids(session, connection_id)
+            if word_ids is None:
+                raise HTTPException(status_code=404, detail=f"Board {connection_id} not found.")
+        if not word_ids or len(set(word_ids)) != len(word_ids):
+            raise HTTPException(status_code=400, detail=f"A board needs distinct word ids.")
+        if not await word_index.ensure(session, word_ids):
+            raise HTTPException(status_code=400, detail=f"Unknown word ids.")
+    return [{"id": word["id"], "word": word["word"]} for word in word_index.board_words(word_ids)]
+
+async def board_from_selection(word_selection) -> list[dict]:
+    if isinstance(word_selection, BoardReferenceSchema):
+        return await hydrate_board(word_ids=word_selection.word_ids, connection_id=word_selection.connection_id)
+    return await hydrate_board(words=word_selection)
+
+async def store_clue_alternates(clue_id: int, word_objects: list, alternates: list):
+    """
+        Keep the other candidates of a clue call for the board, a failure only loses them
+    """
+    try:
+        async with SessionLocal() as session:
+            await add_clue_alternates(session, clue_id, [word["id"] for word in word_objects], alternates)
+    except Exception as e:
+        print("CLUE ALTERNATES NOT STORED", clue_id, e)
+
+async def take_alternate_clue(word_objects: list) -> dict | None:
+    """
+        An unused alternate stored for this board, as an AI clue response
+    """
+    try:
+        async with SessionLocal() as session:
+            alternate = await take_clue_alternate(session, [word["id"] for word in word_objects])
+    except Exception as e:
+        print("CLUE ALTERNATE ERROR", e)
+        return None
+    if alternate is None:
+        return None
+    selected_ids = set(alternate.selected_word_ids)
+    return {
+        "clue": alternate.clue,
+        "selected_words": [{**word, "selected": word["id"] in selected_ids} for word in word_objects],
+    }
+
+async def store_generated_clue(word_objects: list, ai_clue_response: dict) -> AIClueWithSelectedWordsSchema:
+    """
+        Store the board and the AI's clue, returns the API response
+    """
+    #Put the selection and the clue into the database
+    selected_flags = [word["selected"] for word in ai_clue_response["selected_words"]]
+    if PUZZLE_WRITE_BATCHING:
+        response = await save_puzzle_batched(word_objects, selected_flags, ai_clue_response["clue"], AIClueWithSelectedWordsSchema)
+        clue_cache.put(response.clue_id, response)
+        if ai_clue_response.get("alternates"):
+            await store_clue_alternates(response.clue_id, word_objects, ai_clue_response["alternates"])
+        return response
+    async_session = SessionLocal
+
+    clue = None
+
+    async with async_session() as session:
+        #1. Create the word selection
+        word_selection = await create_word_connection(session,[WordWithoutSelectionSchema(**word) for word in word_objects],selected_flags=selected_flags)
+        print("WORD SELECTION ID",word_selection.id)
+        #2. Create the clue
+        word_connection = await get_word_connection_by_id(session,word_selection.id)
+        word_connection_dict = word_selection.to_dict()
+        word_connection_list = [{'word_id': word['word_id'], 'selected' : word['selected'] } for word in word_connection_dict['words']]
+        selected_length = len([ word for word in word_connection_dict['words'] if word["selected"] ])
+        print("WORD connection LIST", word_connection_list)
+        print("AI CLUE RESPONSE", ai_clue_response["clue"])
+        print("SELECTED LENGTH", selected_length)
+        try:
+            clue = await add_clue_to_selection(session,word_selection.id,word_connection_list,ai_clue_response["clue"],selected_length)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to add the clue.")
+        print("CLUE ID", clue.connection.word_links)
+        word_selections = clue_word_selections(clue)
+        print("WORD SELECTIONS", word_selections)
+        print("API CLUE RESPONSE", clue.to_dict())
+        #THIS FAILS WHEN TRYING TO ASSIGN THE DATE
+        response = AIClueWithSelectedWordsSchema(
+            clue_id = clue.id,
+            clue = clue.clue,
+            number_of_selected_words = clue.clue_word_count,
+            created_at = clue.created_at,
+            words=word_selections
+        )
+        print("API RESPONSE OBJECT", response)
+
+    clue_cache.put(response.clue_id, response)
+    if ai_clue_response.get("alternates"):
+        await store_clue_alternates(response.clue_id, word_objects, ai_clue_response["alternates"])
+    return response
+
 #RESPONSE MODELS
 
 # class TranslationWithAudioResponse(BaseModel):
@@ -84,14 +325,25 @@ class InputTranslationIdToVoice(BaseModel):
 
 
 @app.get('/getwordselection', response_model=List[WordWithoutSelectionSchema])
-async def translate_word_eng_jap(api_key: str = Depends(get_api_key)):
+async def translate_word_eng_jap(difficulty: Optional[str] = Query(None, title="Board difficulty"), api_key: str = Depends(get_api_key)):
     # Create async session
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
+    async_session = SessionLocal
+
+    if difficulty is not None and difficulty not in DIFFICULTIES:
+        raise HTTPException(status_code=400, detail=f"Difficulty must be one of {', '.join(DIFFICULTIES)}.")
 
     async with async_session() as session:
-        nine_random_words = await get_random_words(session)
+        if difficulty:
+            #Board with a planted cluster of related words
+            board_generator = get_board_generator()
+            if board_generator is None:
+                raise HTTPException(status_code=503, detail=f"Board generator is not available.")
+            board = board_generator.generate_board(difficulty)
+            nine_random_words = await get_words_by_text(session, [word["word"] for word in board])
+            if len(nine_random_words) != len(board):
+                raise HTTPException(status_code=500, detail=f"Generated board does not match the word table.")
+        else:
+            nine_random_words = await get_random_words(session)
         print("NINE RANDOM WORDS", nine_random_words)
         response_test = WordWithoutSelectionSchema.model_validate(nine_random_words[0])
         response_list = [WordWithoutSelectionSchema.model_validate(word) for word in nine_random_words ]
@@ -99,85 +351,114 @@ async def translate_word_eng_jap(api_key: str = Depends(get_api_key)):
         print("RESPONSE", response_list)
     return response_list
 
+def ai_routing(
+    x_latency_budget: Optional[float] = Header(None, description="Milliseconds the caller can wait for the AI"),
+    x_quality_tier: Optional[str] = Header(None, description="fast, balanced or high"),
+) -> dict:
+    """
+        Routing hints for the AI router, read from the request headers
+    """
+    if x_quality_tier is not None and x_quality_tier not in QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"X-Quality-Tier must be one of {', '.join(QUALITY_TIERS)}.")
+    return {"budget_ms": x_latency_budget, "tier": x_quality_tier}
+
 @app.post('/guessselection', response_model=AIGuessResponseSchema)
-async def api_guess_selection(clue_with_selection : ClueWithSelectedWordsSchema, api_key: str = Depends(get_api_key)):
-    print("INPUT DATA", clue_with_selection.words)
-    word_data = [word.__dict__ for word in clue_with_selection.words]
+async def api_guess_selection(clue_with_selection : ClueWithSelectedWordsSchema, response: Response, routing: dict = Depends(ai_routing), api_key: str = Depends(get_api_key)):
+    print("INPUT DATA", clue_with_selection.words or clue_with_selection.word_ids or clue_with_selection.connection_id)
+    word_data = await hydrate_board(clue_with_selection.words, clue_with_selection.word_ids, clue_with_selection.connection_id)
     print("WORD DATA", word_data)
         
     #Get AI to make the word selection
+    usage = {}
     try:
-        ai_selection = ai_guess_word(word_data,clue_with_selection.clue,clue_with_selection.number_of_selected_words)
+        ai_selection, backend = await route_guess_word(word_data,clue_with_selection.clue,clue_with_selection.number_of_selected_words,usage=usage,**routing)
+    except ModelOverloaded:
+        raise HTTPException(status_code=503, detail=f"AI is busy, try again.", headers={"Retry-After": "1"})
     except Exception as e:
         print("AI ERROR")
         raise HTTPException(status_code=400, detail=f"Invalid AI response.")    
+    response.headers["X-AI-Backend"] = backend
+    #Queued and written in the background, doesn't delay the response
+    record_guess(
+        word_data,
+        ai_selection,
+        clue_with_selection.clue,
+        clue_with_selection.number_of_selected_words,
+        usage,
+        connection_id=clue_with_selection.connection_id,
+        clue_id=clue_with_selection.clue_id,
+    )
     #ai_selection =   [{'id': 992, 'word': 'golf', 'selected': False}, {'id': 747, 'word': 'budget', 'selected': False}, {'id': 301, 'word': 'excitement', 'selected': True}, {'id': 493, 'word': 'study', 'selected': True}, {'id': 901, 'word': 'guarantee', 'selected': False}, {'id': 1092, 'word': 'anger', 'selected': False}, {'id': 486, 'word': 'work', 'selected': True}, {'id': 1515, 'word': 'silly', 'selected': False}, {'id': 942, 'word': 'holiday', 'selected': False}]
     ai_guess_response = [ WordSchema.model_validate(guess) for guess in ai_selection]
-    response = AIGuessResponseSchema(
+    guess_response = AIGuessResponseSchema(
         clue=clue_with_selection.clue,
         number_of_selected_words=clue_with_selection.number_of_selected_words,
         words=ai_guess_response,
     )
-    print("AI SELECTION", response)
+    print("AI SELECTION", guess_response)
     #NOT SURE IF THE RESPONSE IS RIGHT AS IT MIGHT BE MUSSING THE SELECTIONS
     
-    return response
+    return guess_response
 
 @app.post('/generatewordsandcluefromselection', response_model=AIClueWithSelectedWordsSchema)
-async def api_generate_clue(word_selection: List[WordWithoutSelectionSchema] , api_key: str = Depends(get_api_key)):
+async def api_generate_clue(word_selection: Union[List[WordWithoutSelectionSchema], BoardReferenceSchema] , http_response: Response, routing: dict = Depends(ai_routing), api_key: str = Depends(get_api_key)):
     """
-        Human sends a selection of words and the AI generates a clue
+        Human sends a selection of words (or just a board reference) and the AI generates a clue
     """
     print("INPUT DATA", word_selection)
-    word_objects = [{"id": word.id, "word" : word.word} for word in word_selection]
+    word_objects = await board_from_selection(word_selection)
     print("INPUT DATA WORD OBJECTS", word_objects)
-    try:
-        ai_clue_response = ai_get_clue_and_selected_words(word_objects)
-    except Exception as e:
-        print("AI ERROR", e)
-        raise HTTPException(status_code=400, detail=f"Invalid AI response.")
+    #A board played before may have alternates left from an earlier call
+    ai_clue_response = await take_alternate_clue(word_objects) if AI_CLUE_CANDIDATES > 1 else None
+    if ai_clue_response is not None:
+        backend = "alternate"
+        AI_REQUESTS.inc(kind="clue", backend=backend)
+    else:
+        try:
+            ai_clue_response, backend = await route_clue_and_selected_words(word_objects, **routing)
+        except ModelOverloaded:
+            raise HTTPException(status_code=503, detail=f"AI is busy, try again.", headers={"Retry-After": "1"})
+        except Exception as e:
+            print("AI ERROR", e)
+            raise HTTPException(status_code=400, detail=f"Invalid AI response.")
+    http_response.headers["X-AI-Backend"] = backend
     print("API AI RESPONSE", ai_clue_response)
     #ai_clue_response = {'clue': 'leisure', 'selected_words': [{'id': 992, 'word': 'golf', 'selected': True}, {'id': 747, 'word': 'budget', 'selected': False}, {'id': 301, 'word': 'excitement', 'selected': False}, {'id': 493, 'word': 'study', 'selected': False}, {'id': 901, 'word': 'guarantee', 'selected': False}, {'id': 1092, 'word': 'anger', 'selected': False}, {'id': 486, 'word': 'work', 'selected': False}, {'id': 1515, 'word': 'silly', 'selected': False}, {'id': 942, 'word': 'holiday', 'selected': True}]}
-    #Put the selection and the clue into the database
-    selected_flags = [word["selected"] for word in ai_clue_response["selected_words"]]
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
+    return await store_generated_clue(word_objects, ai_clue_response)
 
-    clue = None
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
-    async with async_session() as session:
-        #1. Create the word selection
-        word_selection = await create_word_connection(session,word_selection,selected_flags=selected_flags)
-        print("WORD SELECTION ID",word_selection.id)
-        #2. Create the clue
-        word_connection = await get_word_connection_by_id(session,word_selection.id)
-        word_connection_dict = word_selection.to_dict()
-        word_connection_list = [{'word_id': word['word_id'], 'selected' : word['selected'] } for word in word_connection_dict['words']]
-        selected_length = len([ word for word in word_connection_dict['words'] if word["selected"] ])
-        print("WORD connection LIST", word_connection_list)
-        print("AI CLUE RESPONSE", ai_clue_response["clue"])
-        print("SELECTED LENGTH", selected_length)
+@app.post('/generatewordsandcluefromselection/stream')
+async def api_generate_clue_stream(word_selection: Union[List[WordWithoutSelectionSchema], BoardReferenceSchema], api_key: str = Depends(get_api_key)):
+    """
+        Streaming /generatewordsandcluefromselection over server-sent events:
+        `clue` as soon as the model has written it, a `word` per parsed selection,
+        then `done` with the stored response (or `error`). Takes an Idempotency-Key
+        like the other AI endpoints, a retry gets the stored events at once.
+        With X-Debug-Profile the whole stream is buffered and sent when it ends.
+    """
+    word_objects = await board_from_selection(word_selection)
+
+    async def events():
         try:
-            clue = await add_clue_to_selection(session,word_selection.id,word_connection_list,ai_clue_response["clue"],selected_length)
+            async for kind, value in stream_clue_and_selected_words(word_objects):
+                if kind == "clue":
+                    yield sse_event("clue", {"clue": value})
+                elif kind == "word":
+                    yield sse_event("word", value)
+                else:
+                    response = await store_generated_clue(word_objects, value)
+                    yield sse_event("done", response.model_dump(mode="json"))
+        except HTTPException as e:
+            yield sse_event("error", {"detail": e.detail})
+        except ModelOverloaded:
+            yield sse_event("error", {"detail": "AI is busy, try again."})
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to add the clue.")
-        print("CLUE ID", clue.connection.word_links)
-        word_selections = [ WordSchema(id=word_link.word_id, word=word_link.word.word, selected=word_link.selected) for word_link in clue.connection.word_links ]
-        print("WORD SELECTIONS", word_selections)
-        print("API CLUE RESPONSE", clue.to_dict())
-        #THIS FAILS WHEN TRYING TO ASSIGN THE DATE
-        response = AIClueWithSelectedWordsSchema(
-            clue_id = clue.id,
-            clue = clue.clue,
-            number_of_selected_words = clue.clue_word_count,
-            created_at = clue.created_at,
-            words=word_selections
-        )
-        print("API RESPONSE OBJECT", response)
+            print("AI ERROR", e)
+            yield sse_event("error", {"detail": "Invalid AI response."})
 
-
-    return response
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 
@@ -186,9 +467,7 @@ async def api_generate_words_and_clie( api_key: str = Depends(get_api_key)):
     """
         Words selection is generated and AI creates the clue
     """
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
+    async_session = SessionLocal
 
     clue = None
 
@@ -207,6 +486,8 @@ async def api_generate_words_and_clie( api_key: str = Depends(get_api_key)):
         ai_clue_response = {'clue': 'light', 'selected_words': [{'id': 1327, 'word': 'deep', 'selected': False}, {'id': 1064, 'word': 'candle', 'selected': True}, {'id': 3, 'word': 'way', 'selected': False}, {'id': 1334, 'word': 'cancel', 'selected': False}, {'id': 1078, 'word': 'pension', 'selected': False}, {'id': 941, 'word': 'grade', 'selected': False}, {'id': 536, 'word': 'fat', 'selected': False}, {'id': 870, 'word': 'interview', 'selected': False}, {'id': 1514, 'word': 'rub', 'selected': False}]}
         print("API AI RESPONSE", ai_clue_response)
         selected_flags = [word["selected"] for word in ai_clue_response["selected_words"]]
+        if PUZZLE_WRITE_BATCHING:
+            return await save_puzzle_batched(word_objects, selected_flags, ai_clue_response["clue"], AIClueWithUnselectedWordsSchema)
         word_selection = await create_word_connection(session,word_connection,selected_flags=selected_flags)
         print("WORD SELECTION ID",word_selection.id)
         #2. Create the clue
@@ -222,7 +503,7 @@ async def api_generate_words_and_clie( api_key: str = Depends(get_api_key)):
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to add the clue.")
         print("CLUE ID", clue.connection.word_links)
-        word_selections = [ WordSchema(id=word_link.word_id, word=word_link.word.word, selected=word_link.selected) for word_link in clue.connection.word_links ]
+        word_selections = clue_word_selections(clue)
         print("WORD SELECTIONS", word_selections)
         print("API CLUE RESPONSE", clue.to_dict())
         #THIS FAILS WHEN TRYING TO ASSIGN THE DATE
@@ -239,32 +520,148 @@ async def api_generate_words_and_clie( api_key: str = Depends(get_api_key)):
     return response
 
 
-@app.get('/getclueresponsefromid', response_model=AIClueWithSelectedWordsSchema)
-async def api_get_clue_response_from_id(clue_id: int = Query(0, title="Clue ID"),api_key: str = Depends(get_api_key)):
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
+def clue_response(clue) -> AIClueWithSelectedWordsSchema:
+    return AIClueWithSelectedWordsSchema(
+        clue_id = clue.id,
+        clue = clue.clue,
+        number_of_selected_words = clue.clue_word_count,
+        created_at = clue.created_at,
+        words=clue_word_selections(clue)
     )
 
-    clue = None
-
-    async with async_session() as session:
+async def get_clue_responses(clue_ids: list[int]) -> dict[int, AIClueWithSelectedWordsSchema]:
+    """
+        {clue_id: response} for the ids that exist. Cached responses first, the rest in
+        one compact query plus one query per level for boards that need their link rows.
+    """
+    responses = clue_cache.get_many(clue_ids)
+    missing = [clue_id for clue_id in dict.fromkeys(clue_ids) if clue_id not in responses]
+    if not missing:
+        return responses
+    async with SessionLocal() as session:
         try:
-            clue = await get_clue_by_id(session,clue_id)
+            clues = await get_clues_by_ids_compact(session, missing)
+            await word_index.ensure(session, [word_id for clue in clues.values() for word_id in clue.connection.word_ids])
+            #Legacy boards, and boards with words that are not in the words table
+            clues = {clue_id: clue for clue_id, clue in clues.items() if all(word_index.word(word_id) for word_id in clue.connection.word_ids)}
+            legacy = [clue_id for clue_id in missing if clue_id not in clues]
+            if legacy:
+                clues.update(await get_clues_by_ids(session, legacy))
         except Exception as e:
             print("ERROR OCCURRED", e)
-            raise HTTPException(status_code=400, detail=f"An error occurred fetching the clue.")
-    if not clue:
+            raise HTTPException(status_code=400, detail=f"An error occurred fetching the clues.")
+    for clue_id, clue in clues.items():
+        responses[clue_id] = clue_response(clue)
+        clue_cache.put(clue_id, responses[clue_id])
+    return responses
+
+@app.get('/getclueresponsefromid', response_model=AIClueWithSelectedWordsSchema)
+async def api_get_clue_response_from_id(clue_id: int = Query(0, title="Clue ID"),api_key: str = Depends(get_api_key)):
+    response = (await get_clue_responses([clue_id])).get(clue_id)
+    if response is None:
         raise HTTPException(status_code=404, detail=f"Clue not found.")
-    word_selections = [ WordSchema(id=word_link.word_id, word=word_link.word.word, selected=word_link.selected) for word_link in clue.connection.word_links ]
-    response = AIClueWithSelectedWordsSchema(
-        clue_id = clue.id,
-        clue = clue.clue,
-        number_of_selected_words = clue.clue_word_count,
-        created_at = clue.created_at,
-        words=word_selections
-    )
     return response
 
+async def api_clue_batch(clue_ids: list[int]) -> ClueBatchResponseSchema:
+    if not clue_ids:
+        raise HTTPException(status_code=400, detail=f"At least one clue id is needed.")
+    if len(clue_ids) > CLUE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {CLUE_BATCH_MAX} clue ids per request.")
+    responses = await get_clue_responses(clue_ids)
+    return ClueBatchResponseSchema(clues=[
+        ClueBatchItemSchema(clue_id=clue_id, found=clue_id in responses, response=responses.get(clue_id))
+        for clue_id in clue_ids
+    ])
+
+@app.get('/clues/batch', response_model=ClueBatchResponseSchema)
+async def api_get_clue_batch(ids: str = Query(..., title="Comma separated clue IDs"), api_key: str = Depends(get_api_key)):
+    """
+        Many clue responses at once, in the order of `ids`, e.g. ?ids=12,7,31
+    """
+    try:
+        clue_ids = [int(clue_id) for clue_id in ids.split(",") if clue_id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"ids must be comma separated integers.")
+    return await api_clue_batch(clue_ids)
+
+@app.get('/clues/{clue_id}/alternates', response_model=List[ClueAlternateSchema])
+async def api_get_clue_alternates(clue_id: int, api_key: str = Depends(get_api_key)):
+    """
+        The other valid clues the model gave for this clue's board, best first.
+        They select different words, so they also serve as easier or harder variants.
+    """
+    response = (await get_clue_responses([clue_id])).get(clue_id)
+    if response is None:
+        raise HTTPException(status_code=404, detail=f"Clue not found.")
+    async with SessionLocal() as session:
+        alternates = await get_clue_alternates(session, clue_id)
+    return [
+        ClueAlternateSchema(
+            clue = alternate.clue,
+            number_of_selected_words = alternate.clue_word_count,
+            words = [ WordSchema(id=word.id, word=word.word, selected=word.id in alternate.selected_word_ids) for word in response.words ],
+            used = alternate.used_at is not None,
+        )
+        for alternate in alternates
+    ]
+
+@app.post('/clues/batch', response_model=ClueBatchResponseSchema)
+async def api_post_clue_batch(batch: ClueBatchRequestSchema, api_key: str = Depends(get_api_key)):
+    """
+        Same as GET /clues/batch, for id lists too long for a query string
+    """
+    return await api_clue_batch(batch.ids)
+
+def cached_puzzle_response(request: Request, puzzle, cache_control: str) -> Response:
+    headers = {"Cache-Control": cache_control, "ETag": puzzle.etag}
+    if request.headers.get("if-none-match") == puzzle.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=puzzle.body, media_type="application/json", headers=headers)
+
+async def seeded_puzzle_or_error(seed: str, limited: bool = False):
+    try:
+        return await get_seeded_puzzle_response(seed, limited)
+    except SeedLimitReached as e:
+        print("SEEDED PUZZLE LIMIT", seed, e)
+        raise HTTPException(status_code=429, detail=f"Too many new seeds, try again later.", headers={"Retry-After": "3600"})
+    except Exception as e:
+        print("SEEDED PUZZLE ERROR", seed, e)
+        raise HTTPException(status_code=503, detail=f"Puzzle is not available yet.")
+
+@app.get('/puzzle/daily', response_model=AIClueWithUnselectedWordsSchema)
+async def api_daily_puzzle(request: Request, api_key: str = Depends(get_api_key)):
+    """
+        Today's (UTC) puzzle, the same for every player
+    """
+    puzzle = await seeded_puzzle_or_error(daily_seed())
+    #Expire exactly when the day rolls over. Private, the endpoint needs an API key and a
+    #shared cache would serve it without one
+    max_age = seconds_until_next_day()
+    return cached_puzzle_response(request, puzzle, f"private, max-age={max_age}")
+
+@app.get('/puzzle/seed/{seed}', response_model=AIClueWithUnselectedWordsSchema)
+async def api_seeded_puzzle(seed: str, request: Request, api_key: str = Depends(get_api_key)):
+    """
+        Puzzle derived from any seed, a seed's puzzle never changes.
+        New seeds cost a model call and are capped at SEEDED_NEW_PER_HOUR, except for admins.
+    """
+    if not valid_seed(seed):
+        raise HTTPException(status_code=400, detail=f"Seed must be 1-64 letters, digits, '-' or '_'.")
+    if seed.startswith("daily-"):
+        #Would let players read tomorrow's daily puzzle early
+        raise HTTPException(status_code=400, detail=f"Daily puzzles are only served from /puzzle/daily.")
+    puzzle = await seeded_puzzle_or_error(seed, limited=not is_admin_key(request.headers.get("x-admin-key")))
+    return cached_puzzle_response(request, puzzle, f"private, max-age={SEEDED_MAX_AGE}, immutable")
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def api_metrics(api_key: str = Depends(get_api_key)):
+    return render_metrics()
+
+@app.get('/debug/loop-stalls')
+async def api_loop_stalls(admin_key: str = Depends(get_admin_key)):
+    #Most recent first
+    return list(reversed(loop_watchdog.captures))
+
 async def start_fastapi():
     config = Config(app=app, host="0.0.0.0", port=8000, loop="asyncio", reload=True)
     server = Server(config)
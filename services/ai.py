@@ -1,9 +1,19 @@
 import dotenv
 import os
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APITimeoutError
 import json
 import ast
 import re
+import time
+import asyncio
+from collections import OrderedDict, deque
+from .metrics import Counter, Gauge
+from .clue_legality import clue_index
+from .local_engine import local_available, local_guess_word, local_get_clue_and_selected_words
+from .traffic_capture import capture, ai_replay
+from .disk_cache import open_disk_cache
+from .concurrency_limit import AdaptiveLimiter, ModelOverloaded, export_metrics
+from data.association_graph import association_graph
 
 dotenv_file = ".env"
 if os.path.isfile(dotenv_file):
@@ -11,6 +21,41 @@ if os.path.isfile(dotenv_file):
 
 API_KEY = os.environ.get("OPENAI_API_KEY")
 
+#MODEL CONFIG
+AI_MODEL = os.environ.get("AI_MODEL", "gpt-4o-mini")
+AI_TEMPERATURE = float(os.environ.get("AI_TEMPERATURE", 0.2))
+AI_LINK_MAX_TOKENS = int(os.environ.get("AI_LINK_MAX_TOKENS", 100))
+AI_CLUE_MAX_TOKENS = int(os.environ.get("AI_CLUE_MAX_TOKENS", 500))
+AI_GUESS_MAX_TOKENS = int(os.environ.get("AI_GUESS_MAX_TOKENS", 300))
+#Ranked candidate clues asked for per clue call, the best valid one is used and the rest
+#are kept as alternates for the board. 1 asks for a single clue.
+AI_CLUE_CANDIDATES = int(os.environ.get("AI_CLUE_CANDIDATES", 1))
+
+_client = None
+_async_client = None
+
+def get_client() -> OpenAI:
+    """
+        One client per process so connections to the API are reused
+    """
+    global _client
+    if not API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    if _client is None:
+        _client = OpenAI(api_key=API_KEY)
+    return _client
+
+def get_async_client() -> AsyncOpenAI:
+    """
+        Async client for streaming, the stream is consumed on the event loop
+    """
+    global _async_client
+    if not API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    if _async_client is None:
+        _async_client = AsyncOpenAI(api_key=API_KEY)
+    return _async_client
+
 class AIResponseNotValid(Exception):
     """Raised when the AI response does not match the expected format or schema."""
 
@@ -44,10 +89,7 @@ def ai_get_linking_word(list_of_word_objects:list) -> str:
         :return: linking_word
         :rtype: str
     """
-    if not API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not set")
-    
-    client = OpenAI(api_key=API_KEY)
+    client = get_client()
 
     # --- PROMPT FOR AI ---
     prompt = f"""
@@ -74,13 +116,13 @@ def ai_get_linking_word(list_of_word_objects:list) -> str:
 
     # --- API CALL ---
     response = client.responses.create(
-        model="gpt-4o-mini",
+        model=AI_MODEL,
         input=[
             {"role": "system", "content": "You are generating a clue for a word connection game."},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.2,
-        max_output_tokens=100
+        temperature=AI_TEMPERATURE,
+        max_output_tokens=AI_LINK_MAX_TOKENS
     )
 
     # --- EXTRACT TEXT OUTPUT ---
@@ -114,28 +156,17 @@ def validate_ai_clue(original_words:list,ai_response:list, clue:str) -> bool:
     if set(original_words) != set(response_words):
         print("Words do not match")
         return False
-    #Check the clue word
-    if clue in original_words:
-        print("Clue is in word list")
+    #Check the clue word isn't (close to) one of the words
+    if not clue_index.is_legal(clue, original_words):
+        print("Clue is too close to a word in the list", clue, clue_index.rejection(clue, original_words))
         return False
     return True
 
-def ai_get_clue_and_selected_words(list_of_word_objects:list) -> str:
+def clue_prompt(list_of_word_objects:list) -> str:
     """
-        Get a clue to match a slection of words from open AI
-        
-        :param list_of_word_objects: Description
-        :type list_of_word_objects: list
-        :return: linking_word
-        :rtype: str
+        Prompt for ai_get_clue_and_selected_words and its streaming variant
     """
-    if not API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not set")
-    
-    client = OpenAI(api_key=API_KEY)
-
-    # --- PROMPT FOR AI ---
-    prompt = f"""
+    return f"""
         You are generating a clue for a word connection game.
 
         You are given this list of word objects in JSON format:
@@ -178,16 +209,123 @@ def ai_get_clue_and_selected_words(list_of_word_objects:list) -> str:
         The selected_words array MUST contain the same number of objects as the input.
     """
 
+def clue_candidates_prompt(list_of_word_objects:list, candidates:int) -> str:
+    """
+        Prompt for ai_get_clue_and_selected_words asking for several ranked clues at once
+    """
+    return f"""
+        You are generating clues for a word connection game.
+
+        You are given this list of word objects in JSON format:
+        {list_of_word_objects}
+
+        Each object contains:
+        - "id": integer
+        - "word": string
+
+        Your task:
+
+        1. Generate {candidates} DIFFERENT candidate clues, each ONE single English word.
+        2. No clue may match or contain any word in the list, or be a form of one.
+        3. For each clue, select the words that have a strong, clear, and guessable association with it.
+        4. Each clue must select at least one word.
+        5. Aim to maximise the number of selected words, but NEVER at the expense of strong association.
+        6. Weak or vague associations are not allowed.
+        7. Rank the candidates from best to worst.
+
+        CRITICAL STRUCTURE RULES:
+        - Every candidate MUST return ALL original objects.
+        - You MUST preserve the original order.
+        - You MUST NOT modify any "id" values.
+        - You MUST NOT modify any "word" values.
+        - You may ONLY add a boolean field called "selected".
+        - Every object must contain: id, word, selected.
+
+        Output Rules:
+        - Return ONLY valid JSON.
+        - No markdown.
+        - No explanations.
+        - The JSON must match this exact structure:
+
+        {{
+        "candidates": [
+            {{
+            "clue": "<single_word>",
+            "selected_words": [
+                {{ "id": <original_id>, "word": "<original_word>", "selected": true_or_false }}
+            ]
+            }}
+        ]
+        }}
+
+        Each selected_words array MUST contain the same number of objects as the input.
+    """
+
+def select_clue_candidates(list_of_word_objects:list, candidates:list) -> tuple[dict | None, list]:
+    """
+        Validate ranked candidates locally. Returns (best, alternates), best is None when
+        no candidate is valid.
+    """
+    valid = []
+    seen = set()
+    for candidate in candidates:
+        try:
+            clue = candidate["clue"].strip()
+            selected_words = candidate["selected_words"]
+            is_valid = (
+                clue.lower() not in seen
+                and any(word.get("selected") is True for word in selected_words)
+                and validate_ai_clue(list_of_word_objects, selected_words, clue)
+            )
+        except (KeyError, TypeError, AttributeError):
+            is_valid = False
+        if not is_valid:
+            AI_CLUE_CANDIDATE_OUTCOMES.inc(outcome="rejected")
+            continue
+        seen.add(clue.lower())
+        valid.append({"clue": clue, "selected_words": selected_words})
+    if not valid:
+        return None, []
+    AI_CLUE_CANDIDATE_OUTCOMES.inc(outcome="accepted")
+    if len(valid) > 1:
+        AI_CLUE_CANDIDATE_OUTCOMES.inc(len(valid) - 1, outcome="alternate")
+    return valid[0], valid[1:]
+
+def ai_get_clue_and_selected_words(list_of_word_objects:list, candidates:int = AI_CLUE_CANDIDATES, usage:dict|None=None) -> str:
+    """
+        Get a clue to match a slection of words from open AI
+        
+        :param list_of_word_objects: Description
+        :type list_of_word_objects: list
+        :param candidates: Number of ranked clues to ask for in the one call. With more than
+            one the result also has "alternates", the other valid candidates in rank order
+        :type candidates: int
+        :param usage: Optional dict filled with model, latency_ms, input_tokens and output_tokens
+        :type usage: dict
+        :return: linking_word
+        :rtype: str
+    """
+    client = get_client()
+
+    # --- PROMPT FOR AI ---
+    prompt = clue_candidates_prompt(list_of_word_objects, candidates) if candidates > 1 else clue_prompt(list_of_word_objects)
+
     # --- API CALL ---
+    started = time.perf_counter()
     response = client.responses.create(
-        model="gpt-4o-mini",
+        model=AI_MODEL,
         input=[
             {"role": "system", "content": "You are generating a clue for a word connection game."},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.2,
-        max_output_tokens=500
+        temperature=AI_TEMPERATURE,
+        max_output_tokens=AI_CLUE_MAX_TOKENS * candidates
     )
+    if usage is not None:
+        usage["model"] = response.model
+        usage["latency_ms"] = int((time.perf_counter() - started) * 1000)
+        usage["input_tokens"] = response.usage.input_tokens if response.usage else None
+        usage["output_tokens"] = response.usage.output_tokens if response.usage else None
 
     # --- EXTRACT TEXT OUTPUT ---
     # Raw model output
@@ -202,6 +340,16 @@ def ai_get_clue_and_selected_words(list_of_word_objects:list) -> str:
 
     #selected_words_list = ast.literal_eval(response.output_text.strip())
     print("SELECTED WORDS", selected_words_with_clue)
+    if candidates > 1:
+        #One invalid candidate no longer costs another round-trip
+        best, alternates = select_clue_candidates(list_of_word_objects, selected_words_with_clue.get("candidates") or [])
+        if best is None:
+            raise AIResponseNotValid(
+                message="No valid clue among the candidates.",
+                response=response,
+                errors=["Invalid clue response from AI"]
+            )
+        return {**best, "alternates": alternates}
     #TODO:
     #Need to validate the response, 
     #   1 .word ids and words must match
@@ -237,7 +385,7 @@ def validate_ai_output(original_words : list, generated_words: list, number_of_w
     return True
 
 
-def ai_guess_word(list_of_word_objects:list,clue:str,num_words_to_select:int) -> list:
+def ai_guess_word(list_of_word_objects:list,clue:str,num_words_to_select:int,usage:dict|None=None) -> list:
     """
         Docstring for ai_guess_word
         
@@ -247,13 +395,12 @@ def ai_guess_word(list_of_word_objects:list,clue:str,num_words_to_select:int) ->
         :type clue: str
         :param noOfWords: Description
         :type noOfWords: int
+        :param usage: Optional dict filled with model, latency_ms, input_tokens and output_tokens
+        :type usage: dict
         :return: Description
         :rtype: list
     """
-    if not API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not set")
-    
-    client = OpenAI(api_key=API_KEY)
+    client = get_client()
 
     # --- PROMPT FOR AI ---
     prompt = f"""
@@ -289,15 +436,21 @@ def ai_guess_word(list_of_word_objects:list,clue:str,num_words_to_select:int) ->
     """
     print("PROMPT",prompt)
 
+    started = time.perf_counter()
     response = client.responses.create(
-        model="gpt-4o-mini",
+        model=AI_MODEL,
         input=[
             {"role": "system", "content": "You are an AI that selects words for a word connection game."},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.2,
-        max_output_tokens=300
+        temperature=AI_TEMPERATURE,
+        max_output_tokens=AI_GUESS_MAX_TOKENS
     )
+    if usage is not None:
+        usage["model"] = response.model
+        usage["latency_ms"] = int((time.perf_counter() - started) * 1000)
+        usage["input_tokens"] = response.usage.input_tokens if response.usage else None
+        usage["output_tokens"] = response.usage.output_tokens if response.usage else None
 
     # Raw model output
     raw_output = response.output_text.strip()
@@ -321,6 +474,414 @@ def ai_guess_word(list_of_word_objects:list,clue:str,num_words_to_select:int) ->
     #Need to validate the output to check that has selected the given amount and that it hasn't invented words
     return selected_words_list
 
+
+#LATENCY-BUDGET ROUTING
+#Each request can carry a latency budget (ms) and/or a quality tier. The router answers
+#from the cache if it can, otherwise picks the best backend whose recent latency fits:
+#   remote - the model above, best quality
+#   local  - services/local_engine.py heuristics, sub-millisecond
+#Guesses are first tried against the association graph of stored clues (data/association_graph.py)
+#Model calls go through an adaptive concurrency limit (services/concurrency_limit.py), a call
+#that can't get a slot in time is answered locally when possible, else raises ModelOverloaded
+
+AI_CACHE_SIZE = int(os.environ.get("AI_CACHE_SIZE", 2048))
+AI_LATENCY_WINDOW = int(os.environ.get("AI_LATENCY_WINDOW", 200))
+AI_LATENCY_MAX_AGE = float(os.environ.get("AI_LATENCY_MAX_AGE", 300))
+AI_ROUTE_PERCENTILE = float(os.environ.get("AI_ROUTE_PERCENTILE", 95))
+#Samples needed before a backend's percentile is trusted, until then it is assumed to fit
+AI_ROUTE_MIN_SAMPLES = int(os.environ.get("AI_ROUTE_MIN_SAMPLES", 10))
+
+QUALITY_TIERS = ("fast", "balanced", "high")
+
+AI_REQUESTS = Counter("ai_requests_total", "AI requests by kind and the backend that served them")
+AI_BACKEND_LATENCY = Gauge("ai_backend_latency_ms", "Rolling latency percentiles per AI backend")
+AI_GUESS_WITHOUT_MODEL = Gauge("ai_guess_without_model_ratio", "Fraction of guesses answered without a model call")
+AI_CLUE_CANDIDATE_OUTCOMES = Counter("ai_clue_candidates_total", "Candidate clues from the model, by outcome")
+AI_CLUE_TOKENS = Counter("ai_clue_tokens_total", "Model tokens spent generating clues, by direction")
+AI_TOKENS_PER_CLUE = Gauge("ai_tokens_per_accepted_clue", "Model tokens per clue used from a model call, alternates included")
+AI_CACHE_REQUESTS = Counter("ai_cache_requests_total", "AI result cache lookups, by tier (memory, disk) and result")
+AI_CACHE_HIT_RATIO = Gauge("ai_cache_hit_ratio", "Fraction of lookups that hit, per cache tier")
+
+
+class LatencyTracker:
+    """
+        Rolling window of recent latencies for one backend. Samples older than
+        AI_LATENCY_MAX_AGE are ignored, so a backend that was skipped for being slow
+        gets tried again once its bad samples age out.
+    """
+
+    def __init__(self, window: int = AI_LATENCY_WINDOW, max_age: float = AI_LATENCY_MAX_AGE):
+        self.samples = deque(maxlen=window)
+        self.max_age = max_age
+
+    def record(self, latency_ms: float):
+        self.samples.append((time.monotonic(), latency_ms))
+
+    def recent(self) -> list[float]:
+        cutoff = time.monotonic() - self.max_age
+        return [latency_ms for recorded, latency_ms in self.samples if recorded >= cutoff]
+
+    def percentile(self, p: float) -> float | None:
+        ordered = sorted(self.recent())
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class ResultCache:
+    """
+        In-process LRU of AI results, keyed by the request's inputs, in front of the
+        disk cache shared by every worker (services/disk_cache.py)
+    """
+
+    def __init__(self, size: int = AI_CACHE_SIZE, disk=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.disk = disk
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def lookup(self, key):
+        """
+            Memory first, then disk. A disk hit is promoted to memory.
+        """
+        value = self.get(key)
+        AI_CACHE_REQUESTS.inc(tier="memory", result="hit" if value is not None else "miss")
+        if value is not None or self.disk is None:
+            return value
+        try:
+            value = await asyncio.to_thread(self.disk.get, key)
+        except Exception as e:
+            print("AI DISK CACHE ERROR", e)
+            return None
+        AI_CACHE_REQUESTS.inc(tier="disk", result="hit" if value is not None else "miss")
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    async def store(self, key, value):
+        self.put(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, value)
+            except Exception as e:
+                print("AI DISK CACHE ERROR", e)
+
+
+latency = {"remote": LatencyTracker(), "local": LatencyTracker()}
+#429s and timeouts from the API cut the limit like slow responses do
+model_limiter = AdaptiveLimiter(overload_errors=(RateLimitError, APITimeoutError))
+export_metrics(model_limiter)
+#Keyed by model, a different model doesn't reuse another's answers. Replays start cold
+#so builds are compared on the same model calls.
+result_cache = ResultCache(disk=None if ai_replay.active else open_disk_cache(AI_MODEL))
+
+
+def _cache_hit_ratios() -> dict:
+    counts = {}
+    for key, count in AI_CACHE_REQUESTS.values.items():
+        labels = dict(key)
+        hits, total = counts.get(labels["tier"], (0, 0))
+        counts[labels["tier"]] = (hits + (count if labels["result"] == "hit" else 0), total + count)
+    return {(("tier", tier),): round(hits / total, 4) for tier, (hits, total) in counts.items() if total}
+
+AI_CACHE_HIT_RATIO.set_function(_cache_hit_ratios)
+
+AI_BACKEND_LATENCY.set_function(lambda: {
+    (("backend", name), ("percentile", p)): value
+    for name, tracker in latency.items()
+    for p in (50, 95)
+    if (value := tracker.percentile(p)) is not None
+})
+
+
+def _guess_without_model_ratio() -> float:
+    served = {dict(key)["backend"]: count for key, count in AI_REQUESTS.values.items() if dict(key)["kind"] == "guess"}
+    total = sum(served.values())
+    return round((total - served.get("remote", 0)) / total, 4) if total else 0
+
+AI_GUESS_WITHOUT_MODEL.set_function(_guess_without_model_ratio)
+
+
+def _tokens_per_accepted_clue() -> float:
+    served = {dict(key)["backend"]: count for key, count in AI_REQUESTS.values.items() if dict(key)["kind"] == "clue"}
+    accepted = served.get("remote", 0) + served.get("alternate", 0)
+    tokens = sum(AI_CLUE_TOKENS.values.values())
+    return round(tokens / accepted, 1) if accepted else 0
+
+AI_TOKENS_PER_CLUE.set_function(_tokens_per_accepted_clue)
+
+
+def record_clue_usage(usage: dict):
+    AI_CLUE_TOKENS.inc(usage.get("input_tokens") or 0, direction="input")
+    AI_CLUE_TOKENS.inc(usage.get("output_tokens") or 0, direction="output")
+
+
+def choose_backend(budget_ms: float | None, tier: str | None) -> str:
+    #No neighbour file, the local engine can't answer, every tier goes to the model
+    if not local_available():
+        return "remote"
+    if tier == "fast":
+        return "local"
+    if tier == "high" or budget_ms is None:
+        return "remote"
+    remote = latency["remote"]
+    if len(remote.recent()) < AI_ROUTE_MIN_SAMPLES or remote.percentile(AI_ROUTE_PERCENTILE) <= budget_ms:
+        return "remote"
+    return "local"
+
+
+def _guess_key(list_of_word_objects: list, clue: str, num_words_to_select: int) -> tuple:
+    return ("guess", clue.strip().lower(), num_words_to_select, tuple((w["id"], w["word"]) for w in list_of_word_objects))
+
+
+def _clue_key(list_of_word_objects: list) -> tuple:
+    return ("clue", tuple((w["id"], w["word"]) for w in list_of_word_objects))
+
+
+async def _run_backend(backend: str, function, *args, **kwargs):
+    if backend == "remote":
+        #Guesses and clues are limited together but judged against their own latency
+        kind = function.__name__
+        if ai_replay.active:
+            #Replaying a capture, recorded results at their recorded latencies
+            function = ai_replay.stub(function)
+        async with model_limiter.slot(kind):
+            #Timed inside the slot, the wait for it is not the backend's latency
+            started = time.perf_counter()
+            #The OpenAI SDK is synchronous, keep it off the event loop
+            result = await asyncio.to_thread(function, *args, **kwargs)
+            latency_ms = (time.perf_counter() - started) * 1000
+    else:
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        latency_ms = (time.perf_counter() - started) * 1000
+    latency[backend].record(latency_ms)
+    if backend == "remote" and capture.enabled:
+        capture.record_ai(function.__name__, args, kwargs.get("usage"), result, latency_ms)
+    return result
+
+
+async def route_guess_word(
+    list_of_word_objects: list,
+    clue: str,
+    num_words_to_select: int,
+    budget_ms: float | None = None,
+    tier: str | None = None,
+    usage: dict | None = None,
+) -> tuple[list, str]:
+    """
+        ai_guess_word behind the cache and latency router.
+        Returns (selection, backend) where backend is "cache", "graph", "local" or "remote".
+    """
+    key = _guess_key(list_of_word_objects, clue, num_words_to_select)
+    cached = await result_cache.lookup(key)
+    if cached is not None:
+        backend, selection = "cache", [dict(word) for word in cached]
+    elif (selection := association_graph.guess(list_of_word_objects, clue, num_words_to_select)) is not None:
+        backend = "graph"
+    elif choose_backend(budget_ms, tier) == "local":
+        backend = "local"
+        selection = await _run_backend("local", local_guess_word, list_of_word_objects, clue, num_words_to_select)
+    else:
+        try:
+            selection = await _run_backend("remote", ai_guess_word, list_of_word_objects, clue, num_words_to_select, usage=usage)
+            backend = "remote"
+            await result_cache.store(key, [dict(word) for word in selection])
+        except ModelOverloaded:
+            if not local_available():
+                raise
+            #Shed to the local engine rather than fail the guess
+            backend = "local"
+            selection = await _run_backend("local", local_guess_word, list_of_word_objects, clue, num_words_to_select)
+    if usage is not None and backend != "remote":
+        usage["model"] = backend
+    AI_REQUESTS.inc(kind="guess", backend=backend)
+    return selection, backend
+
+
+async def _local_clue(list_of_word_objects: list) -> dict | None:
+    result = await _run_backend("local", local_get_clue_and_selected_words, list_of_word_objects)
+    if result is not None and validate_ai_clue(list_of_word_objects, result["selected_words"], result["clue"]):
+        AI_REQUESTS.inc(kind="clue", backend="local")
+        return result
+    return None
+
+
+async def route_clue_and_selected_words(
+    list_of_word_objects: list,
+    budget_ms: float | None = None,
+    tier: str | None = None,
+) -> tuple[dict, str]:
+    """
+        ai_get_clue_and_selected_words behind the cache and latency router.
+        Falls back to the model when the local engine has no clue for the board, and to
+        the local engine when the model is over its concurrency limit. A model result may carry "alternates" (see AI_CLUE_CANDIDATES), cached results don't.
+    """
+    key = _clue_key(list_of_word_objects)
+    cached = await result_cache.lookup(key)
+    if cached is not None:
+        AI_REQUESTS.inc(kind="clue", backend="cache")
+        return {"clue": cached["clue"], "selected_words": [dict(word) for word in cached["selected_words"]]}, "cache"
+
+    local_tried = choose_backend(budget_ms, tier) == "local"
+    if local_tried and (result := await _local_clue(list_of_word_objects)) is not None:
+        return result, "local"
+
+    usage = {}
+    try:
+        result = await _run_backend("remote", ai_get_clue_and_selected_words, list_of_word_objects, usage=usage)
+    except ModelOverloaded:
+        if not local_tried and (result := await _local_clue(list_of_word_objects)) is not None:
+            return result, "local"
+        raise
+    record_clue_usage(usage)
+    await result_cache.store(key, {"clue": result["clue"], "selected_words": [dict(word) for word in result["selected_words"]]})
+    AI_REQUESTS.inc(kind="clue", backend="remote")
+    return result, "remote"
+
+
+
+#STREAMING CLUE GENERATION
+
+CLUE_FIELD = re.compile(r'"clue"\s*:\s*"((?:[^"\\]|\\.)*)"')
+SELECTED_WORDS_FIELD = re.compile(r'"selected_words"\s*:\s*\[')
+WORD_OBJECT = re.compile(r"\{[^{}]*\}")
+
+
+class ClueStreamParser:
+    """
+        Incremental parser for the clue JSON as the model streams it.
+        feed() returns the parts completed by the new text: ("clue", str) once and
+        ("word", dict) for each selected_words object.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.clue = None
+        self.words = []
+        self._words_start = None
+        self._position = 0
+
+    def feed(self, delta: str) -> list[tuple]:
+        self.text += delta
+        parts = []
+        if self.clue is None and (match := CLUE_FIELD.search(self.text)):
+            self.clue = json.loads(f'"{match.group(1)}"')
+            parts.append(("clue", self.clue))
+        if self._words_start is None and (match := SELECTED_WORDS_FIELD.search(self.text)):
+            self._words_start = self._position = match.end()
+        if self._words_start is not None:
+            for match in WORD_OBJECT.finditer(self.text, self._position):
+                try:
+                    word = json.loads(match.group(0))
+                except ValueError:
+                    break
+                self.words.append(word)
+                parts.append(("word", word))
+                self._position = match.end()
+        return parts
+
+    def result(self) -> dict:
+        """
+            The whole output, parsed the same way as ai_get_clue_and_selected_words
+        """
+        clean_output = re.sub(r"^```(?:python)?|```$", "", self.text.strip(), flags=re.MULTILINE).strip()
+        return json.loads(clean_output)
+
+
+async def _read_clue_stream(list_of_word_objects: list, deltas: asyncio.Queue) -> float:
+    """
+        Stream the clue from the model into deltas, None at the end.
+        Returns the model's latency in ms.
+    """
+    try:
+        async with model_limiter.slot("stream_clue_and_selected_words"):
+            started = time.perf_counter()
+            stream = await get_async_client().responses.create(
+                model=AI_MODEL,
+                input=[
+                    {"role": "system", "content": "You are generating a clue for a word connection game."},
+                    {"role": "user", "content": clue_prompt(list_of_word_objects)}
+                ],
+                temperature=AI_TEMPERATURE,
+                max_output_tokens=AI_CLUE_MAX_TOKENS,
+                stream=True,
+            )
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    deltas.put_nowait(event.delta)
+                elif event.type == "response.completed" and event.response.usage:
+                    record_clue_usage({"input_tokens": event.response.usage.input_tokens, "output_tokens": event.response.usage.output_tokens})
+            return (time.perf_counter() - started) * 1000
+    finally:
+        deltas.put_nowait(None)
+
+
+async def stream_clue_and_selected_words(list_of_word_objects: list):
+    """
+        Streaming ai_get_clue_and_selected_words. Yields ("clue", str) as soon as the clue
+        is generated, ("word", dict) per selected_words object, then ("result", dict) once
+        the full output has been validated. Served from the result cache when possible.
+    """
+    key = _clue_key(list_of_word_objects)
+    cached = await result_cache.lookup(key)
+    if cached is not None:
+        AI_REQUESTS.inc(kind="clue", backend="cache")
+        yield "clue", cached["clue"]
+        for word in cached["selected_words"]:
+            yield "word", dict(word)
+        yield "result", {"clue": cached["clue"], "selected_words": [dict(word) for word in cached["selected_words"]]}
+        return
+
+    if ai_replay.active:
+        result, _ = await route_clue_and_selected_words(list_of_word_objects, tier="high")
+        yield "clue", result["clue"]
+        for word in result["selected_words"]:
+            yield "word", dict(word)
+        yield "result", result
+        return
+
+    #The model stream is read by its own task, so a slow client doesn't hold the slot
+    deltas = asyncio.Queue()
+    reader = asyncio.create_task(_read_clue_stream(list_of_word_objects, deltas))
+    parser = ClueStreamParser()
+    try:
+        while (delta := await deltas.get()) is not None:
+            for part in parser.feed(delta):
+                yield part
+        latency_ms = await reader
+    finally:
+        #Client gone before the end, stop paying for the output
+        reader.cancel()
+    latency["remote"].record(latency_ms)
+
+    try:
+        result = parser.result()
+    except ValueError as e:
+        raise AIResponseNotValid(message="Clue response is not valid JSON.", response=parser.text, errors=[str(e)])
+    if not validate_ai_clue(list_of_word_objects, result["selected_words"], result["clue"]):
+        raise AIResponseNotValid(
+            message="Mismatch between input words and clue response.",
+            response=parser.text,
+            errors=["Invalid clue response from AI"]
+        )
+    await result_cache.store(key, {"clue": result["clue"], "selected_words": [dict(word) for word in result["selected_words"]]})
+    AI_REQUESTS.inc(kind="clue", backend="remote")
+    if capture.enabled:
+        capture.record_ai("ai_get_clue_and_selected_words", (list_of_word_objects,), None, result, latency_ms)
+    yield "result", result
+
 if __name__ == "__main__":
     # word_selection = [{'seq': 1, 'word': 'body', 'selected': True}, {'seq': 2, 'word': 'border', 'selected': False}, {'seq': 3, 'word': 'pen', 'selected': True}, {'seq': 4, 'word': 'shoulder', 'selected': False}, {'seq': 5, 'word': 'panic', 'selected': False}, {'seq': 6, 'word': 'mud', 'selected': False}, {'seq': 7, 'word': 'league', 'selected': False}, {'seq': 8, 'word': 'client', 'selected': True}, {'seq': 9, 'word': 'agent', 'selected': True}]
     # for word in word_selection:
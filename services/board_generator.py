@@ -0,0 +1,271 @@
+"""
+    Board generator with controlled relatedness.
+
+    The whole lexicon is embedded once (offline) and reduced to a compact
+    top-k neighbour structure:
+
+        neighbour_ids  (N, K) uint16/int32 - lexicon index of the k-th nearest word
+        neighbour_sims (N, K) uint8        - cosine similarity quantized to 0..255
+
+    Boards are then assembled entirely in memory with numpy. A board has a planted
+    cluster of related words (a seed word plus some of its neighbours, taken from a
+    rank window that depends on the difficulty) and distractors which are not in the
+    neighbour lists of any cluster word.
+
+    Build the neighbour file:
+        python -m services.board_generator build
+    Benchmark:
+        python -m services.board_generator bench --boards 100000
+"""
+from pathlib import Path
+import argparse
+import os
+import time
+import dotenv
+import numpy as np
+
+dotenv_file = ".env"
+if os.path.isfile(dotenv_file):
+    dotenv.load_dotenv(dotenv_file)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+WORD_LIST_FILE = BASE_DIR / "word_list.txt"
+NEIGHBOURS_FILE = Path(os.environ.get("BOARD_NEIGHBOURS_FILE", BASE_DIR / "word_neighbours.npz"))
+EMBEDDING_MODEL = os.environ.get("BOARD_EMBEDDING_MODEL", "text-embedding-3-small")
+NEIGHBOURS_K = int(os.environ.get("BOARD_NEIGHBOURS_K", 64))
+
+BOARD_SIZE = 9
+
+#Rank window (in the seed's neighbour list) the planted words are drawn from,
+#and how many words the planted cluster has including the seed
+DIFFICULTIES = {
+    "easy": {"window": (0, 8), "cluster_size": 4},
+    "medium": {"window": (4, 24), "cluster_size": 3},
+    "hard": {"window": (16, 48), "cluster_size": 3},
+}
+
+
+def load_word_list(file_path: Path = WORD_LIST_FILE) -> list[str]:
+    with open(file_path, "r") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def quantize_similarities(sims: np.ndarray) -> np.ndarray:
+    return np.rint(np.clip(sims, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def build_neighbours(embeddings: np.ndarray, k: int = NEIGHBOURS_K, chunk_size: int = 1024) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Reduce an (N, D) embedding matrix to top-k neighbour ids and quantized similarities.
+        Works in row chunks so the full N x N matrix is never held in memory.
+    """
+    n = embeddings.shape[0]
+    k = min(k, n - 1)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = (embeddings / np.maximum(norms, 1e-12)).astype(np.float32)
+    id_dtype = np.uint16 if n < np.iinfo(np.uint16).max else np.int32
+
+    neighbour_ids = np.empty((n, k), dtype=id_dtype)
+    neighbour_sims = np.empty((n, k), dtype=np.uint8)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        sims = unit[start:stop] @ unit.T
+        #A word is never its own neighbour
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(-sims, k, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        neighbour_ids[start:stop] = np.take_along_axis(top, order, axis=1)
+        neighbour_sims[start:stop] = quantize_similarities(np.take_along_axis(top_sims, order, axis=1))
+    return neighbour_ids, neighbour_sims
+
+
+def embed_words(words: list[str], batch_size: int = 512) -> np.ndarray:
+    """
+        Get embeddings for the lexicon from open AI. Only needed when building the neighbour file.
+    """
+    from openai import OpenAI
+
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    client = OpenAI(api_key=api_key)
+    vectors = []
+    for start in range(0, len(words), batch_size):
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=words[start:start + batch_size])
+        vectors.extend(item.embedding for item in response.data)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def save_neighbours(file_path: Path, words: list[str], neighbour_ids: np.ndarray, neighbour_sims: np.ndarray):
+    tmp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.tmp.npz")
+    np.savez(tmp_path, words=np.asarray(words), neighbour_ids=neighbour_ids, neighbour_sims=neighbour_sims)
+    os.replace(tmp_path, file_path)
+
+
+class BoardGenerator:
+    """
+        Generates boards from an in-memory top-k neighbour structure.
+        Lexicon index i corresponds to line i + 1 of word_list.txt.
+    """
+
+    def __init__(self, words: list[str], neighbour_ids: np.ndarray, neighbour_sims: np.ndarray, seed=None):
+        if neighbour_ids.shape != neighbour_sims.shape or neighbour_ids.shape[0] != len(words):
+            raise ValueError("Neighbour arrays do not match the word list")
+        self.words = words
+        self.neighbour_ids = neighbour_ids.astype(np.int32, copy=False)
+        self.neighbour_sims = neighbour_sims
+        self.k = neighbour_ids.shape[1]
+        self.rng = np.random.default_rng(seed)
+        self._index_by_word = None
+
+    @classmethod
+    def from_file(cls, file_path: Path = NEIGHBOURS_FILE, seed=None) -> "BoardGenerator":
+        data = np.load(file_path)
+        return cls([str(w) for w in data["words"]], data["neighbour_ids"], data["neighbour_sims"], seed=seed)
+
+    def index_of(self, word: str) -> int | None:
+        """Lexicon index of a word, None if it isn't in the lexicon"""
+        if self._index_by_word is None:
+            self._index_by_word = {w.lower(): i for i, w in enumerate(self.words)}
+        return self._index_by_word.get(word.strip().lower())
+
+    def generate(self, count: int, difficulty: str = "medium") -> tuple[np.ndarray, np.ndarray]:
+        """
+            Generate `count` boards.
+
+            :return: (boards, planted) - (count, 9) lexicon indices and a (count, 9) bool
+                     mask marking the planted cluster
+        """
+        if difficulty not in DIFFICULTIES:
+            raise ValueError(f"Unknown difficulty {difficulty}")
+        settings = DIFFICULTIES[difficulty]
+        lo, hi = settings["window"]
+        hi = min(hi, self.k)
+        cluster_size = settings["cluster_size"]
+        if hi - lo < cluster_size - 1:
+            raise ValueError(f"Neighbour lists are too short for difficulty {difficulty}")
+        rng = self.rng
+        n = len(self.words)
+
+        seeds = rng.integers(0, n, size=count)
+        #Pick cluster_size - 1 distinct ranks from the window for every board
+        ranks = rng.random((count, hi - lo)).argsort(axis=1)[:, :cluster_size - 1] + lo
+        planted_words = np.take_along_axis(self.neighbour_ids[seeds], ranks, axis=1)
+        cluster = np.concatenate([seeds[:, None], planted_words], axis=1)
+
+        distractors = self._pick_distractors(cluster, BOARD_SIZE - cluster_size)
+
+        boards = np.concatenate([cluster, distractors], axis=1)
+        planted = np.zeros((count, BOARD_SIZE), dtype=bool)
+        planted[:, :cluster_size] = True
+        #Shuffle the board positions so the cluster isn't always first
+        order = rng.random((count, BOARD_SIZE)).argsort(axis=1)
+        return np.take_along_axis(boards, order, axis=1), np.take_along_axis(planted, order, axis=1)
+
+    def _pick_distractors(self, cluster: np.ndarray, number: int) -> np.ndarray:
+        rng = self.rng
+        count = cluster.shape[0]
+        n = len(self.words)
+        #Anything in a cluster word's neighbour list is too related to be a distractor
+        forbidden = np.concatenate([cluster, self.neighbour_ids[cluster].reshape(count, -1)], axis=1)
+
+        result = np.empty((count, number), dtype=cluster.dtype)
+        pending = np.arange(count)
+        oversample = number * 4
+        while pending.size:
+            candidates = rng.integers(0, n, size=(pending.size, oversample))
+            bad = (candidates[:, :, None] == forbidden[pending][:, None, :]).any(axis=2)
+            #Reject repeats of an earlier candidate in the same row
+            same = candidates[:, :, None] == candidates[:, None, :]
+            bad |= np.triu(same, k=1).any(axis=1)
+
+            ok_rows = (~bad).sum(axis=1) >= number
+            first_good = np.argsort(bad, axis=1, kind="stable")[:, :number]
+            picked = np.take_along_axis(candidates, first_good, axis=1)
+            result[pending[ok_rows]] = picked[ok_rows]
+            pending = pending[~ok_rows]
+        return result
+
+    def generate_board(self, difficulty: str = "medium") -> list[dict]:
+        """
+            One board as word objects, in the same shape as the rest of the API uses
+        """
+        boards, planted = self.generate(1, difficulty)
+        return [
+            {"id": int(index) + 1, "word": self.words[index], "planted": bool(flag)}
+            for index, flag in zip(boards[0], planted[0])
+        ]
+
+
+_generator = None
+
+
+def get_board_generator() -> BoardGenerator | None:
+    """
+        Lazily loaded generator shared by the process, None when the neighbour file has not been built
+    """
+    global _generator
+    if _generator is None and NEIGHBOURS_FILE.is_file():
+        _generator = BoardGenerator.from_file(NEIGHBOURS_FILE)
+    return _generator
+
+
+def synthetic_generator(n: int = 1500, k: int = NEIGHBOURS_K, seed: int = 0) -> BoardGenerator:
+    """
+        Generator over random neighbour lists, for benchmarking without an embedding build
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, 32)).astype(np.float32)
+    neighbour_ids, neighbour_sims = build_neighbours(embeddings, k)
+    return BoardGenerator([f"word{i}" for i in range(n)], neighbour_ids, neighbour_sims, seed=seed)
+
+
+def benchmark(generator: BoardGenerator, boards: int, batch_size: int):
+    for difficulty in DIFFICULTIES:
+        generator.generate(batch_size, difficulty)  # warm up
+        start = time.perf_counter()
+        made = 0
+        while made < boards:
+            generated, _ = generator.generate(min(batch_size, boards - made), difficulty)
+            #The last batch may be partial, count what came back
+            made += len(generated)
+        elapsed = time.perf_counter() - start
+        print(f"{difficulty:>6}: {made} boards in {elapsed:.3f}s ({made / elapsed:,.0f} boards/s, batch {batch_size})")
+
+    start = time.perf_counter()
+    singles = min(boards, 2000)
+    for _ in range(singles):
+        generator.generate_board("medium")
+    elapsed = time.perf_counter() - start
+    print(f"single: {singles} boards in {elapsed:.3f}s ({singles / elapsed:,.0f} boards/s, one at a time)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Board generator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Embed the word list and write the neighbour file")
+    build_parser.add_argument("-k", type=int, default=NEIGHBOURS_K)
+    bench_parser = subparsers.add_parser("bench", help="Time board generation")
+    bench_parser.add_argument("--boards", type=int, default=100000)
+    bench_parser.add_argument("--batch-size", type=int, default=1000)
+    bench_parser.add_argument("--synthetic", action="store_true", help="Use random neighbours instead of the built file")
+    sample_parser = subparsers.add_parser("sample", help="Print a few boards")
+    sample_parser.add_argument("--difficulty", default="medium", choices=list(DIFFICULTIES))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        words = load_word_list()
+        print("EMBEDDING WORDS", len(words))
+        neighbour_ids, neighbour_sims = build_neighbours(embed_words(words), args.k)
+        save_neighbours(NEIGHBOURS_FILE, words, neighbour_ids, neighbour_sims)
+        print("NEIGHBOURS WRITTEN", NEIGHBOURS_FILE, neighbour_ids.shape)
+    elif args.command == "bench":
+        generator = synthetic_generator() if args.synthetic else BoardGenerator.from_file(NEIGHBOURS_FILE)
+        benchmark(generator, args.boards, args.batch_size)
+    elif args.command == "sample":
+        generator = get_board_generator()
+        if generator is None:
+            raise SystemExit(f"{NEIGHBOURS_FILE} not found, run the build command first")
+        for _ in range(3):
+            print([("*" if w["planted"] else "") + w["word"] for w in generator.generate_board(args.difficulty)])
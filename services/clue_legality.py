@@ -0,0 +1,125 @@
+"""
+    Clue legality checks against a board, in memory and in microseconds.
+
+    A clue is rejected when it is not a single word, or when it is too close to one of the
+    board's words: the same word, the same stem ("golfer" / "golf"), one containing the
+    other ("football" / "ball"), or character trigram similarity of at least
+    CLUE_MAX_SIMILARITY. Word features (stem and trigrams) are computed once per word and
+    kept in an index that is warmed with the whole word table at startup.
+
+    Rejections are counted in clue_rejections_total{reason}.
+"""
+import os
+from .metrics import Counter
+
+CLUE_MAX_SIMILARITY = float(os.environ.get("CLUE_MAX_SIMILARITY", 0.5))
+#Shorter words than this may appear inside a clue, e.g. "ant" in "elephant"
+CLUE_MIN_SUBSTRING = int(os.environ.get("CLUE_MIN_SUBSTRING", 4))
+
+CLUE_REJECTIONS = Counter("clue_rejections_total", "Clues rejected by the legality check, by reason")
+
+#Longest first, the first one that leaves a stem of at least 3 letters is removed
+SUFFIXES = sorted([
+    "ations", "ation", "ments", "ment", "ness", "ings", "ing", "ers", "er", "ies", "ied",
+    "ed", "es", "s", "ly", "ful", "less", "able", "ible", "ists", "ist", "ism", "ity",
+    "ive", "ous", "al", "ic", "y",
+], key=len, reverse=True)
+
+
+def stem(word: str) -> str:
+    """
+        Light suffix-stripping stemmer, good enough to catch inflections and simple
+        derivations of the same word
+    """
+    word = word.lower()
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    #"running" -> "runn" -> "run"
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiouls":
+        word = word[:-1]
+    return word
+
+
+def trigrams(word: str) -> frozenset:
+    padded = f"  {word.lower()} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ClueIndex:
+    """
+        word -> (lowercase word, stem, trigrams)
+    """
+
+    def __init__(self):
+        self.features: dict[str, tuple[str, str, frozenset]] = {}
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def feature(self, word: str, store: bool = True) -> tuple[str, str, frozenset]:
+        found = self.features.get(word)
+        if found is None:
+            lower = word.strip().lower()
+            found = (lower, stem(lower), trigrams(lower))
+            if store:
+                self.features[word] = found
+        return found
+
+    def warm(self, words):
+        for word in words:
+            self.feature(word)
+
+    def rejection(self, clue: str, board_words: list[str]) -> str | None:
+        """
+            Why the clue is illegal for this board ("format", "exact", "stem", "substring",
+            "similar") or None if it is fine
+        """
+        clue = clue.strip()
+        if not clue or not clue.isalpha():
+            return "format"
+        #Clues are arbitrary model output, only board words are kept in the index
+        clue_lower, clue_stem, clue_grams = self.feature(clue, store=False)
+        for word in board_words:
+            lower, word_stem, grams = self.feature(word)
+            if clue_lower == lower:
+                return "exact"
+            if clue_stem == word_stem:
+                return "stem"
+            shorter, longer = sorted((clue_lower, lower), key=len)
+            if len(shorter) >= CLUE_MIN_SUBSTRING and shorter in longer:
+                return "substring"
+            if len(clue_grams & grams) / len(clue_grams | grams) >= CLUE_MAX_SIMILARITY:
+                return "similar"
+        return None
+
+    def is_legal(self, clue: str, board_words: list[str], count: bool = True) -> bool:
+        reason = self.rejection(clue, board_words)
+        if reason is not None and count:
+            CLUE_REJECTIONS.inc(reason=reason)
+        return reason is None
+
+
+clue_index = ClueIndex()
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from pathlib import Path
+
+    with open(Path(__file__).resolve().parent.parent / "word_list.txt", "r") as file:
+        words = [line.strip() for line in file if line.strip()]
+    started = time.perf_counter()
+    clue_index.warm(words)
+    print(f"warmed {len(clue_index)} words in {(time.perf_counter() - started) * 1000:.1f}ms")
+    rng = random.Random(0)
+    boards = [rng.sample(words, 9) for _ in range(1000)]
+    clues = [rng.choice(words) + rng.choice(["", "er", "s", "ing"]) for _ in range(1000)]
+    started = time.perf_counter()
+    rejected = sum(1 for clue, board in zip(clues, boards) if not clue_index.is_legal(clue, board, count=False))
+    elapsed = (time.perf_counter() - started) / len(clues) * 1e6
+    print(f"{elapsed:.2f}us per check, {rejected} of {len(clues)} random clues rejected")
+    for clue, board in (("golfer", ["golf"]), ("holidays", ["holiday"]), ("football", ["ball"]), ("leisure", ["golf", "work"])):
+        print(clue, board, clue_index.rejection(clue, board))
@@ -0,0 +1,180 @@
+"""
+    Adaptive concurrency limit for outbound model calls (AIMD).
+
+    The limiter tracks a latency baseline per kind of call (a guess, a clue and a
+    streamed clue take very different times): the AI_BASELINE_PERCENTILE of that kind's
+    last AI_BASELINE_WINDOW latencies. One unusually fast response doesn't become the
+    floor, and the baseline follows the provider up or down within a window. Latency
+    cuts wait until a kind has AI_BASELINE_MIN_SAMPLES latencies. After each call:
+
+    - a 429 or timeout cuts the limit to limit * AI_LIMIT_BACKOFF
+    - latency above its kind's baseline * AI_LATENCY_TOLERANCE cuts it the same way
+    - otherwise, when the limit was actually in use, it grows by 1 / limit, about +1 per
+      limit's worth of calls
+
+    Cuts happen at most once per baseline latency, so one slow burst counts once.
+    Calls over the limit wait in a FIFO queue of at most AI_QUEUE_MAX for up to
+    AI_QUEUE_TIMEOUT_MS, then fail with ModelOverloaded.
+
+    ai_concurrency_limit, ai_concurrency_inflight, ai_concurrency_queue,
+    ai_latency_baseline_ms{kind} and ai_concurrency_rejections_total{reason} are on /metrics.
+"""
+from collections import deque
+import asyncio
+import os
+import time
+from .metrics import Counter, Gauge
+
+AI_CONCURRENCY_INITIAL = float(os.environ.get("AI_CONCURRENCY_INITIAL", 8))
+AI_CONCURRENCY_MIN = float(os.environ.get("AI_CONCURRENCY_MIN", 1))
+#The remote calls run in the default thread pool, more than its size only queues there
+AI_CONCURRENCY_MAX = float(os.environ.get("AI_CONCURRENCY_MAX", 32))
+AI_QUEUE_MAX = int(os.environ.get("AI_QUEUE_MAX", 100))
+AI_QUEUE_TIMEOUT_MS = float(os.environ.get("AI_QUEUE_TIMEOUT_MS", 2000))
+AI_LATENCY_TOLERANCE = float(os.environ.get("AI_LATENCY_TOLERANCE", 2.0))
+AI_LIMIT_BACKOFF = float(os.environ.get("AI_LIMIT_BACKOFF", 0.7))
+#Latencies per kind the baseline is taken from
+AI_BASELINE_WINDOW = int(os.environ.get("AI_BASELINE_WINDOW", 100))
+#Low percentile, under the normal spread of model latencies but not the odd short output
+AI_BASELINE_PERCENTILE = float(os.environ.get("AI_BASELINE_PERCENTILE", 0.1))
+#Enough that the percentile is above the single fastest latency
+AI_BASELINE_MIN_SAMPLES = int(os.environ.get("AI_BASELINE_MIN_SAMPLES", 20))
+
+CONCURRENCY_LIMIT = Gauge("ai_concurrency_limit", "Current limit on concurrent model calls")
+CONCURRENCY_INFLIGHT = Gauge("ai_concurrency_inflight", "Model calls in flight")
+CONCURRENCY_QUEUE = Gauge("ai_concurrency_queue", "Model calls waiting for the limit")
+LATENCY_BASELINE = Gauge("ai_latency_baseline_ms", "Latency baselines the concurrency limit is adapted against, by kind of call")
+CONCURRENCY_REJECTIONS = Counter("ai_concurrency_rejections_total", "Model calls rejected by the concurrency limit, by reason")
+CONCURRENCY_DECREASES = Counter("ai_concurrency_decreases_total", "Concurrency limit cuts, by reason")
+
+
+class ModelOverloaded(Exception):
+    """Raised when a model call can't get a slot in time."""
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: float = AI_CONCURRENCY_INITIAL,
+        min_limit: float = AI_CONCURRENCY_MIN,
+        max_limit: float = AI_CONCURRENCY_MAX,
+        queue_max: int = AI_QUEUE_MAX,
+        queue_timeout_ms: float = AI_QUEUE_TIMEOUT_MS,
+        overload_errors: tuple = (),
+    ):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.overload_errors = overload_errors
+        self.inflight = 0
+        #kind -> recent latencies and the baseline taken from them
+        self.latencies: dict[str, deque[float]] = {}
+        self.baselines: dict[str, float] = {}
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            return
+        if len(self._waiters) >= self.queue_max:
+            CONCURRENCY_REJECTIONS.inc(reason="queue_full")
+            raise ModelOverloaded("Too many model calls waiting")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                #Handed a slot just as the wait ran out, keep it
+                return
+            waiter.cancel()
+            CONCURRENCY_REJECTIONS.inc(reason="timeout")
+            raise ModelOverloaded("Timed out waiting for a model call slot")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                #The slot was handed over, pass it on
+                self._release_slot()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _release_slot(self):
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self):
+        #The slot goes straight to a waiter, inflight stays counted
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+    def release(self, kind: str, latency_ms: float, overloaded: bool = False):
+        #Whether the limit was the constraint, growing an unused limit means nothing
+        saturated = self.inflight >= int(self.limit) or bool(self._waiters)
+        self.inflight -= 1
+        now = time.monotonic()
+        #Judged against the latencies before this one
+        baseline_ms = self.baselines.get(kind)
+        window = self.latencies.setdefault(kind, deque(maxlen=AI_BASELINE_WINDOW))
+        too_slow = len(window) >= AI_BASELINE_MIN_SAMPLES and latency_ms > baseline_ms * AI_LATENCY_TOLERANCE
+        if not overloaded:
+            window.append(latency_ms)
+            self.baselines[kind] = percentile(window, AI_BASELINE_PERCENTILE)
+        if overloaded or too_slow:
+            #At most one cut per baseline latency
+            if now - self._last_decrease >= (baseline_ms or latency_ms) / 1000:
+                self.limit = max(self.min_limit, self.limit * AI_LIMIT_BACKOFF)
+                self._last_decrease = now
+                CONCURRENCY_DECREASES.inc(reason="overload" if overloaded else "latency")
+        elif saturated:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def slot(self, kind: str) -> "_Slot":
+        """
+            async with limiter.slot(kind): ...  holds a slot for the call and reports its
+            latency and outcome when it ends, against the baseline of its kind
+        """
+        return _Slot(self, kind)
+
+
+class _Slot:
+    def __init__(self, limiter: AdaptiveLimiter, kind: str):
+        self.limiter = limiter
+        self.kind = kind
+        self.started = None
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        latency_ms = (time.perf_counter() - self.started) * 1000
+        overloaded = exc is not None and isinstance(exc, self.limiter.overload_errors)
+        if exc is not None and not overloaded:
+            #Failed for another reason (bad output, cancelled), says nothing about load
+            self.limiter._release_slot()
+        else:
+            self.limiter.release(self.kind, latency_ms, overloaded)
+        return False
+
+
+def export_metrics(limiter: AdaptiveLimiter):
+    CONCURRENCY_LIMIT.set_function(lambda: round(limiter.limit, 2))
+    CONCURRENCY_INFLIGHT.set_function(lambda: limiter.inflight)
+    CONCURRENCY_QUEUE.set_function(lambda: len(limiter._waiters))
+    LATENCY_BASELINE.set_function(lambda: {(("kind", kind),): round(baseline_ms, 1) for kind, baseline_ms in limiter.baselines.items()})
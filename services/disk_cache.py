@@ -0,0 +1,146 @@
+"""
+    Second-tier cache of AI results in a local SQLite file, behind the in-process LRU.
+
+    Every uvicorn worker opens the same file (WAL mode, so readers don't wait for the
+    writer), so a result paid for by one worker is reused by the others and survives
+    restarts and deploys. Keys include AI_MODEL and AI_CACHE_VERSION, bump the version
+    after changing a prompt to start from an empty cache.
+
+    Bounded to AI_DISK_CACHE_MAX_ENTRIES rows, the least recently used are evicted every
+    EVICT_EVERY writes of a worker, and entries expire after AI_DISK_CACHE_TTL_SECONDS.
+    Calls block on SQLite, the async callers run them in a thread.
+
+        python -m services.disk_cache stats
+        python -m services.disk_cache clear
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+#Empty disables the disk tier
+AI_DISK_CACHE = os.environ.get("AI_DISK_CACHE", str(BASE_DIR / "ai_cache.sqlite3"))
+AI_DISK_CACHE_MAX_ENTRIES = int(os.environ.get("AI_DISK_CACHE_MAX_ENTRIES", 200_000))
+AI_DISK_CACHE_TTL_SECONDS = float(os.environ.get("AI_DISK_CACHE_TTL_SECONDS", 30 * 86400))
+AI_CACHE_VERSION = os.environ.get("AI_CACHE_VERSION", "1")
+#Eviction runs every this many writes in a worker
+EVICT_EVERY = 500
+#accessed_at is only rewritten when older than this, most hits stay read-only
+TOUCH_SECONDS = 60
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)",
+]
+
+
+class DiskCache:
+    def __init__(self, path: str, namespace: str, max_entries: int = AI_DISK_CACHE_MAX_ENTRIES, ttl: float = AI_DISK_CACHE_TTL_SECONDS):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            #A crash may lose the last writes, never corrupts the file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def _key(self, key) -> str:
+        return hashlib.sha1(f"{self.namespace}\n{json.dumps(key, default=str)}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        hashed = self._key(key)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, created_at, accessed_at FROM results WHERE key = ?", (hashed,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at, accessed_at = row
+            if now - created_at > self.ttl:
+                conn.execute("DELETE FROM results WHERE key = ?", (hashed,))
+                return None
+            if now - accessed_at > TOUCH_SECONDS:
+                conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, hashed))
+        return json.loads(value)
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (self._key(key), json.dumps(value), now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        evicted = conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,)).rowcount
+        excess = conn.execute("SELECT count(*) FROM results").fetchone()[0] - self.max_entries
+        if excess > 0:
+            evicted += conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)", (excess,)
+            ).rowcount
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            entries, oldest = conn.execute("SELECT count(*), min(created_at) FROM results").fetchone()
+        return {
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "oldest_age_s": round(time.time() - oldest) if oldest else None,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM results")
+
+
+def open_disk_cache(namespace: str) -> DiskCache | None:
+    if not AI_DISK_CACHE:
+        return None
+    return DiskCache(AI_DISK_CACHE, f"{namespace}:{AI_CACHE_VERSION}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="AI result disk cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Entries and size of the cache file")
+    subparsers.add_parser("clear", help="Remove every entry")
+    args = parser.parse_args()
+    cache = open_disk_cache("")
+    if cache is None:
+        raise SystemExit("AI_DISK_CACHE is empty, the disk cache is disabled")
+    if args.command == "stats":
+        print(cache.stats())
+    elif args.command == "clear":
+        cache.clear()
+        print("CLEARED", cache.path)
@@ -0,0 +1,225 @@
+"""
+    Idempotency-Key support for the AI-backed POST endpoints.
+
+    A POST to one of IDEMPOTENT_PATHS with an `Idempotency-Key` header runs at most once
+    per key:
+
+    - a retry that arrives while the first attempt is still running waits for it
+      (in the same worker it attaches to the running attempt, in another worker it
+      polls the shared store) and gets the same response
+    - a retry after the attempt finished gets the stored response, with
+      `Idempotent-Replayed: true`, for IDEMPOTENCY_TTL_SECONDS
+    - reusing a key with a different body is rejected with 422
+
+    Keys are stored in the `idempotency_keys` table, so every worker sees them. Only
+    successful responses are stored, after an error the next retry runs again.
+
+    STREAMED_PATHS (server-sent events) are streamed to the first attempt's client as
+    they are produced and stored once complete, a stream that ended with an `error`
+    event counts as failed. Retries get the stored events in one response.
+    A scheduled job removes expired keys and keeps at most IDEMPOTENCY_MAX_KEYS.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from data.db import SessionLocal
+from data.db_actions import (
+    claim_idempotency_key,
+    get_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+    delete_expired_idempotency_keys,
+)
+from .metrics import Counter
+
+STREAMED_PATHS = {
+    "/generatewordsandcluefromselection/stream",
+}
+IDEMPOTENT_PATHS = {
+    "/guessselection",
+    "/generatewordsandcluefromselection",
+    "/generatewordsandclue",
+    *STREAMED_PATHS,
+}
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 86400))
+#A pending key older than this is assumed abandoned (worker died mid-request)
+IDEMPOTENCY_PENDING_SECONDS = float(os.environ.get("IDEMPOTENCY_PENDING_SECONDS", 120))
+#How long a retry waits for an attempt running in another worker
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", 60))
+IDEMPOTENCY_POLL_SECONDS = 0.2
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", 100_000))
+IDEMPOTENCY_CLEANUP_SECONDS = float(os.environ.get("IDEMPOTENCY_CLEANUP_SECONDS", 600))
+MAX_KEY_LENGTH = 255
+#Response headers kept with the stored response
+STORED_HEADERS = {"content-type", "x-ai-backend"}
+#A streamed response with this event failed, it isn't stored
+SSE_ERROR = b"event: error"
+
+IDEMPOTENT_REQUESTS = Counter("idempotent_requests_total", "Requests with an Idempotency-Key, by outcome")
+
+
+class StoredResponse:
+    def __init__(self, status: int, headers: list, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @classmethod
+    def from_row(cls, row) -> "StoredResponse":
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row.response_headers)]
+        return cls(row.response_status, headers, row.response_body.encode("utf-8"))
+
+
+#Attempts running in this worker, key -> (body fingerprint, future), retries attach to them
+_inflight: dict[str, tuple[str, asyncio.Future]] = {}
+
+
+class IdempotencyMiddleware:
+    """
+        Plain ASGI middleware, like ProfilingMiddleware
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in IDEMPOTENT_PATHS:
+            return await self.app(scope, receive, send)
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        client_key = headers.get("idempotency-key")
+        if client_key is None:
+            return await self.app(scope, receive, send)
+        if not client_key or len(client_key) > MAX_KEY_LENGTH:
+            return await _send(send, _json_response(400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters."))
+
+        body = await _read_body(receive)
+        #Keys are scoped to the caller's API key and the endpoint
+        key = hashlib.sha256(f"{headers.get('x-api-key', '')}\n{scope['path']}\n{client_key}".encode()).hexdigest()
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        if key in _inflight:
+            inflight_fingerprint, inflight = _inflight[key]
+            if inflight_fingerprint != fingerprint:
+                IDEMPOTENT_REQUESTS.inc(outcome="mismatch")
+                return await _send(send, _json_response(422, "Idempotency-Key was already used with a different request body."))
+            IDEMPOTENT_REQUESTS.inc(outcome="attached")
+            return await _send(send, await asyncio.shield(inflight), replayed=True)
+
+        async with SessionLocal() as session:
+            claimed, existing = await claim_idempotency_key(session, key, fingerprint, IDEMPOTENCY_PENDING_SECONDS)
+        if not claimed:
+            if existing is not None and existing.fingerprint != fingerprint:
+                IDEMPOTENT_REQUESTS.inc(outcome="mismatch")
+                return await _send(send, _json_response(422, "Idempotency-Key was already used with a different request body."))
+            IDEMPOTENT_REQUESTS.inc(outcome="replayed")
+            return await _send(send, await _wait_for_stored(key, existing), replayed=True)
+
+        IDEMPOTENT_REQUESTS.inc(outcome="executed")
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = (fingerprint, future)
+        streamed = scope["path"] in STREAMED_PATHS
+        try:
+            response = await _run(self.app, scope, body, forward=send if streamed else None)
+            async with SessionLocal() as session:
+                if response.status >= 400 or (streamed and SSE_ERROR in response.body):
+                    await release_idempotency_key(session, key)
+                else:
+                    stored_headers = json.dumps([
+                        (name.decode("latin-1"), value.decode("latin-1"))
+                        for name, value in response.headers if name.decode("latin-1").lower() in STORED_HEADERS
+                    ])
+                    await complete_idempotency_key(
+                        session, key, response.status, stored_headers, response.body.decode("utf-8"), IDEMPOTENCY_TTL_SECONDS
+                    )
+            future.set_result(response)
+        except BaseException as e:
+            future.set_exception(e)
+            #Nobody may be waiting on it
+            future.exception()
+            async with SessionLocal() as session:
+                await release_idempotency_key(session, key)
+            raise
+        finally:
+            _inflight.pop(key, None)
+        if not streamed:
+            await _send(send, response)
+
+
+async def _wait_for_stored(key: str, row) -> StoredResponse:
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while row is not None and row.status != "done" and time.monotonic() < deadline:
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+        async with SessionLocal() as session:
+            row = await get_idempotency_key(session, key)
+    if row is None:
+        #The first attempt failed and was released, the client should retry
+        return _json_response(409, "The original request failed, retry it.")
+    if row.status != "done":
+        return _json_response(409, "A request with this Idempotency-Key is still in progress.")
+    return StoredResponse.from_row(row)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _run(app, scope, body: bytes, forward=None) -> StoredResponse:
+    """
+        Run the endpoint with the buffered body and capture its response.
+        With forward (the client's send) the response is also passed on as it is sent.
+    """
+    sent = False
+    status = 500
+    headers = []
+    chunks = []
+
+    async def replay_receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        #Body already delivered, wait like a connection that stays open
+        await asyncio.Future()
+
+    async def capture_send(message):
+        nonlocal status, headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+        if forward is not None:
+            await forward(message)
+
+    await app(scope, replay_receive, capture_send)
+    return StoredResponse(status, headers, b"".join(chunks))
+
+
+def _json_response(status: int, detail: str) -> StoredResponse:
+    return StoredResponse(status, [(b"content-type", b"application/json")], json.dumps({"detail": detail}).encode("utf-8"))
+
+
+async def _send(send, response: StoredResponse, replayed: bool = False):
+    headers = [(name, value) for name, value in response.headers if name.lower() != b"content-length"]
+    headers.append((b"content-length", str(len(response.body)).encode()))
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    await send({"type": "http.response.body", "body": response.body})
+
+
+async def expire_idempotency_keys():
+    """
+        Scheduled job: drop expired keys and bound the table to IDEMPOTENCY_MAX_KEYS
+    """
+    async with SessionLocal() as session:
+        deleted = await delete_expired_idempotency_keys(session, IDEMPOTENCY_MAX_KEYS)
+    if deleted:
+        print("IDEMPOTENCY KEYS EXPIRED", deleted)
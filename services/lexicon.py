@@ -0,0 +1,214 @@
+"""
+    Packed, memory-mapped lexicon shared by every worker process.
+
+    word_list.txt is compiled once into a binary file:
+
+        header   magic, version, count, source mtime/size
+        offsets  uint32[count + 1]  - start of each word in the blob
+        sorted   uint32[count]      - word indices ordered by lowercased word, for lookups
+        blob     UTF-8 bytes of every word, back to back
+
+    Each worker mmaps the file read-only so the pages are shared by the OS and lookups
+    by id and random sampling never copy the word list. Rebuilds write a temporary file
+    and os.replace() it over the old one, workers pick up the new inode on their next
+    refresh check.
+
+    Rebuild:
+        python -m services.lexicon build
+"""
+from pathlib import Path
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+WORD_LIST_FILE = BASE_DIR / "word_list.txt"
+LEXICON_FILE = Path(os.environ.get("LEXICON_FILE", BASE_DIR / "word_list.bin"))
+REFRESH_SECONDS = float(os.environ.get("LEXICON_REFRESH_SECONDS", 5))
+
+MAGIC = b"WLEX"
+VERSION = 1
+# magic, version, count, source mtime (ns), source size
+HEADER = struct.Struct("<4sIIQQ")
+
+
+class LexiconNotBuilt(Exception):
+    """Raised when the packed lexicon file does not exist or is not valid."""
+
+
+def _read_source(source: Path) -> list[str]:
+    with open(source, "r") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def build_lexicon(source: Path = WORD_LIST_FILE, target: Path = LEXICON_FILE) -> int:
+    """
+        Compile the word list into the packed format and atomically swap it into place.
+        Returns the number of words written.
+    """
+    words = _read_source(source)
+    encoded = [word.encode("utf-8") for word in words]
+
+    offsets = [0]
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+    sorted_index = sorted(range(len(words)), key=lambda i: words[i].lower())
+
+    stat = source.stat()
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(words), stat.st_mtime_ns, stat.st_size))
+        file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        file.write(struct.pack(f"<{len(sorted_index)}I", *sorted_index))
+        file.write(b"".join(encoded))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, target)
+    return len(words)
+
+
+def is_stale(source: Path = WORD_LIST_FILE, target: Path = LEXICON_FILE) -> bool:
+    if not target.is_file():
+        return True
+    with open(target, "rb") as file:
+        header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return True
+    magic, version, _, source_mtime, source_size = HEADER.unpack(header)
+    stat = source.stat()
+    return magic != MAGIC or version != VERSION or source_mtime != stat.st_mtime_ns or source_size != stat.st_size
+
+
+def ensure_lexicon(source: Path = WORD_LIST_FILE, target: Path = LEXICON_FILE) -> bool:
+    """
+        Rebuild the packed file if it is missing or older than the word list. Returns True if rebuilt.
+        Safe to call from several workers at once, the last os.replace() wins with identical content.
+    """
+    if is_stale(source, target):
+        count = build_lexicon(source, target)
+        print("LEXICON BUILT", target, count)
+        return True
+    return False
+
+
+class Lexicon:
+    """
+        Read-only view over a packed lexicon file.
+        Ids are 1-based to match the `words` table, which is loaded from word_list.txt in order.
+    """
+
+    def __init__(self, file_path: Path = LEXICON_FILE):
+        self.file_path = Path(file_path)
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self.file_path, "rb") as file:
+                self._inode = os.fstat(file.fileno()).st_ino
+                self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError) as e:
+            raise LexiconNotBuilt(f"{self.file_path} is missing or empty") from e
+        magic, version, count, _, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise LexiconNotBuilt(f"{self.file_path} is not a version {VERSION} lexicon")
+        self._count = count
+        view = memoryview(self._mm)
+        offsets_start = HEADER.size
+        sorted_start = offsets_start + (count + 1) * 4
+        self._blob_start = sorted_start + count * 4
+        self._offsets = view[offsets_start:sorted_start].cast("I")
+        self._sorted = view[sorted_start:self._blob_start].cast("I")
+        self._blob = view[self._blob_start:]
+        self._checked_at = time.monotonic()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+            Remap the file if it has been replaced. Checks at most every REFRESH_SECONDS.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < REFRESH_SECONDS:
+            return False
+        self._checked_at = now
+        try:
+            inode = os.stat(self.file_path).st_ino
+        except FileNotFoundError:
+            return False
+        if inode == self._inode:
+            return False
+        # Old views are dropped rather than closed, in case a caller still holds a slice
+        self._open()
+        return True
+
+    def __len__(self) -> int:
+        return self._count
+
+    def word(self, index: int) -> str:
+        """Word at 0-based lexicon index"""
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return bytes(self._blob[self._offsets[index]:self._offsets[index + 1]]).decode("utf-8")
+
+    def word_by_id(self, word_id: int) -> str:
+        return self.word(word_id - 1)
+
+    def id_of(self, word: str) -> int | None:
+        """Binary search the sorted index, returns the 1-based id or None"""
+        target = word.strip().lower()
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            index = self._sorted[mid]
+            current = self.word(index).lower()
+            if current < target:
+                lo = mid + 1
+            elif current > target:
+                hi = mid
+            else:
+                return index + 1
+        return None
+
+    def sample(self, k: int, rng: random.Random | None = None) -> list[int]:
+        """k distinct random 0-based indices, the word list itself is never copied"""
+        return (rng or random).sample(range(self._count), k)
+
+    def sample_words(self, k: int, rng: random.Random | None = None) -> list[dict]:
+        return [{"id": index + 1, "word": self.word(index)} for index in self.sample(k, rng)]
+
+
+_lexicon = None
+
+
+def get_lexicon() -> Lexicon:
+    """
+        Process-wide lexicon, built on first use if needed and remapped when the file is swapped
+    """
+    global _lexicon
+    if _lexicon is None:
+        if not LEXICON_FILE.is_file():
+            ensure_lexicon()
+        _lexicon = Lexicon(LEXICON_FILE)
+    else:
+        _lexicon.refresh()
+    return _lexicon
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packed lexicon")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Compile word_list.txt into the packed file")
+    build_parser.add_argument("--if-stale", action="store_true", help="Only rebuild when the word list has changed")
+    subparsers.add_parser("info", help="Print a summary of the packed file")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.if_stale:
+            ensure_lexicon()
+        else:
+            print("LEXICON BUILT", LEXICON_FILE, build_lexicon())
+    elif args.command == "info":
+        lexicon = Lexicon(LEXICON_FILE)
+        print("WORDS", len(lexicon), "SIZE", LEXICON_FILE.stat().st_size, "STALE", is_stale())
+        print("SAMPLE", lexicon.sample_words(9))
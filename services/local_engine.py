@@ -0,0 +1,100 @@
+"""
+    Local heuristic engine, answers in well under a millisecond without a model call.
+
+    Uses the board generator's top-k neighbour lists (services/board_generator.py) as a
+    word association table. Quality is well below the model, the router only sends
+    requests here when their latency budget can't wait for the model, and never when
+    the neighbour file hasn't been built (see local_available).
+"""
+import numpy as np
+import os
+from .board_generator import get_board_generator
+from .clue_legality import clue_index
+
+#Candidates tried, best first, until one passes the clue legality check
+LOCAL_CLUE_CANDIDATES = int(os.environ.get("LOCAL_CLUE_CANDIDATES", 20))
+
+
+def _trigrams(word: str) -> set:
+    padded = f"  {word.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _spelling_similarity(a: str, b: str) -> float:
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / max(1, len(ta | tb))
+
+
+def local_available() -> bool:
+    """
+        Without the neighbour lists guesses would only go by spelling, no better than chance
+    """
+    return get_board_generator() is not None
+
+
+def local_guess_word(list_of_word_objects: list, clue: str, num_words_to_select: int) -> list:
+    """
+        Same output as ai_guess_word: the word objects with "selected" set on the
+        num_words_to_select words most associated with the clue
+    """
+    generator = get_board_generator()
+    clue_position = generator.index_of(clue) if generator else None
+    scores = []
+    for word in list_of_word_objects:
+        score = 0.0
+        if clue_position is not None:
+            word_position = generator.index_of(word["word"])
+            if word_position is not None:
+                #Association either way round in the neighbour lists
+                for a, b in ((clue_position, word_position), (word_position, clue_position)):
+                    hits = np.nonzero(generator.neighbour_ids[a] == b)[0]
+                    if hits.size:
+                        score = max(score, generator.neighbour_sims[a][hits[0]] / 255)
+        #Tie-break (or fall back) on spelling, e.g. "golfer" / "golf"
+        score += 0.01 * _spelling_similarity(clue, word["word"])
+        scores.append(score)
+    chosen = set(np.argsort(-np.asarray(scores), kind="stable")[:num_words_to_select].tolist())
+    return [{**word, "selected": position in chosen} for position, word in enumerate(list_of_word_objects)]
+
+
+def local_get_clue_and_selected_words(list_of_word_objects: list) -> dict | None:
+    """
+        Same output as ai_get_clue_and_selected_words, or None when no clue links
+        at least two of the words
+    """
+    generator = get_board_generator()
+    if generator is None:
+        return None
+    board = [(word, generator.index_of(word["word"])) for word in list_of_word_objects]
+    indices = np.asarray([index for _, index in board if index is not None], dtype=np.int64)
+    if indices.size < 2:
+        return None
+
+    n = len(generator.words)
+    neighbours = generator.neighbour_ids[indices]
+    weights = generator.neighbour_sims[indices].astype(np.float32)
+    #A candidate clue scores the summed similarity of every board word it neighbours
+    scores = np.bincount(neighbours.ravel(), weights=weights.ravel(), minlength=n)
+    counts = np.bincount(neighbours.ravel(), minlength=n)
+    scores[indices] = 0
+    scores[counts < 2] = 0
+    #Best scoring candidate that isn't too close to a board word
+    board_words = [word["word"] for word in list_of_word_objects]
+    best = None
+    for candidate in np.argsort(-scores)[:LOCAL_CLUE_CANDIDATES].tolist():
+        if scores[candidate] <= 0:
+            break
+        if clue_index.is_legal(generator.words[candidate], board_words, count=False):
+            best = candidate
+            break
+    if best is None:
+        return None
+
+    linked = {int(index) for index, row in zip(indices, neighbours) if best in row}
+    return {
+        "clue": generator.words[best],
+        "selected_words": [
+            {"id": word["id"], "word": word["word"], "selected": index in linked}
+            for word, index in board
+        ],
+    }
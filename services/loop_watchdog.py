@@ -0,0 +1,112 @@
+"""
+    Event-loop lag watchdog.
+
+    A heartbeat task sleeps LOOP_WATCHDOG_INTERVAL_MS at a time and measures how late it
+    wakes up; that lateness is the loop lag, exported as event_loop_lag_ms. A watcher
+    thread checks the heartbeat. When the loop has not ticked for LOOP_STALL_THRESHOLD_MS
+    it grabs the loop thread's stack while the blocking code is still running, so the
+    capture points at the culprit (a sync SDK call, a large print, ...) rather than at
+    whatever ran after it. Captures are rate limited to one per LOOP_STALL_CAPTURE_SECONDS,
+    printed, and kept for GET /debug/loop-stalls.
+"""
+from collections import deque
+from datetime import datetime, timezone
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from .metrics import Counter, Gauge
+
+LOOP_WATCHDOG = os.environ.get("LOOP_WATCHDOG", "1") == "1"
+LOOP_WATCHDOG_INTERVAL_MS = float(os.environ.get("LOOP_WATCHDOG_INTERVAL_MS", 100))
+LOOP_STALL_THRESHOLD_MS = float(os.environ.get("LOOP_STALL_THRESHOLD_MS", 200))
+LOOP_STALL_CAPTURE_SECONDS = float(os.environ.get("LOOP_STALL_CAPTURE_SECONDS", 60))
+LOOP_STALLS_KEPT = int(os.environ.get("LOOP_STALLS_KEPT", 20))
+#Window for the max lag gauge
+LOOP_LAG_WINDOW_SECONDS = 60
+
+LOOP_LAG = Gauge("event_loop_lag_ms", "Event loop lag (last heartbeat and max over the last minute)")
+LOOP_STALLS = Counter("event_loop_stalls_total", "Heartbeats later than LOOP_STALL_THRESHOLD_MS")
+LOOP_STALL_CAPTURES = Counter("event_loop_stall_captures_total", "Stacks captured while the loop was blocked")
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float, threshold: float, capture_interval: float, kept: int):
+        self.interval = interval
+        self.threshold = threshold
+        self.capture_interval = capture_interval
+        self.captures = deque(maxlen=kept)
+        self._recent = deque()
+        self._last_beat = 0.0
+        self._captured_beat = 0.0
+        self._last_capture = float("-inf")
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._last_beat = now
+            self.record_lag(max(0.0, now - expected) * 1000, now)
+
+    def record_lag(self, lag_ms: float, now: float):
+        self._recent.append((now, lag_ms))
+        while self._recent[0][0] < now - LOOP_LAG_WINDOW_SECONDS:
+            self._recent.popleft()
+        LOOP_LAG.set(round(lag_ms, 3), stat="last")
+        LOOP_LAG.set(round(max(lag for _, lag in self._recent), 3), stat="max")
+        if lag_ms >= self.threshold * 1000:
+            LOOP_STALLS.inc()
+
+    def _watch(self):
+        #Checks a few times per threshold so a stall is caught while still in progress
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._last_beat
+            blocked = time.perf_counter() - beat - self.interval
+            if blocked < self.threshold or beat == self._captured_beat:
+                continue
+            if time.perf_counter() - self._last_capture < self.capture_interval:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._captured_beat = beat
+            self._last_capture = time.perf_counter()
+            capture = {
+                "at": datetime.now(timezone.utc).isoformat(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "stack": "".join(traceback.format_stack(frame)),
+            }
+            self.captures.append(capture)
+            LOOP_STALL_CAPTURES.inc()
+            print("EVENT LOOP BLOCKED", f"{capture['blocked_ms']}ms", "\n" + capture["stack"])
+
+
+loop_watchdog = LoopWatchdog(
+    LOOP_WATCHDOG_INTERVAL_MS / 1000,
+    LOOP_STALL_THRESHOLD_MS / 1000,
+    LOOP_STALL_CAPTURE_SECONDS,
+    LOOP_STALLS_KEPT,
+)
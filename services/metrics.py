@@ -0,0 +1,89 @@
+"""
+    Minimal in-process metrics, rendered in the Prometheus text format by GET /metrics.
+
+        REQUESTS = Counter("requests_total", "Requests served")
+        REQUESTS.inc(path="/x")
+
+    Values are per worker process, the scraper sums them across workers.
+"""
+import threading
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    inner = ",".join(f'{name}="{str(value)}"' for name, value in key)
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._function = None
+        with _lock:
+            _registry[name] = self
+
+    def set_function(self, function):
+        """Compute the value at scrape time instead, `function` returns a number or {labels_tuple: number}"""
+        self._function = function
+        return self
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self) -> dict:
+        if self._function is None:
+            return dict(self.values)
+        value = self._function()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.samples().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+def get_metric(name: str):
+    return _registry.get(name)
+
+
+def render_metrics() -> str:
+    with _lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
@@ -0,0 +1,162 @@
+"""
+    On-demand profiling of a single request.
+
+    Send `X-Debug-Profile: 1` together with `X-Admin-Key: <ADMIN_KEY>` and the JSON
+    response is wrapped as
+
+        {
+            "response": <the normal response body>,
+            "debug": {
+                "sql": {"count": ..., "total_ms": ..., "statements": [...]},
+                "profile": {"format": "collapsed", "samples": ..., "stacks": "main;f;g 12\\n..."}
+            }
+        }
+
+    `stacks` is in the collapsed format read by flamegraph.pl / speedscope / inferno.
+    The response keeps the endpoint's status and headers, other than its content type
+    and length.
+    Only samples taken while the request's own task is running on the loop are counted.
+"""
+from collections import Counter
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from authentication.auth import is_admin_key
+from data.db_stats import track_queries
+
+#The GIL switch interval (5ms) bounds how often the sampler thread can run anyway
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+MAX_STACK_DEPTH = 128
+REPLACED_HEADERS = {b"content-type", b"content-length", b"content-encoding", b"transfer-encoding"}
+
+
+class SamplingProfiler:
+    """
+        Samples the stack of `thread_id` from a background thread every `interval` seconds.
+        If `task` is given, samples are only kept while that asyncio task is the one running.
+    """
+
+    def __init__(self, thread_id: int, interval: float, loop=None, task=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.loop = loop
+        self.task = task
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.task is not None and asyncio.current_task(self.loop) is not self.task:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def collapse_stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class ProfilingMiddleware:
+    """
+        Plain ASGI middleware (not BaseHTTPMiddleware) so the endpoint runs in the
+        same task as the middleware and the profiler can tell its samples apart.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        if "x-debug-profile" not in headers:
+            return await self.app(scope, receive, send)
+        if not is_admin_key(headers.get("x-admin-key")):
+            return await _send_json(send, 401, {"detail": "Invalid admin key."})
+
+        start_message = None
+        body = []
+
+        async def capture_send(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+            elif message["type"] == "http.response.body":
+                body.append(message.get("body", b""))
+
+        profiler = SamplingProfiler(
+            threading.get_ident(),
+            PROFILE_INTERVAL_MS / 1000,
+            loop=asyncio.get_running_loop(),
+            task=asyncio.current_task(),
+        )
+        started = time.perf_counter()
+        with track_queries() as sql_stats:
+            profiler.start()
+            try:
+                await self.app(scope, receive, capture_send)
+            finally:
+                profiler.stop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        raw_body = b"".join(body)
+        try:
+            original = json.loads(raw_body) if raw_body else None
+        except ValueError:
+            original = raw_body.decode("utf-8", errors="replace")
+        status = start_message["status"] if start_message else 500
+        #The endpoint's own headers (CORS, X-AI-Backend, ETag...), the body is replaced so not its type or length
+        original_headers = [
+            (key, value)
+            for key, value in (start_message or {}).get("headers", [])
+            if key.lower() not in REPLACED_HEADERS
+        ]
+        await _send_json(send, status, {
+            "response": original,
+            "debug": {
+                "elapsed_ms": round(elapsed_ms, 3),
+                "sql": sql_stats.to_dict(),
+                "profile": {
+                    "format": "collapsed",
+                    "interval_ms": PROFILE_INTERVAL_MS,
+                    "samples": profiler.samples,
+                    "stacks": profiler.collapsed(),
+                },
+            },
+        }, extra_headers=original_headers + [
+            (b"x-debug-sql-count", str(sql_stats.count).encode()),
+            (b"x-debug-sql-ms", f"{sql_stats.total_ms:.3f}".encode()),
+        ])
+
+
+async def _send_json(send, status: int, content, extra_headers=None):
+    payload = json.dumps(content, default=str).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(payload)).encode()),
+    ] + (extra_headers or [])
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,62 @@
+"""
+    Tiny in-process scheduler for periodic background jobs.
+
+        schedule("prewarm_daily_puzzles", 3600, prewarm_daily_puzzles)
+
+    Jobs are started with the app and cancelled on shutdown. Every uvicorn worker runs
+    its own copy of each job, so jobs must be safe to run concurrently (use a database
+    lock where it matters).
+"""
+import asyncio
+import time
+from .metrics import Counter, Gauge
+
+JOB_RUNS = Counter("scheduler_job_runs_total", "Scheduled job runs")
+JOB_FAILURES = Counter("scheduler_job_failures_total", "Scheduled job runs that raised")
+JOB_LAST_SECONDS = Gauge("scheduler_job_last_duration_seconds", "Duration of the last run of each job")
+
+_jobs = []
+_tasks = []
+
+
+class Job:
+    def __init__(self, name: str, interval: float, function, initial_delay: float = 0):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.initial_delay = initial_delay
+
+    async def run_once(self):
+        started = time.perf_counter()
+        try:
+            await self.function()
+        except Exception as e:
+            print("SCHEDULED JOB FAILED", self.name, e)
+            JOB_FAILURES.inc(job=self.name)
+        finally:
+            JOB_RUNS.inc(job=self.name)
+            JOB_LAST_SECONDS.set(round(time.perf_counter() - started, 3), job=self.name)
+
+    async def run_forever(self):
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+
+def schedule(name: str, interval: float, function, initial_delay: float = 0) -> Job:
+    job = Job(name, interval, function, initial_delay)
+    _jobs.append(job)
+    return job
+
+
+def start_scheduler():
+    for job in _jobs:
+        _tasks.append(asyncio.create_task(job.run_forever(), name=f"job-{job.name}"))
+
+
+async def stop_scheduler():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
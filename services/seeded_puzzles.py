@@ -0,0 +1,180 @@
+"""
+    Daily and seeded puzzles.
+
+    A seed deterministically picks nine words from the lexicon. The clue is generated
+    once with ai_get_clue_and_selected_words, the puzzle is stored like any other and
+    the serialized response is kept in `seeded_puzzles`. After that every request is
+    served from the stored response (and an in-process cache in front of it).
+
+    Generation takes a Postgres advisory lock on the seed only to check for a stored
+    puzzle and the new seed cap, no connection is held during the model call. Two
+    workers generating the same seed at once both pay for it, the second insert loses
+    (ON CONFLICT) and its board is deleted. Within a worker requests for a seed wait
+    for the first one.
+
+    Every new seed costs a model call, so at most SEEDED_NEW_PER_HOUR new seeds are
+    generated per hour across all workers (SeedLimitReached beyond that). Daily
+    puzzles and admin requests don't count against it. The prewarm job generates
+    tomorrow's daily puzzle ahead of time so midnight traffic only ever reads.
+"""
+from collections import OrderedDict
+from datetime import datetime, date, timedelta, timezone
+from sqlalchemy import select, func
+import asyncio
+import hashlib
+import os
+import random
+import re
+from data.db import SessionLocal, engine
+from data.db_actions import (
+    create_word_connection,
+    add_clue_to_selection,
+    get_seeded_puzzle,
+    add_seeded_puzzle,
+    get_words_by_text,
+    count_recent_seeded_puzzles,
+    delete_word_connection,
+)
+from data.shemas import AIClueWithUnselectedWordsSchema, WordWithoutSelectionSchema
+from .ai import route_clue_and_selected_words
+from .lexicon import get_lexicon
+
+SEED_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+SEEDED_CACHE_SIZE = int(os.environ.get("SEEDED_CACHE_SIZE", 256))
+DAILY_PREWARM_SECONDS = float(os.environ.get("DAILY_PREWARM_SECONDS", 3600))
+SEEDED_MAX_AGE = int(os.environ.get("SEEDED_MAX_AGE", 86400 * 365))
+#0 turns off generating new seeds, stored ones are still served
+SEEDED_NEW_PER_HOUR = int(os.environ.get("SEEDED_NEW_PER_HOUR", 60))
+
+
+class SeedLimitReached(Exception):
+    """Raised when a new seed would go over SEEDED_NEW_PER_HOUR."""
+
+
+class CachedPuzzle:
+    def __init__(self, body: str):
+        self.body = body.encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+
+_cache: OrderedDict[str, CachedPuzzle] = OrderedDict()
+_locks: dict[str, asyncio.Lock] = {}
+
+
+def valid_seed(seed: str) -> bool:
+    return bool(SEED_PATTERN.match(seed))
+
+
+def daily_seed(day: date | None = None) -> str:
+    day = day or datetime.now(timezone.utc).date()
+    return f"daily-{day.isoformat()}"
+
+
+def seconds_until_next_day(now: datetime | None = None) -> int:
+    now = now or datetime.now(timezone.utc)
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return max(1, int((tomorrow - now).total_seconds()))
+
+
+def board_for_seed(seed: str) -> list[str]:
+    """
+        Nine words picked from the lexicon by a RNG seeded with `seed`.
+        String seeds hash the same way in every process, so every worker gets the same board.
+    """
+    lexicon = get_lexicon()
+    rng = random.Random(f"puzzle:{seed}")
+    return [lexicon.word(index) for index in lexicon.sample(9, rng)]
+
+
+def _cache_get(seed: str) -> CachedPuzzle | None:
+    puzzle = _cache.get(seed)
+    if puzzle is not None:
+        _cache.move_to_end(seed)
+    return puzzle
+
+
+def _cache_put(seed: str, body: str) -> CachedPuzzle:
+    puzzle = CachedPuzzle(body)
+    _cache[seed] = puzzle
+    _cache.move_to_end(seed)
+    while len(_cache) > SEEDED_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return puzzle
+
+
+async def _generate(seed: str, limited: bool) -> str:
+    async with engine.connect() as lock_conn:
+        async with lock_conn.begin():
+            #Released when this transaction ends, before the model call
+            await lock_conn.execute(select(func.pg_advisory_xact_lock(func.hashtext(f"puzzle:{seed}"))))
+            async with SessionLocal() as session:
+                existing = await get_seeded_puzzle(session, seed)
+                if existing is not None:
+                    return existing.response_json
+                if limited:
+                    if await count_recent_seeded_puzzles(session, timedelta(hours=1)) >= SEEDED_NEW_PER_HOUR:
+                        raise SeedLimitReached(f"More than {SEEDED_NEW_PER_HOUR} new seeds in the last hour")
+                words = await get_words_by_text(session, board_for_seed(seed))
+    if len(words) != 9:
+        raise ValueError(f"Board for seed {seed} does not match the word table")
+    word_objects = [{"id": word.id, "word": word.word} for word in words]
+
+    #Generated once and served to everyone, always use the model
+    ai_clue_response, _ = await route_clue_and_selected_words(word_objects, tier="high")
+    selected_by_id = {word["id"]: word["selected"] for word in ai_clue_response["selected_words"]}
+    selected_flags = [selected_by_id.get(word.id, False) for word in words]
+    selected_length = len([flag for flag in selected_flags if flag])
+
+    async with SessionLocal() as session:
+        connection = await create_word_connection(session, words, selected_flags=selected_flags)
+        selection_list = [{"word_id": word.id, "selected": flag} for word, flag in zip(words, selected_flags)]
+        clue = await add_clue_to_selection(session, connection.id, selection_list, ai_clue_response["clue"], selected_length)
+
+        response = AIClueWithUnselectedWordsSchema(
+            clue_id=clue.id,
+            clue=clue.clue,
+            number_of_selected_words=clue.clue_word_count,
+            created_at=clue.created_at,
+            words=[WordWithoutSelectionSchema(id=word["id"], word=word["word"]) for word in word_objects],
+        )
+        body = response.model_dump_json()
+        if not await add_seeded_puzzle(session, seed, clue.id, body):
+            #Another worker stored the seed while the model ran, serve theirs
+            existing = await get_seeded_puzzle(session, seed)
+            await delete_word_connection(session, connection.id)
+            return existing.response_json
+    print("SEEDED PUZZLE GENERATED", seed, clue.id)
+    return body
+
+
+async def get_seeded_puzzle_response(seed: str, limited: bool = False) -> CachedPuzzle:
+    """
+        Stored response for a seed, generating it the first time.
+        limited: count a new seed against SEEDED_NEW_PER_HOUR
+    """
+    puzzle = _cache_get(seed)
+    if puzzle is not None:
+        return puzzle
+    lock = _locks.setdefault(seed, asyncio.Lock())
+    try:
+        async with lock:
+            puzzle = _cache_get(seed)
+            if puzzle is None:
+                async with SessionLocal() as session:
+                    existing = await get_seeded_puzzle(session, seed)
+                body = existing.response_json if existing is not None else await _generate(seed, limited)
+                puzzle = _cache_put(seed, body)
+    finally:
+        #Also when generation failed, or failed seeds would keep their locks forever
+        if _locks.get(seed) is lock:
+            _locks.pop(seed, None)
+    return puzzle
+
+
+async def prewarm_daily_puzzles():
+    """
+        Scheduled job: make sure today's and tomorrow's daily puzzles exist and are cached
+    """
+    today = datetime.now(timezone.utc).date()
+    for day in (today, today + timedelta(days=1)):
+        await get_seeded_puzzle_response(daily_seed(day))
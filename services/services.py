@@ -1,15 +1,11 @@
 
-from pathlib import Path
 import random
+from .lexicon import get_lexicon
 
 def get_nine_random_words_and_select(noOfWords : int) -> list:
-    BASE_DIR = Path(__file__).resolve().parent.parent
-    file_path = BASE_DIR / "word_list.txt"
-
-    with open(file_path, "r") as file:
-        words = [line.strip() for line in file]
-
-    nine_random_words = random.sample(words,9)
+    #Sample from the shared memory-mapped lexicon instead of re-reading word_list.txt
+    lexicon = get_lexicon()
+    nine_random_words = [lexicon.word(index) for index in lexicon.sample(9)]
     selected_words = random.sample(nine_random_words,noOfWords)
     list_of_word_selections = []
     count = 1
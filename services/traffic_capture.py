@@ -0,0 +1,445 @@
+"""
+    Traffic capture and deterministic replay.
+
+    With TRAFFIC_CAPTURE_FILE set, every request (except /metrics and /debug) is appended
+    to that file as one JSON line, together with every model call made for it:
+
+        {"t":"req","id":"<pid>-<n>","ts":..., "m":"POST","p":"/guessselection","q":"",
+         "h":{"content-type":"application/json"},"b":"<body>","s":200,"ms":812.4}
+        {"t":"ai","req":"<pid>-<n>","ts":...,"f":"ai_guess_word","a":[...],"u":{...},"r":[...],"ms":790.1}
+
+    Bodies are kept as text (base64 with "b64": true for MessagePack), API and admin keys,
+    cookies and every header not in CAPTURED_HEADERS are dropped. Each record is a single
+    O_APPEND write, so all workers can share one file.
+
+    Replay it against a local build started with AI_REPLAY_FILE pointing at the capture.
+    Model calls are then answered from the recorded results after sleeping the recorded
+    latency; the same inputs get their recorded result (in recorded order), other inputs
+    (e.g. random boards) get the next recorded result of that call mapped onto the board.
+
+        AI_REPLAY_FILE=capture.jsonl uvicorn main:app
+        python -m services.traffic_capture replay capture.jsonl --target http://127.0.0.1:8000 --output replay.json
+        python -m services.traffic_capture compare baseline.json replay.json --tolerance 0.25
+        python -m services.traffic_capture stats capture.jsonl
+
+    Requests are sent at their recorded arrival times (--speed 2 sends twice as fast), so
+    the load is open loop like production and tail latency is comparable between builds.
+"""
+from collections import defaultdict, deque
+import base64
+import contextvars
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+TRAFFIC_CAPTURE_FILE = os.environ.get("TRAFFIC_CAPTURE_FILE")
+#Fraction of requests captured, model calls of captured requests are always kept
+TRAFFIC_CAPTURE_SAMPLE = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE", 1.0))
+TRAFFIC_CAPTURE_MAX_BODY = int(os.environ.get("TRAFFIC_CAPTURE_MAX_BODY", 65536))
+AI_REPLAY_FILE = os.environ.get("AI_REPLAY_FILE")
+
+CAPTURED_HEADERS = {
+    "content-type",
+    "accept",
+    "idempotency-key",
+    "if-none-match",
+    "x-latency-budget",
+    "x-quality-tier",
+}
+SKIPPED_PREFIXES = ("/metrics", "/debug")
+
+#Capture id of the request being handled, model calls are recorded against it
+current_request: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_request", default=None)
+
+
+class CaptureWriter:
+    def __init__(self, path: str | None):
+        self.path = path
+        self._fd = None
+        self._ids = itertools.count(1)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def next_id(self) -> str:
+        return f"{os.getpid()}-{next(self._ids)}"
+
+    def write(self, record: dict):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        #One write per line, lines from different workers never interleave
+        os.write(self._fd, (json.dumps(record, separators=(",", ":"), default=str) + "\n").encode("utf-8"))
+
+    def record_ai(self, function: str, args: tuple, usage: dict | None, result, latency_ms: float):
+        request_id = current_request.get()
+        if request_id is None:
+            return
+        try:
+            self.write({
+                "t": "ai",
+                "req": request_id,
+                "ts": round(time.time(), 4),
+                "f": function,
+                "a": list(args),
+                "u": usage or None,
+                "r": result,
+                "ms": round(latency_ms, 2),
+            })
+        except Exception as e:
+            print("TRAFFIC CAPTURE ERROR", e)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+capture = CaptureWriter(TRAFFIC_CAPTURE_FILE)
+
+
+class TrafficCaptureMiddleware:
+    """
+        Plain ASGI middleware, like ProfilingMiddleware. Added outermost so it records
+        requests as clients sent them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not capture.enabled
+            or scope["path"].startswith(SKIPPED_PREFIXES)
+            or random.random() >= TRAFFIC_CAPTURE_SAMPLE
+        ):
+            return await self.app(scope, receive, send)
+
+        request_id = capture.next_id()
+        token = current_request.set(request_id)
+        started = time.perf_counter()
+        arrived = time.time()
+        chunks = []
+        status = None
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            current_request.reset(token)
+            headers = {}
+            for key, value in scope["headers"]:
+                name = key.decode("latin-1").lower()
+                if name in CAPTURED_HEADERS:
+                    headers[name] = value.decode("latin-1")
+            record = {
+                "t": "req",
+                "id": request_id,
+                "ts": round(arrived, 4),
+                "m": scope["method"],
+                "p": scope["path"],
+                "q": scope.get("query_string", b"").decode("latin-1"),
+                "h": headers,
+                "s": status,
+                "ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            body = b"".join(chunks)
+            if len(body) > TRAFFIC_CAPTURE_MAX_BODY:
+                record["truncated"] = True
+            elif body:
+                try:
+                    record["b"] = body.decode("utf-8")
+                except UnicodeDecodeError:
+                    record["b"] = base64.b64encode(body).decode("ascii")
+                    record["b64"] = True
+            try:
+                capture.write(record)
+            except Exception as e:
+                print("TRAFFIC CAPTURE ERROR", e)
+
+
+def read_capture(path: str) -> list[dict]:
+    records = []
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                #A worker killed mid-write leaves a partial last line
+                continue
+    return records
+
+
+def _board_ids(args: list) -> list:
+    return [word["id"] for word in args[0]] if args and isinstance(args[0], list) else []
+
+
+def _replay_key(function: str, args: list) -> str:
+    #Board word ids plus any scalar arguments (clue, number of words)
+    return json.dumps([function, _board_ids(args), [arg for arg in args[1:] if not isinstance(arg, (list, dict))]])
+
+
+def _map_selection(board: list, recorded: list, count: int | None = None) -> list:
+    """
+        A recorded selection moved onto another board by position
+    """
+    flags = [bool(word.get("selected")) for word in recorded]
+    flags = (flags + [False] * len(board))[:len(board)]
+    if count is not None:
+        chosen = [position for position, flag in enumerate(flags) if flag][:count]
+        chosen += [position for position in range(len(board)) if position not in chosen][:count - len(chosen)]
+        flags = [position in chosen for position in range(len(board))]
+    return [{**word, "selected": flag} for word, flag in zip(board, flags)]
+
+
+class AIReplay:
+    """
+        Model stub serving the model calls of a capture file
+    """
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self._by_key: dict[str, deque] = defaultdict(deque)
+        self._by_function: dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def active(self) -> bool:
+        return bool(self.path)
+
+    def _load(self):
+        for record in read_capture(self.path):
+            if record.get("t") == "ai":
+                self._by_key[_replay_key(record["f"], record["a"])].append(record)
+                self._by_function[record["f"]].append(record)
+        self._loaded = True
+        print("AI REPLAY LOADED", {function: len(calls) for function, calls in self._by_function.items()})
+
+    def _next(self, function: str, args: tuple) -> tuple[dict, bool]:
+        """
+            (record, exact) for a call, exact is False when the inputs were never recorded
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            calls = self._by_key.get(_replay_key(function, list(args)))
+            exact = bool(calls)
+            if not exact:
+                calls = self._by_function.get(function)
+            if not calls:
+                raise LookupError(f"No recorded {function} calls to replay")
+            record = calls[0]
+            #Cycle, so a replay longer than the capture keeps going
+            calls.rotate(-1)
+            return record, exact
+
+    def stub(self, function):
+        """
+            Stand-in for a model function: blocks for the recorded latency and returns
+            the recorded result
+        """
+        name = function.__name__
+
+        def replayed(*args, usage: dict | None = None, **kwargs):
+            record, exact = self._next(name, args)
+            time.sleep(record["ms"] / 1000)
+            if usage is not None and record.get("u"):
+                usage.update(record["u"])
+            result = record["r"]
+            if exact or not args or not isinstance(args[0], list):
+                return json.loads(json.dumps(result))
+            board = [dict(word) for word in args[0]]
+            if isinstance(result, dict) and "selected_words" in result:
+                return {"clue": result["clue"], "selected_words": _map_selection(board, result["selected_words"])}
+            if isinstance(result, list):
+                count = args[2] if len(args) > 2 and isinstance(args[2], int) else None
+                return _map_selection(board, result, count)
+            return result
+        replayed.__name__ = name
+        return replayed
+
+
+ai_replay = AIReplay(AI_REPLAY_FILE)
+
+
+#REPLAY CLIENT
+
+def _percentile(ordered: list[float], p: float) -> float | None:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 2)
+
+
+def _summary(latencies: list[float], statuses: list[int | None], elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if status is None or status >= 500),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": _percentile(ordered, 50),
+        "p95_ms": _percentile(ordered, 95),
+        "p99_ms": _percentile(ordered, 99),
+        "max_ms": round(ordered[-1], 2) if ordered else None,
+    }
+
+
+async def replay(path: str, target: str, api_key: str | None, speed: float, limit: int | None, timeout: float, output: str):
+    import asyncio
+    import httpx
+
+    requests = sorted((record for record in read_capture(path) if record.get("t") == "req"), key=lambda record: record["ts"])
+    requests = [record for record in requests if not record.get("truncated")][:limit]
+    if not requests:
+        raise SystemExit(f"No requests in {path}")
+    first = requests[0]["ts"]
+    results = defaultdict(lambda: ([], []))
+
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=httpx.Limits(max_connections=None)) as client:
+        async def send(record: dict):
+            headers = dict(record.get("h", {}))
+            if api_key:
+                headers["x-api-key"] = api_key
+            body = record.get("b")
+            if body is not None:
+                body = base64.b64decode(body) if record.get("b64") else body.encode("utf-8")
+            url = record["p"] + (f"?{record['q']}" if record.get("q") else "")
+            started = time.perf_counter()
+            try:
+                response = await client.request(record["m"], url, headers=headers, content=body)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                print("REPLAY ERROR", record["m"], record["p"], e)
+                status = None
+            latency_ms = (time.perf_counter() - started) * 1000
+            for path_key in (record["p"], "all"):
+                results[path_key][0].append(latency_ms)
+                results[path_key][1].append(status)
+
+        started = time.perf_counter()
+        tasks = []
+        for record in requests:
+            #Open loop, at the recorded arrival times
+            delay = (record["ts"] - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(record)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    report = {
+        "capture": path,
+        "target": target,
+        "speed": speed,
+        "elapsed_s": round(elapsed, 2),
+        "results": {path_key: _summary(latencies, statuses, elapsed) for path_key, (latencies, statuses) in sorted(results.items())},
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    for path_key, result in report["results"].items():
+        print(f"{path_key:>40}: {result['requests']:6d} req  {result['throughput_rps']:8.2f}/s  "
+              f"p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f}ms  {result['errors']} errors")
+    print("REPORT WRITTEN", output)
+
+
+def compare(baseline_path: str, report_path: str, tolerance: float) -> int:
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    with open(report_path) as file:
+        report = json.load(file)
+    if baseline.get("capture") != report.get("capture") or baseline.get("speed") != report.get("speed"):
+        print("WARNING DIFFERENT CAPTURES OR SPEEDS", baseline.get("capture"), report.get("capture"))
+
+    regressions = []
+    for path_key, result in report["results"].items():
+        base = baseline["results"].get(path_key)
+        if base is None:
+            print(f"{path_key:>40}: new")
+            continue
+        ratio = result["p99_ms"] / base["p99_ms"] if base["p99_ms"] else 1.0
+        status = "ok"
+        if ratio > 1 + tolerance:
+            status = "SLOWER"
+            regressions.append(path_key)
+        if result["errors"] > base["errors"]:
+            status = "MORE ERRORS"
+            regressions.append(path_key)
+        print(f"{path_key:>40}: p50 {base['p50_ms']:8.2f} -> {result['p50_ms']:8.2f}  "
+              f"p99 {base['p99_ms']:8.2f} -> {result['p99_ms']:8.2f}ms ({ratio:5.2f}x)  "
+              f"{base['throughput_rps']} -> {result['throughput_rps']}/s  {status}")
+    if regressions:
+        print("REGRESSIONS", sorted(set(regressions)))
+        return 1
+    return 0
+
+
+def stats(path: str):
+    records = read_capture(path)
+    requests = [record for record in records if record.get("t") == "req"]
+    calls = [record for record in records if record.get("t") == "ai"]
+    if requests:
+        span = max(record["ts"] for record in requests) - min(record["ts"] for record in requests)
+        print(f"{len(requests)} requests over {span:.0f}s, {len(calls)} model calls")
+    by_path = defaultdict(list)
+    for record in requests:
+        by_path[(record["m"], record["p"])].append(record["ms"])
+    for (method, path_key), latencies in sorted(by_path.items()):
+        ordered = sorted(latencies)
+        print(f"{method:>6} {path_key:<40} {len(ordered):6d}  p50 {_percentile(ordered, 50):8.2f}  p99 {_percentile(ordered, 99):8.2f}ms")
+    by_function = defaultdict(list)
+    for record in calls:
+        by_function[record["f"]].append(record["ms"])
+    for function, latencies in sorted(by_function.items()):
+        ordered = sorted(latencies)
+        print(f"{'model':>6} {function:<40} {len(ordered):6d}  p50 {_percentile(ordered, 50):8.2f}  p99 {_percentile(ordered, 99):8.2f}ms")
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import sys
+    parser = argparse.ArgumentParser(description="Traffic capture and replay")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="Re-drive captured requests against a server")
+    replay_parser.add_argument("capture")
+    replay_parser.add_argument("--target", default="http://127.0.0.1:8000")
+    replay_parser.add_argument("--api-key", default=os.environ.get("AUTH_KEY"))
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="2 replays twice as fast as recorded")
+    replay_parser.add_argument("--limit", type=int, default=None)
+    replay_parser.add_argument("--timeout", type=float, default=60)
+    replay_parser.add_argument("--output", default="replay.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare a replay report against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("report")
+    compare_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p99 growth, 0.25 = 25%%")
+
+    stats_parser = subparsers.add_parser("stats", help="Summarize a capture file")
+    stats_parser.add_argument("capture")
+
+    args = parser.parse_args()
+    if args.command == "replay":
+        asyncio.run(replay(args.capture, args.target, args.api_key, args.speed, args.limit, args.timeout, args.output))
+    elif args.command == "compare":
+        sys.exit(compare(args.baseline, args.report, args.tolerance))
+    elif args.command == "stats":
+        stats(args.capture)
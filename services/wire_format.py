@@ -0,0 +1,279 @@
+"""
+    MessagePack content negotiation.
+
+    Requests with `Accept: application/msgpack` get MessagePack instead of JSON from every
+    JSON endpoint, and request bodies can be sent with `Content-Type: application/msgpack`.
+    Word lists are encoded compactly as positional arrays instead of repeating the keys:
+
+        {"id": 992, "word": "golf", "selected": true}   ->   [992, "golf", true]
+        {"id": 992, "word": "golf"}                     ->   [992, "golf"]
+
+    Request bodies may use either form. The endpoints themselves only ever see JSON, the
+    middleware converts on the way in and out.
+
+    Needs the msgpack package, without it everything stays JSON.
+
+        python -m services.wire_format bench
+"""
+import json
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPE = "application/msgpack"
+WORD_KEYS = ("id", "word", "selected")
+
+
+def _is_word(value) -> bool:
+    return (
+        isinstance(value, dict)
+        and isinstance(value.get("id"), int)
+        and isinstance(value.get("word"), str)
+        and set(value) <= set(WORD_KEYS)
+    )
+
+
+def compact_words(value):
+    """
+        Replace word objects with positional arrays, anywhere in a decoded JSON document
+    """
+    if isinstance(value, list):
+        if value and all(_is_word(item) for item in value):
+            return [[item[key] for key in WORD_KEYS if key in item] for item in value]
+        return [compact_words(item) for item in value]
+    if isinstance(value, dict):
+        return {key: compact_words(item) for key, item in value.items()}
+    return value
+
+
+def _is_compact_word(value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) in (2, 3)
+        and isinstance(value[0], int)
+        and isinstance(value[1], str)
+        and (len(value) == 2 or value[2] is None or isinstance(value[2], bool))
+    )
+
+
+def expand_words(value):
+    """
+        Inverse of compact_words
+    """
+    if isinstance(value, list):
+        if value and all(_is_compact_word(item) for item in value):
+            return [dict(zip(WORD_KEYS, item)) for item in value]
+        return [expand_words(item) for item in value]
+    if isinstance(value, dict):
+        return {key: expand_words(item) for key, item in value.items()}
+    return value
+
+
+def json_to_msgpack(body: bytes) -> bytes:
+    return msgpack.packb(compact_words(json.loads(body)), use_bin_type=True)
+
+
+def msgpack_to_json(body: bytes) -> bytes:
+    return json.dumps(expand_words(msgpack.unpackb(body, raw=False))).encode("utf-8")
+
+
+def accepts_msgpack(accept: str) -> bool:
+    for part in accept.split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        if media_type.lower() == MSGPACK_TYPE:
+            #Honour an explicit q=0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+    return False
+
+
+class MsgPackMiddleware:
+    """
+        Plain ASGI middleware, like ProfilingMiddleware
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or msgpack is None:
+            return await self._without_msgpack(scope, receive, send)
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        msgpack_request = headers.get("content-type", "").split(";")[0].strip().lower() == MSGPACK_TYPE
+        msgpack_response = accepts_msgpack(headers.get("accept", ""))
+        if not msgpack_response:
+            #The JSON answer depends on Accept too, shared caches must not serve it to MessagePack clients
+            send = _vary_accept(send)
+        if not msgpack_request and not msgpack_response:
+            return await self.app(scope, receive, send)
+
+        if msgpack_request:
+            body = await _read_body(receive)
+            try:
+                body = msgpack_to_json(body) if body else body
+            except Exception:
+                return await _send(send, 400, "application/json", json.dumps({"detail": "Invalid MessagePack body."}).encode())
+            scope = dict(scope, headers=[
+                (key, value) for key, value in scope["headers"] if key.lower() not in (b"content-type", b"content-length")
+            ] + [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())])
+            receive = _replay(body)
+
+        if not msgpack_response:
+            return await self.app(scope, receive, send)
+
+        #Conditional requests carry the MessagePack entity tag, the endpoint knows the JSON one
+        scope = dict(scope, headers=[
+            (key, _json_etag(value) if key.lower() == b"if-none-match" else value) for key, value in scope["headers"]
+        ])
+        start_message = None
+        convert = False
+        chunks = []
+
+        async def capture_send(message):
+            nonlocal start_message, convert
+            if message["type"] == "http.response.start":
+                response_headers = dict((key.lower(), value) for key, value in message.get("headers", []))
+                convert = response_headers.get(b"content-type", b"").startswith(b"application/json")
+                if not convert:
+                    #Anything else (text, streams, 304s) passes through, a 304 still names the MessagePack tag
+                    headers = [
+                        (key, _msgpack_etag(value) if key.lower() == b"etag" and message["status"] == 304 else value)
+                        for key, value in message.get("headers", [])
+                    ]
+                    return await send(dict(message, headers=headers + [(b"vary", b"Accept")]))
+                start_message = message
+            elif message["type"] == "http.response.body" and convert:
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    await _finish()
+            else:
+                await send(message)
+
+        async def _finish():
+            body = b"".join(chunks)
+            response_headers = [
+                (key, _msgpack_etag(value) if key.lower() == b"etag" else value)
+                for key, value in start_message.get("headers", [])
+                if key.lower() not in (b"content-type", b"content-length")
+            ]
+            if body:
+                body = json_to_msgpack(body)
+                response_headers.append((b"content-type", MSGPACK_TYPE.encode()))
+            response_headers += [(b"content-length", str(len(body)).encode()), (b"vary", b"Accept")]
+            await send({"type": "http.response.start", "status": start_message["status"], "headers": response_headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, capture_send)
+
+    async def _without_msgpack(self, scope, receive, send):
+        if scope["type"] == "http" and msgpack is None:
+            for key, value in scope["headers"]:
+                if key.lower() == b"content-type" and value.split(b";")[0].strip().lower() == MSGPACK_TYPE.encode():
+                    return await _send(send, 415, "application/json", json.dumps({"detail": "MessagePack is not available."}).encode())
+        return await self.app(scope, receive, send)
+
+
+def _vary_accept(send):
+    async def vary_send(message):
+        if message["type"] == "http.response.start":
+            response_headers = message.get("headers", [])
+            content_type = dict((key.lower(), value) for key, value in response_headers).get(b"content-type", b"")
+            if content_type.startswith(b"application/json") or message["status"] == 304:
+                message = dict(message, headers=list(response_headers) + [(b"vary", b"Accept")])
+        await send(message)
+    return vary_send
+
+
+def _msgpack_etag(etag: bytes) -> bytes:
+    #A different representation needs a different entity tag
+    return etag[:-1] + b'-mp"' if etag.endswith(b'"') else etag + b"-mp"
+
+
+def _json_etag(value: bytes) -> bytes:
+    return value.replace(b'-mp"', b'"')
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _replay(body: bytes):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+    return receive
+
+
+async def _send(send, status: int, content_type: str, body: bytes):
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", content_type.encode()),
+        (b"content-length", str(len(body)).encode()),
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _bench(iterations: int):
+    words = [{"id": 900 + i, "word": word, "selected": i % 3 == 0} for i, word in enumerate(
+        ["golf", "budget", "excitement", "study", "guarantee", "anger", "work", "silly", "holiday"]
+    )]
+    samples = {
+        "board": [{"id": word["id"], "word": word["word"]} for word in words],
+        "clue response": {
+            "clue_id": 123456,
+            "clue": "leisure",
+            "number_of_selected_words": 3,
+            "created_at": "2026-10-19T12:00:00.000000",
+            "words": words,
+        },
+    }
+    for name, document in samples.items():
+        json_body = json.dumps(document).encode("utf-8")
+        msgpack_body = json_to_msgpack(json_body)
+        assert json.loads(msgpack_to_json(msgpack_body)) == document
+
+        timings = {}
+        for label, function in (
+            ("json encode", lambda: json.dumps(document).encode("utf-8")),
+            ("json decode", lambda: json.loads(json_body)),
+            ("msgpack encode", lambda: msgpack.packb(compact_words(document), use_bin_type=True)),
+            ("msgpack decode", lambda: expand_words(msgpack.unpackb(msgpack_body, raw=False))),
+        ):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                function()
+            timings[label] = (time.perf_counter() - started) / iterations * 1e6
+        print(f"{name}: json {len(json_body)} bytes, msgpack {len(msgpack_body)} bytes "
+              f"({len(msgpack_body) / len(json_body):.0%})")
+        for label, microseconds in timings.items():
+            print(f"    {label:>15}: {microseconds:6.2f}us")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="MessagePack wire format")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Compare payload size and CPU with JSON")
+    bench_parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    if msgpack is None:
+        raise SystemExit("msgpack is not installed")
+    _bench(args.iterations)
@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+from data import association_graph as graph_module
+from data.association_graph import AssociationGraph
+from data.models import pack_selection
+
+
+class FakeSession:
+    """
+        Answers refresh()'s compact query from a list of stored clues
+    """
+
+    def __init__(self):
+        self.clues = []
+
+    def store(self, clue_id: int, clue: str, word_ids: list[int], selected: list[bool]):
+        selected_mask, known_mask = pack_selection(selected)
+        self.clues.append(SimpleNamespace(
+            id=clue_id, clue=clue, word_ids=word_ids, selected_mask=selected_mask, known_mask=known_mask,
+        ))
+
+    async def execute(self, statement):
+        params = statement.compile().params
+        after = next(value for name, value in params.items() if name.startswith("id_"))
+        rows = sorted((clue for clue in self.clues if clue.id > after), key=lambda clue: clue.id)
+        return SimpleNamespace(all=lambda: rows[:graph_module.ASSOC_LOAD_BATCH])
+
+
+def test_refresh_picks_up_clues_committed_late():
+    graph = AssociationGraph()
+    session = FakeSession()
+    session.store(1, "sport", [10, 11, 12], [True, True, False])
+    session.store(3, "sport", [10, 11, 12], [True, True, False])
+    assert asyncio.run(graph.refresh(session)) == 2
+    #Id 2 was reserved first but committed after 3 had been read
+    session.store(2, "sport", [10, 11, 12], [True, False, False])
+    assert asyncio.run(graph.refresh(session)) == 1
+    assert graph.clue_counts["sport"] == 3
+    assert graph.edges["sport"] == {10: 3, 11: 2}
+
+
+def test_clues_added_locally_are_not_counted_again():
+    graph = AssociationGraph()
+    session = FakeSession()
+    session.store(1, "sport", [10, 11], [True, False])
+    graph.add("sport", [10], clue_id=1)
+    assert asyncio.run(graph.refresh(session)) == 0
+    assert asyncio.run(graph.refresh(session)) == 0
+    assert graph.clue_counts["sport"] == 1
@@ -0,0 +1,34 @@
+import pytest
+from services.clue_legality import ClueIndex, stem
+
+
+@pytest.mark.parametrize("clue, board, reason", [
+    ("golf", ["Golf", "work"], "exact"),
+    ("golfer", ["golf"], "stem"),
+    ("holidays", ["holiday"], "substring"),
+    ("running", ["runner"], "stem"),
+    ("football", ["ball"], "substring"),
+    ("two words", ["golf"], "format"),
+    ("", ["golf"], "format"),
+    ("r2d2", ["golf"], "format"),
+    ("leisure", ["golf", "work", "holiday"], None),
+    #Shorter than CLUE_MIN_SUBSTRING may appear inside the clue
+    ("elephant", ["ant"], None),
+])
+def test_rejection(clue, board, reason):
+    assert ClueIndex().rejection(clue, board) == reason
+
+
+def test_similar_spelling_is_rejected():
+    assert ClueIndex().rejection("planet", ["planes"]) in ("stem", "similar")
+
+
+def test_only_board_words_are_indexed():
+    index = ClueIndex()
+    index.is_legal("leisure", ["golf", "work"], count=False)
+    assert set(index.features) == {"golf", "work"}
+
+
+def test_stem():
+    assert stem("running") == "run"
+    assert stem("golfers") == stem("golfer") == "golf"
@@ -0,0 +1,40 @@
+import json
+from services.ai import ClueStreamParser
+
+OUTPUT = json.dumps({
+    "clue": 'leisure "time"',
+    "selected_words": [
+        {"id": 992, "word": "golf", "selected": True},
+        {"id": 747, "word": "budget", "selected": False},
+        {"id": 942, "word": "holiday", "selected": True},
+    ],
+})
+
+
+def feed_in_pieces(size: int) -> tuple[ClueStreamParser, list]:
+    parser = ClueStreamParser()
+    parts = []
+    for start in range(0, len(OUTPUT), size):
+        parts += parser.feed(OUTPUT[start:start + size])
+    return parser, parts
+
+
+def test_parts_are_the_same_however_the_output_is_split():
+    expected = [("clue", 'leisure "time"')] + [("word", word) for word in json.loads(OUTPUT)["selected_words"]]
+    for size in (1, 2, 3, 7, 64, len(OUTPUT)):
+        parser, parts = feed_in_pieces(size)
+        assert parts == expected, size
+        assert parser.result() == json.loads(OUTPUT)
+
+
+def test_clue_is_emitted_before_the_words_arrive():
+    parser = ClueStreamParser()
+    assert parser.feed('{"clue": "leis') == []
+    assert parser.feed('ure", "selected_words": [{"id": 1, "wo') == [("clue", "leisure")]
+    assert parser.feed('rd": "golf", "selected": true}') == [("word", {"id": 1, "word": "golf", "selected": True})]
+
+
+def test_result_strips_a_code_fence():
+    parser = ClueStreamParser()
+    parser.feed("```python\n" + OUTPUT + "\n```")
+    assert parser.result() == json.loads(OUTPUT)
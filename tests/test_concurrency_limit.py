@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+from services import concurrency_limit
+from services.concurrency_limit import AdaptiveLimiter, ModelOverloaded
+
+
+class Overloaded(Exception):
+    pass
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_calls_over_the_limit_wait_in_order():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=1, queue_timeout_ms=1000)
+        order = []
+
+        async def call(name, seconds):
+            async with limiter.slot("guess"):
+                order.append(name)
+                await asyncio.sleep(seconds)
+
+        await asyncio.gather(call("a", 0.02), call("b", 0), call("c", 0))
+        return order, limiter
+
+    order, limiter = run(scenario())
+    assert order == ["a", "b", "c"]
+    assert limiter.inflight == 0
+
+
+def test_queue_timeout_and_full_queue_reject():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=1, queue_max=1, queue_timeout_ms=20)
+        await limiter.acquire()
+        results = await asyncio.gather(limiter.acquire(), limiter.acquire(), return_exceptions=True)
+        return limiter, results
+
+    limiter, results = run(scenario())
+    assert [type(result) for result in results] == [ModelOverloaded, ModelOverloaded]
+    assert limiter.inflight == 1
+    assert not limiter._waiters
+
+
+def test_cancelled_waiter_leaves_no_slot_behind():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=1, queue_timeout_ms=1000)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release("guess", 10)
+        return limiter
+
+    limiter = run(scenario())
+    assert limiter.inflight == 0
+    assert not limiter._waiters
+
+
+def test_limit_grows_while_in_use_and_fast():
+    limiter = AdaptiveLimiter(initial=2, max_limit=4)
+    for _ in range(50):
+        limiter.inflight = int(limiter.limit)
+        limiter.release("guess", 10)
+    assert limiter.limit == 4
+
+
+def test_limit_does_not_grow_when_unused():
+    limiter = AdaptiveLimiter(initial=4)
+    limiter.inflight = 1
+    limiter.release("guess", 10)
+    assert limiter.limit == 4
+
+
+def test_slow_call_and_overload_cut_the_limit():
+    limiter = AdaptiveLimiter(initial=10, overload_errors=(Overloaded,))
+    for _ in range(concurrency_limit.AI_BASELINE_MIN_SAMPLES):
+        limiter.inflight = 2
+        limiter.release("guess", 10)
+    limiter.inflight = 2
+    limiter.release("guess", 100)
+    assert limiter.limit == pytest.approx(10 * concurrency_limit.AI_LIMIT_BACKOFF)
+
+    async def overloaded_call():
+        async with limiter.slot("guess"):
+            raise Overloaded()
+
+    #Cuts are at most once per baseline latency
+    limiter._last_decrease = 0
+    with pytest.raises(Overloaded):
+        run(overloaded_call())
+    assert limiter.limit == pytest.approx(10 * concurrency_limit.AI_LIMIT_BACKOFF ** 2)
+
+
+def test_no_latency_cuts_before_enough_samples():
+    limiter = AdaptiveLimiter(initial=10)
+    limiter.inflight = 2
+    limiter.release("guess", 10)
+    limiter.release("guess", 100)
+    assert limiter.limit == 10
+
+
+def test_one_fast_response_does_not_become_the_baseline():
+    limiter = AdaptiveLimiter(initial=10)
+    limiter.inflight = 2
+    limiter.release("clue", 20)
+    #Normal model latency spread, well over twice the one fast response
+    for latency_ms in (400, 700, 500, 750, 600) * 20:
+        limiter.inflight = 1
+        limiter.release("clue", latency_ms)
+    assert limiter.limit == 10
+    assert limiter.baselines["clue"] == 400
+
+
+def test_baseline_follows_latency_down_again():
+    limiter = AdaptiveLimiter(initial=10)
+    for latency_ms in [1000] * 100 + [300] * 100:
+        limiter.inflight = 1
+        limiter.release("clue", latency_ms)
+    assert limiter.baselines["clue"] == 300
+
+
+def test_each_kind_has_its_own_baseline():
+    limiter = AdaptiveLimiter(initial=4)
+    for kind, latency_ms in (("guess", 50), ("clue", 300)) * 5:
+        limiter.inflight = 4
+        limiter.release(kind, latency_ms)
+    assert limiter.baselines == {"guess": 50, "clue": 300}
+    assert limiter.limit > 4
+
+
+def test_other_errors_release_without_adapting():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=4)
+        with pytest.raises(ValueError):
+            async with limiter.slot("guess"):
+                raise ValueError()
+        return limiter
+
+    limiter = run(scenario())
+    assert limiter.inflight == 0
+    assert limiter.limit == 4
+    assert limiter.baselines == {}
@@ -0,0 +1,25 @@
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from data import db
+from data.models import Word
+
+
+def test_reads_follow_writes_within_a_session_only(monkeypatch):
+    replica = create_async_engine("postgresql+asyncpg://replica/words")
+    monkeypatch.setattr(db, "read_engine", replica)
+    token = db._use_replica.set(True)
+    try:
+        first = db.RoutingSession()
+        assert first.get_bind(clause=select(Word)) is replica.sync_engine
+        assert first.get_bind(clause=insert(Word)) is db.engine.sync_engine
+        assert first.get_bind(clause=select(Word)) is db.engine.sync_engine
+        #Same task, new session: back on the replica
+        second = db.RoutingSession()
+        assert second.get_bind(clause=select(Word)) is replica.sync_engine
+    finally:
+        db._use_replica.reset(token)
+
+
+def test_reads_outside_read_only_actions_use_the_primary(monkeypatch):
+    monkeypatch.setattr(db, "read_engine", create_async_engine("postgresql+asyncpg://replica/words"))
+    assert db.RoutingSession().get_bind(clause=select(Word)) is db.engine.sync_engine
@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import create_engine, text
+from data.db_stats import attach_query_listeners, query_budget, QueryBudgetExceeded
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    attach_query_listeners(engine)
+    return engine
+
+
+def test_query_budget_counts_statements(engine):
+    with engine.connect() as conn:
+        with query_budget(2) as stats:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+    assert stats.count == 2
+    assert [statement["sql"] for statement in stats.statements] == ["SELECT 1", "SELECT 2"]
+
+
+def test_query_budget_fails_when_exceeded(engine):
+    with engine.connect() as conn:
+        with pytest.raises(QueryBudgetExceeded, match="Query budget of 1 exceeded, 2 statements ran"):
+            with query_budget(1):
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
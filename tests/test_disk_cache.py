@@ -0,0 +1,45 @@
+import pytest
+from services import disk_cache
+from services.disk_cache import DiskCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+def test_round_trip_and_namespaces(path):
+    cache = DiskCache(path, "model-a:1")
+    cache.put(("guess", "leisure", 2), [{"id": 1, "word": "golf"}])
+    assert cache.get(("guess", "leisure", 2)) == [{"id": 1, "word": "golf"}]
+    assert cache.get(("guess", "leisure", 3)) is None
+    assert DiskCache(path, "model-b:1").get(("guess", "leisure", 2)) is None
+
+
+def test_expired_entries_are_not_returned(path):
+    cache = DiskCache(path, "model", ttl=-1)
+    cache.put("key", "value")
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_are_evicted(path, monkeypatch):
+    monkeypatch.setattr(disk_cache, "EVICT_EVERY", 5)
+    monkeypatch.setattr(disk_cache, "TOUCH_SECONDS", -1)
+    cache = DiskCache(path, "model", max_entries=3)
+    for key in range(4):
+        cache.put(key, key)
+    #Key 0 is read, 1 becomes the least recently used
+    assert cache.get(0) == 0
+    cache.put(4, 4)
+    assert cache.stats()["entries"] == 3
+    assert cache.get(1) is None
+    assert cache.get(2) is None
+    assert [cache.get(key) for key in (0, 3, 4)] == [0, 3, 4]
+
+
+def test_clear(path):
+    cache = DiskCache(path, "model")
+    cache.put("key", "value")
+    cache.clear()
+    assert cache.get("key") is None
@@ -0,0 +1,67 @@
+import asyncio
+from sqlalchemy.exc import IntegrityError, OperationalError
+from data import guess_writer
+from data.guess_writer import GuessWriter, GUESSES_DROPPED
+
+
+class ScriptedWriter(GuessWriter):
+    """
+        flush() raises the next error from `errors` (None writes the rows)
+    """
+
+    def __init__(self, errors: list, max_queue: int):
+        super().__init__(max_items=10, interval_ms=5, max_queue=max_queue)
+        self.errors = errors
+        self.written = []
+
+    async def flush(self, rows: list[dict]):
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        self.written += rows
+
+
+def transient():
+    return OperationalError("INSERT", {}, Exception("connection lost"))
+
+
+def bad_row():
+    return IntegrityError("INSERT", {}, Exception("violates check constraint"))
+
+
+def write(writer: GuessWriter, rows: list[dict]):
+    async def scenario():
+        await writer._flush(rows)
+        while writer._retry_tasks:
+            await asyncio.gather(*writer._retry_tasks)
+    asyncio.run(scenario())
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(guess_writer, "GUESS_RETRY_SECONDS", 0)
+    writer = ScriptedWriter([transient(), transient()], max_queue=10)
+    rows = [{"clue": "leisure"}, {"clue": "emotion"}]
+    write(writer, rows)
+    assert writer.written == rows
+    assert writer.retrying == 0
+
+
+def test_split_rows_are_not_counted_twice_against_the_retry_capacity(monkeypatch):
+    monkeypatch.setattr(guess_writer, "GUESS_RETRY_SECONDS", 0)
+    #Whole batch: database down. Retry: a bad row, so it is split. First half: database
+    #down again, that half goes back to retrying with the whole batch no longer counted.
+    writer = ScriptedWriter([transient(), bad_row(), transient()], max_queue=4)
+    rows = [{"clue": clue} for clue in ("a", "b", "c", "d")]
+    before = GUESSES_DROPPED.get(reason="retry_full")
+    write(writer, rows)
+    assert GUESSES_DROPPED.get(reason="retry_full") == before
+    assert sorted(row["clue"] for row in writer.written) == ["a", "b", "c", "d"]
+    assert writer.retrying == 0
+
+
+def test_bad_rows_are_dropped_as_flush_errors():
+    writer = ScriptedWriter([bad_row()], max_queue=10)
+    before = GUESSES_DROPPED.get(reason="flush_error")
+    write(writer, [{"clue": "leisure"}])
+    assert GUESSES_DROPPED.get(reason="flush_error") == before + 1
+    assert writer.retrying == 0
@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from services import idempotency
+from services.idempotency import IdempotencyMiddleware
+
+app = FastAPI()
+app.add_middleware(IdempotencyMiddleware)
+calls = []
+
+
+@app.post("/guessselection")
+async def guess(request: Request):
+    body = await request.json()
+    calls.append(body)
+    await asyncio.sleep(0.01)
+    if body.get("fail"):
+        return JSONResponse({"detail": "model error"}, status_code=502)
+    return JSONResponse({"call": len(calls)}, headers={"X-AI-Backend": "model"})
+
+
+@app.post("/generatewordsandcluefromselection/stream")
+async def stream(request: Request):
+    body = await request.json()
+    calls.append(body)
+
+    async def events():
+        yield b"event: clue\ndata: \"leisure\"\n\n"
+        yield b"event: error\ndata: {}\n\n" if body.get("fail") else b"event: done\ndata: {}\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    """
+        In-memory idempotency_keys table
+    """
+    rows = {}
+
+    async def claim(session, key, fingerprint, pending_seconds):
+        if key in rows:
+            return False, rows[key]
+        rows[key] = SimpleNamespace(fingerprint=fingerprint, status="pending")
+        return True, None
+
+    async def get(session, key):
+        return rows.get(key)
+
+    async def complete(session, key, status, headers, body, ttl_seconds):
+        rows[key].__dict__.update(status="done", response_status=status, response_headers=headers, response_body=body)
+
+    async def release(session, key):
+        rows.pop(key, None)
+
+    calls.clear()
+    monkeypatch.setattr(idempotency, "SessionLocal", FakeSession)
+    monkeypatch.setattr(idempotency, "claim_idempotency_key", claim)
+    monkeypatch.setattr(idempotency, "get_idempotency_key", get)
+    monkeypatch.setattr(idempotency, "complete_idempotency_key", complete)
+    monkeypatch.setattr(idempotency, "release_idempotency_key", release)
+    return rows
+
+
+def post(*requests):
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.post(path, json=body, headers={"Idempotency-Key": key})
+                for path, body, key in requests
+            ))
+    return asyncio.run(scenario())
+
+
+def test_retry_gets_the_stored_response():
+    first, = post(("/guessselection", {"clue": "leisure"}, "k1"))
+    retry, = post(("/guessselection", {"clue": "leisure"}, "k1"))
+    assert calls == [{"clue": "leisure"}]
+    assert retry.json() == first.json() == {"call": 1}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.headers["x-ai-backend"] == "model"
+
+
+def test_concurrent_retry_attaches_to_the_running_attempt():
+    first, retry = post(("/guessselection", {"clue": "leisure"}, "k1"), ("/guessselection", {"clue": "leisure"}, "k1"))
+    assert len(calls) == 1
+    assert first.json() == retry.json()
+
+
+def test_key_reused_with_another_body_is_rejected():
+    post(("/guessselection", {"clue": "leisure"}, "k1"))
+    reused, = post(("/guessselection", {"clue": "emotion"}, "k1"))
+    assert reused.status_code == 422
+    assert len(calls) == 1
+
+
+def test_failed_attempt_is_not_stored(store):
+    failed, = post(("/guessselection", {"fail": True}, "k1"))
+    assert failed.status_code == 502
+    assert store == {}
+    post(("/guessselection", {"fail": True}, "k1"))
+    assert len(calls) == 2
+
+
+def test_stream_is_stored_unless_it_ended_in_an_error(store):
+    streamed, = post(("/generatewordsandcluefromselection/stream", {}, "k1"))
+    replayed, = post(("/generatewordsandcluefromselection/stream", {}, "k1"))
+    assert replayed.content == streamed.content
+    assert len(calls) == 1
+    post(("/generatewordsandcluefromselection/stream", {"fail": True}, "k2"))
+    assert len(store) == 1
+
+
+def test_requests_without_a_key_pass_through():
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            await client.post("/guessselection", json={"clue": "leisure"})
+            await client.post("/guessselection", json={"clue": "leisure"})
+    asyncio.run(scenario())
+    assert len(calls) == 2
@@ -0,0 +1,81 @@
+import asyncio
+from data import maintenance
+from data.maintenance import OrphanReaper
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+        self.rowcount = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.database.executed.append((sql, params))
+        if sql.startswith("SELECT max(id)"):
+            return FakeResult(self.database.max_id)
+        #One orphan per batch
+        return FakeResult(1)
+
+
+class FakeEngine:
+    def __init__(self, max_id: int):
+        self.max_id = max_id
+        self.executed = []
+
+    def begin(self):
+        return FakeConnection(self)
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+def reap(monkeypatch, max_id: int, detached: list, **kwargs):
+    database = FakeEngine(max_id)
+
+    async def list_detached(conn):
+        return detached
+
+    monkeypatch.setattr(maintenance, "engine", database)
+    monkeypatch.setattr(maintenance, "list_detached_partitions", list_detached)
+    monkeypatch.setattr(maintenance, "ORPHAN_BATCH", 10)
+    reaper = OrphanReaper()
+    return reaper, asyncio.run(reaper.reap(**kwargs)), database
+
+
+def test_reaper_walks_the_id_range_in_batches(monkeypatch):
+    reaper, reaped, database = reap(monkeypatch, 25, [], max_batches=2)
+    batches = [params for sql, params in database.executed if sql.startswith("WITH orphans")]
+    assert [(params["after"], params["upto"]) for params in batches] == [(0, 10), (10, 20)]
+    assert reaped["orphans"] == 2
+    assert reaped["remaining_ids"] == 5
+    assert reaper.scanned_upto == 20
+
+
+def test_reaper_does_nothing_while_a_partition_is_detached(monkeypatch):
+    reaper, reaped, database = reap(monkeypatch, 25, [("clues_p202401", "exported")])
+    assert reaped["orphans"] == 0
+    assert reaped["skipped"] == "detached partitions"
+    assert not any(sql.startswith("WITH orphans") for sql, params in database.executed)
+    assert reaper.scanned_upto == 0
+
+
+def test_dry_run_counts_without_moving_on(monkeypatch):
+    reaper, reaped, database = reap(monkeypatch, 15, [], dry_run=True, max_batches=None)
+    assert reaped["orphans"] == 2
+    assert any(sql.startswith("SELECT count(*)") for sql, params in database.executed)
+    assert not any(sql.startswith("WITH orphans") for sql, params in database.executed)
+    assert reaper.scanned_upto == 0
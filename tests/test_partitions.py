@@ -0,0 +1,83 @@
+import asyncio
+from datetime import date
+from sqlalchemy import create_mock_engine
+from data import partitions
+from data.models import Clue
+
+
+def test_partitioned_table_is_created_without_the_sequence():
+    statements = []
+    mock = create_mock_engine("postgresql+asyncpg://", lambda sql, *args, **kwargs: statements.append(str(sql.compile(dialect=mock.dialect)).strip()))
+    partitions.create_partitioned_clues(mock)
+    assert not any(statement.startswith("CREATE SEQUENCE") for statement in statements)
+    assert statements[0].startswith("CREATE TABLE clues (")
+    assert statements[0].endswith("PARTITION BY RANGE (created_at)")
+    assert "CREATE INDEX ix_clues_connection_id ON clues (connection_id)" in statements
+
+
+def test_legacy_table_gives_up_every_name_the_new_table_uses():
+    renames = partitions.legacy_renames()
+    for index in Clue.__table__.indexes:
+        assert f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name.replace('clues', 'clues_legacy', 1)}" in renames
+    assert "ALTER TABLE clues_legacy RENAME CONSTRAINT clues_pkey TO clues_legacy_pkey" in renames
+
+
+class FakeResult:
+    rowcount = 0
+
+
+class FakeConnection:
+    def __init__(self, executed: list):
+        self.executed = executed
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        self.executed.append(" ".join(str(statement).split()))
+        return FakeResult()
+
+
+class FakeEngine:
+    def __init__(self):
+        self.executed = []
+
+    def begin(self):
+        return FakeConnection(self.executed)
+
+    def connect(self):
+        return FakeConnection(self.executed)
+
+
+def test_exported_partition_is_finished_without_detaching_or_exporting_again(tmp_path, monkeypatch):
+    fake = FakeEngine()
+    monkeypatch.setattr(partitions, "engine", fake)
+    exported = asyncio.run(partitions.archive_partition("clues_p202401", tmp_path, state="exported"))
+    assert exported == {}
+    assert not any("DETACH" in statement or "COMMENT" in statement for statement in fake.executed)
+    assert fake.executed[0].startswith("DELETE FROM clue_alternates")
+    assert fake.executed[-1] == "DROP TABLE clues_p202401"
+
+
+def test_retention_resumes_detached_partitions_first(tmp_path, monkeypatch):
+    archived = []
+
+    async def detached(conn):
+        return [("clues_p202312", "exported"), ("clues_p202401", None)]
+
+    async def attached(conn):
+        return [("clues_p202402", date(2024, 2, 1)), (partitions.partition_name(date.today()), date.today().replace(day=1))]
+
+    async def archive(name, archive_dir=partitions.ARCHIVE_DIR, state=None):
+        archived.append((name, state))
+        return {}
+
+    monkeypatch.setattr(partitions, "engine", FakeEngine())
+    monkeypatch.setattr(partitions, "list_detached_partitions", detached)
+    monkeypatch.setattr(partitions, "list_partitions", attached)
+    monkeypatch.setattr(partitions, "archive_partition", archive)
+    assert asyncio.run(partitions.apply_retention(1)) == ["clues_p202312", "clues_p202401", "clues_p202402"]
+    assert archived == [("clues_p202312", "exported"), ("clues_p202401", "detached"), ("clues_p202402", None)]
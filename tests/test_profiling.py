@@ -0,0 +1,31 @@
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+from authentication import auth
+from services.profiling import ProfilingMiddleware
+
+app = FastAPI()
+app.add_middleware(ProfilingMiddleware)
+
+
+@app.get("/clue")
+async def clue(response: Response):
+    response.headers["X-AI-Backend"] = "cache"
+    response.headers["ETag"] = '"abc"'
+    return {"clue": "leisure"}
+
+
+def test_profiled_response_keeps_the_endpoint_headers(monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_KEY_CHECK", "secret")
+    response = TestClient(app).get("/clue", headers={"X-Debug-Profile": "1", "X-Admin-Key": "secret"})
+    assert response.status_code == 200
+    assert response.json()["response"] == {"clue": "leisure"}
+    assert response.headers["x-ai-backend"] == "cache"
+    assert response.headers["etag"] == '"abc"'
+    assert response.headers["content-length"] == str(len(response.content))
+    assert response.headers["x-debug-sql-count"] == "0"
+
+
+def test_profiling_needs_the_admin_key(monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_KEY_CHECK", "secret")
+    response = TestClient(app).get("/clue", headers={"X-Debug-Profile": "1", "X-Admin-Key": "wrong"})
+    assert response.status_code == 401
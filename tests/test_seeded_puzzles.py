@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from services import seeded_puzzles
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    #Nothing stored yet
+    async def get_seeded_puzzle(session, seed):
+        return None
+
+    monkeypatch.setattr(seeded_puzzles, "SessionLocal", FakeSession)
+    monkeypatch.setattr(seeded_puzzles, "get_seeded_puzzle", get_seeded_puzzle)
+    monkeypatch.setattr(seeded_puzzles, "_cache", type(seeded_puzzles._cache)())
+
+
+def test_failed_generation_releases_the_seed_lock(stored, monkeypatch):
+    async def generate(seed, limited):
+        raise seeded_puzzles.SeedLimitReached("over the cap")
+
+    monkeypatch.setattr(seeded_puzzles, "_generate", generate)
+    with pytest.raises(seeded_puzzles.SeedLimitReached):
+        asyncio.run(seeded_puzzles.get_seeded_puzzle_response("failing", limited=True))
+    assert "failing" not in seeded_puzzles._locks
+
+
+def test_concurrent_requests_generate_once(stored, monkeypatch):
+    calls = []
+
+    async def generate(seed, limited):
+        calls.append((seed, limited))
+        await asyncio.sleep(0.01)
+        return '{"clue": "leisure"}'
+
+    async def scenario():
+        return await asyncio.gather(*(seeded_puzzles.get_seeded_puzzle_response("shared") for _ in range(3)))
+
+    monkeypatch.setattr(seeded_puzzles, "_generate", generate)
+    puzzles = asyncio.run(scenario())
+    assert calls == [("shared", False)]
+    assert {puzzle.body for puzzle in puzzles} == {b'{"clue": "leisure"}'}
+    assert "shared" not in seeded_puzzles._locks
@@ -0,0 +1,85 @@
+import json
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from services.wire_format import (
+    MsgPackMiddleware,
+    accepts_msgpack,
+    compact_words,
+    expand_words,
+    json_to_msgpack,
+    msgpack_to_json,
+)
+
+#Optional dependency, without it the middleware leaves everything JSON
+msgpack = pytest.importorskip("msgpack")
+
+WORDS = [{"id": 992, "word": "golf", "selected": True}, {"id": 747, "word": "budget", "selected": None}]
+
+app = FastAPI()
+app.add_middleware(MsgPackMiddleware)
+
+
+@app.get("/clue")
+async def clue(request: Request, response: Response):
+    if request.headers.get("if-none-match") == '"v1"':
+        return Response(status_code=304, headers={"ETag": '"v1"'})
+    response.headers["ETag"] = '"v1"'
+    return {"clue": "leisure", "words": WORDS}
+
+
+@app.post("/echo")
+async def echo(request: Request):
+    return await request.json()
+
+
+client = TestClient(app)
+
+
+def test_word_lists_round_trip_compactly():
+    document = {"clue": "leisure", "words": WORDS, "nested": [{"words": WORDS[:1]}]}
+    assert compact_words(document)["words"] == [[992, "golf", True], [747, "budget", None]]
+    assert expand_words(compact_words(document)) == document
+    assert json.loads(msgpack_to_json(json_to_msgpack(json.dumps(document).encode()))) == document
+
+
+def test_other_lists_are_left_alone():
+    assert compact_words([{"id": 1, "word": "golf", "rank": 2}]) == [{"id": 1, "word": "golf", "rank": 2}]
+    assert expand_words([[1, "a"], ["b", 2]]) == [[1, "a"], ["b", 2]]
+
+
+def test_accept_negotiation():
+    assert accepts_msgpack("application/msgpack")
+    assert accepts_msgpack("application/json;q=0.5, application/msgpack;q=0.9")
+    assert not accepts_msgpack("application/msgpack;q=0")
+    assert not accepts_msgpack("application/json")
+    assert not accepts_msgpack("")
+
+
+def test_msgpack_response_with_its_own_etag():
+    response = client.get("/clue", headers={"Accept": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    assert response.headers["etag"] == '"v1-mp"'
+    assert response.headers["vary"] == "Accept"
+    assert msgpack.unpackb(response.content) == {"clue": "leisure", "words": [[992, "golf", True], [747, "budget", None]]}
+    revalidated = client.get("/clue", headers={"Accept": "application/msgpack", "If-None-Match": '"v1-mp"'})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == '"v1-mp"'
+
+
+def test_json_responses_vary_on_accept():
+    response = client.get("/clue")
+    assert response.json()["words"] == WORDS
+    assert response.headers["vary"] == "Accept"
+    assert client.get("/clue", headers={"If-None-Match": '"v1"'}).headers["vary"] == "Accept"
+
+
+def test_msgpack_request_body_in_either_form():
+    for words in (WORDS, [[992, "golf", True], [747, "budget", None]]):
+        response = client.post("/echo", content=msgpack.packb({"words": words}), headers={"Content-Type": "application/msgpack"})
+        assert response.json() == {"words": WORDS}
+
+
+def test_invalid_msgpack_body_is_rejected():
+    response = client.post("/echo", content=b"\xc1", headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 400
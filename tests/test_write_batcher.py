@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+from data.write_batcher import Batcher
+
+
+class RecordingBatcher(Batcher):
+    name = "test"
+
+    def __init__(self, error: Exception):
+        super().__init__(max_items=10, interval_ms=5)
+        self.error = error
+        self.written = []
+        self.failures = []
+
+    async def flush(self, items: list):
+        if "bad" in items or "down" in items:
+            raise self.error
+        self.written += items
+
+    def failed(self, items: list, error: Exception):
+        self.failures += items
+
+
+def write(batcher: Batcher, items: list):
+    async def scenario():
+        batcher.start()
+        for item in items:
+            await batcher.queue.put(item)
+        await batcher.stop()
+    asyncio.run(scenario())
+
+
+def test_only_the_bad_item_fails():
+    batcher = RecordingBatcher(IntegrityError("INSERT", {}, Exception("duplicate key")))
+    write(batcher, ["a", "b", "bad", "c", "d", "e"])
+    assert batcher.written == ["a", "b", "c", "d", "e"]
+    assert batcher.failures == ["bad"]
+
+
+def test_transient_errors_fail_the_batch_without_splitting():
+    batcher = RecordingBatcher(OperationalError("INSERT", {}, Exception("connection lost")))
+    flushes = []
+    flush = batcher.flush
+
+    async def counting_flush(items):
+        flushes.append(list(items))
+        await flush(items)
+
+    batcher.flush = counting_flush
+    write(batcher, ["a", "down", "b"])
+    assert flushes == [["a", "down", "b"]]
+    assert batcher.failures == ["a", "down", "b"]
+
+
+def test_flush_is_abstract():
+    with pytest.raises(TypeError):
+        Batcher(10, 5)